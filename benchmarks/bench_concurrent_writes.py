@@ -0,0 +1,167 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Name:
+        bench_concurrent_writes.py
+    Description:
+        Stress the settings file with N writer processes, each changing
+        its own setting over and over and saving after every change, with
+        and without concurrent_writes. Without it the last save wins, so
+        writers overwrite each other's settings with the stale copies they
+        loaded. With it every change survives, at the cost of a lock file
+        and re-reading the file after another process's save.
+
+        python benchmarks/bench_concurrent_writes.py
+        python benchmarks/bench_concurrent_writes.py --writers 8 --saves 50
+    Version:
+        1 - Initial release
+    Author:
+        J.MacGrillen <macgrillen@gmail.com>
+    Copyright:
+        Copyright (c) John MacGrillen. All rights reserved.
+"""
+import os
+import time
+import argparse
+import tempfile
+import multiprocessing
+import yaml
+from maclib.mac_settings import MacSettingsStore
+
+
+def create_store(work_dir: str, concurrent_writes: bool) -> MacSettingsStore:
+    """
+    Create a settings store for the shared settings file.
+
+    Args:
+        work_dir (str):
+            The directory holding the settings files.
+        concurrent_writes (bool):
+            Whether to use the lock file.
+
+    Returns:
+        MacSettingsStore:
+            The loaded settings store.
+    """
+    settings_store = MacSettingsStore(
+        app_name="bench_app",
+        default_settings_path=os.path.join(work_dir, "defaults.yaml"),
+        settings_file_path=os.path.join(work_dir, "bench_app.yaml"),
+        watch=False,
+        concurrent_writes=concurrent_writes,
+    )
+    settings_store.load_settings()
+    return settings_store
+
+
+def write_settings(
+    work_dir: str,
+    concurrent_writes: bool,
+    writer: int,
+    saves: int,
+    barrier,
+) -> None:
+    """
+    A writer process, which counts its own setting up to saves, saving
+    each time.
+
+    Args:
+        work_dir (str):
+            The directory holding the settings files.
+        concurrent_writes (bool):
+            Whether to use the lock file.
+        writer (int):
+            The number of this writer.
+        saves (int):
+            The number of changes to save.
+        barrier (Barrier):
+            Starts every writer at the same time.
+    """
+    settings_store = create_store(work_dir, concurrent_writes)
+    barrier.wait()
+    for count in range(1, saves + 1):
+        settings_store["writers", f"writer{writer}"] = count
+    settings_store.close()
+
+
+def bench_writers(writers: int, saves: int, concurrent_writes: bool) -> dict:
+    """
+    Run the writers against a fresh settings file.
+
+    Args:
+        writers (int):
+            The number of writer processes.
+        saves (int):
+            The number of changes each writer saves.
+        concurrent_writes (bool):
+            Whether to use the lock file.
+
+    Returns:
+        dict:
+            The seconds taken, the saves per second, and the number of
+            writers whose final count was lost.
+    """
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as work_dir:
+        settings = {
+            "writers": {f"writer{writer}": 0 for writer in range(writers)}
+        }
+        for file_name in ("defaults.yaml", "bench_app.yaml"):
+            with open(os.path.join(work_dir, file_name), "w") as file:
+                yaml.safe_dump(settings, file)
+        barrier = context.Barrier(writers + 1)
+        processes = [
+            context.Process(
+                target=write_settings,
+                args=(work_dir, concurrent_writes, writer, saves, barrier),
+            )
+            for writer in range(writers)
+        ]
+        for process in processes:
+            process.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+        with open(os.path.join(work_dir, "bench_app.yaml")) as file:
+            final_settings = yaml.safe_load(file)
+    lost = sum(
+        final_settings["writers"].get(f"writer{writer}") != saves
+        for writer in range(writers)
+    )
+    return {
+        "seconds": elapsed,
+        "saves_per_second": writers * saves / elapsed,
+        "lost": lost,
+    }
+
+
+def run_benchmarks() -> None:
+    """
+    Compare writers with and without concurrent_writes.
+    """
+    parser = argparse.ArgumentParser(
+        description="Stress concurrent writers of a settings file."
+    )
+    parser.add_argument("--writers", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--saves", type=int, default=100)
+    options = parser.parse_args()
+    print(f"{options.saves} saves per writer:")
+    print("  writers  concurrent_writes  saves/s  writers' final count lost")
+    for writers in options.writers:
+        for concurrent_writes in (False, True):
+            results = bench_writers(
+                writers=writers,
+                saves=options.saves,
+                concurrent_writes=concurrent_writes,
+            )
+            print(
+                f"  {writers:>7}  {str(concurrent_writes):>17}"
+                f" {results['saves_per_second']:>8.0f}"
+                f"  {results['lost']:>3} of {writers}"
+            )
+
+
+if __name__ == "__main__":
+    run_benchmarks()
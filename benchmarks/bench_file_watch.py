@@ -0,0 +1,145 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Name:
+        bench_file_watch.py
+    Description:
+        Benchmark the file watchers in maclib.mac_file_watch. For each
+        backend this measures how long it takes to spot a change, and how
+        much CPU the process uses while watching idle files.
+
+        python benchmarks/bench_file_watch.py
+    Version:
+        1 - Initial release
+    Author:
+        J.MacGrillen <macgrillen@gmail.com>
+    Copyright:
+        Copyright (c) John MacGrillen. All rights reserved.
+"""
+import os
+import sys
+import time
+import tempfile
+import statistics
+from threading import Event
+from watchdog.events import FileSystemEventHandler
+from maclib.mac_file_watch import (
+    MacInotifyWatcher,
+    MacPollWatcher,
+    MacWatchdogWatcher,
+)
+
+
+class TimingHandler(FileSystemEventHandler):
+    """
+    Record when the last change event arrived.
+    """
+
+    def __init__(self) -> None:
+        self.changed = Event()
+        self.changed_at = 0.0
+
+    def on_modified(self, event) -> None:
+        self.changed_at = time.perf_counter()
+        self.changed.set()
+
+
+def bench_latency(file_watcher, work_dir: str, changes: int = 20) -> list:
+    """
+    Time from writing a file to the watcher reporting the change.
+
+    Args:
+        file_watcher (MacFileWatcher):
+            The watcher to time.
+        work_dir (str):
+            A scratch directory for the watched file.
+        changes (int):
+            The number of changes to time.
+
+    Returns:
+        list:
+            The latency of each change in seconds.
+    """
+    watched_path = os.path.join(work_dir, "latency.yaml")
+    with open(watched_path, "w") as watched_file:
+        watched_file.write("value: 0\n")
+    handler = TimingHandler()
+    file_watcher.watch(path=watched_path, handler=handler)
+    latencies = []
+    for change in range(changes):
+        handler.changed.clear()
+        written_at = time.perf_counter()
+        with open(watched_path, "w") as watched_file:
+            watched_file.write(f"value: {change + 1}\n")
+        if handler.changed.wait(5):
+            latencies.append(handler.changed_at - written_at)
+        time.sleep(0.02)
+    file_watcher.unwatch(path=watched_path, handler=handler)
+    return latencies
+
+
+def bench_idle_cpu(
+    file_watcher, work_dir: str, files: int = 100, seconds: float = 2.0
+) -> float:
+    """
+    Measure the CPU time used while watching files that don't change.
+
+    Args:
+        file_watcher (MacFileWatcher):
+            The watcher to measure.
+        work_dir (str):
+            A scratch directory for the watched files.
+        files (int):
+            The number of files to watch.
+        seconds (float):
+            How long to watch for.
+
+    Returns:
+        float:
+            The CPU seconds used per second of watching.
+    """
+    handler = TimingHandler()
+    watched_paths = []
+    for count in range(files):
+        watched_path = os.path.join(work_dir, f"idle{count}.yaml")
+        with open(watched_path, "w") as watched_file:
+            watched_file.write("value: 0\n")
+        file_watcher.watch(path=watched_path, handler=handler)
+        watched_paths.append(watched_path)
+    cpu_start = time.process_time()
+    time.sleep(seconds)
+    cpu_used = time.process_time() - cpu_start
+    for watched_path in watched_paths:
+        file_watcher.unwatch(path=watched_path, handler=handler)
+    return cpu_used / seconds
+
+
+def run_benchmarks() -> None:
+    """
+    Benchmark every watcher available on this platform.
+    """
+    backends = {
+        "watchdog": MacWatchdogWatcher,
+        "poll (50 ms)": lambda: MacPollWatcher(interval_ms=50),
+        "poll (500 ms)": lambda: MacPollWatcher(interval_ms=500),
+    }
+    if sys.platform.startswith("linux"):
+        backends["inotify"] = MacInotifyWatcher
+    print("Backend          latency median/max (ms)  idle CPU, 100 files")
+    for name, create_watcher in backends.items():
+        file_watcher = create_watcher()
+        with tempfile.TemporaryDirectory() as work_dir:
+            latencies = bench_latency(file_watcher, work_dir)
+            idle_cpu = bench_idle_cpu(file_watcher, work_dir)
+        file_watcher.stop()
+        if latencies:
+            median = statistics.median(latencies) * 1e3
+            slowest = max(latencies) * 1e3
+            latency = f"{median:8.2f} / {slowest:8.2f}"
+        else:
+            latency = "no changes seen"
+        print(f"{name:<16} {latency:>24}  {idle_cpu * 100:8.3f} %")
+
+
+if __name__ == "__main__":
+    run_benchmarks()
@@ -0,0 +1,43 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Name:
+        bench_helpers.py
+    Description:
+        Helpers shared by the benchmarks, which import it from the
+        benchmarks directory when run as scripts.
+
+        from bench_helpers import generate_settings
+    Version:
+        1 - Initial release
+    Author:
+        J.MacGrillen <macgrillen@gmail.com>
+    Copyright:
+        Copyright (c) John MacGrillen. All rights reserved.
+"""
+
+
+def generate_settings(width: int, depth: int) -> dict:
+    """
+    Generate a settings tree with the given number of keys per level.
+
+    Args:
+        width (int):
+            The number of keys at each level.
+        depth (int):
+            The number of levels in the tree.
+
+    Returns:
+        dict:
+            The generated settings.
+    """
+    if depth == 1:
+        return {f"key{i}": f"value{i}" for i in range(width)}
+    return {
+        f"section{i}": generate_settings(width=width, depth=depth - 1)
+        for i in range(width)
+    }
+
+
+if __name__ == "__main__":  # pragma: no cover
+    pass
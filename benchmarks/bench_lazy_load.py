@@ -0,0 +1,132 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Name:
+        bench_lazy_load.py
+    Description:
+        Compare loading a settings file with large lookup tables eagerly
+        against loading it lazily, where each top level section is only
+        parsed when it's first used. Measures the time and memory to load,
+        a lookup in a small section, and the first and later lookups in
+        a lookup table.
+
+        python benchmarks/bench_lazy_load.py
+    Version:
+        1 - Initial release
+    Author:
+        J.MacGrillen <macgrillen@gmail.com>
+    Copyright:
+        Copyright (c) John MacGrillen. All rights reserved.
+"""
+import gc
+import os
+import time
+import tempfile
+import tracemalloc
+import yaml
+from maclib.mac_settings import MacSettingsStore
+
+
+def generate_settings(tables: int, entries: int) -> dict:
+    """
+    Build settings with a few small sections and some large lookup tables.
+
+    Args:
+        tables (int):
+            The number of lookup tables.
+        entries (int):
+            The number of entries in each lookup table.
+
+    Returns:
+        dict:
+            The settings.
+    """
+    settings = {
+        f"section{section}": {f"key{key}": key for key in range(10)}
+        for section in range(10)
+    }
+    for table in range(tables):
+        settings[f"table{table}"] = {
+            f"entry{entry}": {"code": entry, "name": f"name {entry}"}
+            for entry in range(entries)
+        }
+    return settings
+
+
+def bench_load(work_dir: str, lazy_load: bool) -> dict:
+    """
+    Load the settings and use them, timing each step.
+
+    Args:
+        work_dir (str):
+            The directory holding the settings files.
+        lazy_load (bool):
+            Whether to load the settings lazily.
+
+    Returns:
+        dict:
+            The timings in milliseconds and the memory in KB.
+    """
+    settings_store = MacSettingsStore(
+        app_name="bench_app",
+        default_settings_path=os.path.join(work_dir, "defaults.yaml"),
+        settings_file_path=os.path.join(work_dir, "bench_app.yaml"),
+        watch=False,
+        lazy_load=lazy_load,
+    )
+    start = time.perf_counter()
+    settings_store.load_settings()
+    load_time = time.perf_counter() - start
+    # Tracing slows everything down, so measure the memory on its own.
+    gc.collect()
+    tracemalloc.start()
+    settings_store.load_settings()
+    gc.collect()
+    memory_used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    settings_store["section3", "key4"]
+    section_time = time.perf_counter() - start
+    start = time.perf_counter()
+    settings_store["table0", "entry5", "name"]
+    first_time = time.perf_counter() - start
+    start = time.perf_counter()
+    settings_store["table0", "entry6", "name"]
+    second_time = time.perf_counter() - start
+    settings_store.close()
+    return {
+        "load_ms": load_time * 1e3,
+        "load_kb": memory_used / 1024,
+        "section_ms": section_time * 1e3,
+        "first_table_ms": first_time * 1e3,
+        "table_ms": second_time * 1e3,
+    }
+
+
+def run_benchmarks() -> None:
+    """
+    Compare eager and lazy loading with increasingly large tables.
+    """
+    print(
+        "entries  mode    load (ms)  load (KB)  section (ms)"
+        "  1st table (ms)  table (ms)"
+    )
+    for entries in (1000, 10000, 50000):
+        with tempfile.TemporaryDirectory() as work_dir:
+            with open(os.path.join(work_dir, "defaults.yaml"), "w") as file:
+                yaml.safe_dump(generate_settings(3, entries), file)
+            with open(os.path.join(work_dir, "bench_app.yaml"), "w") as file:
+                yaml.safe_dump(generate_settings(3, entries), file)
+            for lazy_load in (False, True):
+                results = bench_load(work_dir=work_dir, lazy_load=lazy_load)
+                print(
+                    f"{entries:>7}  {'lazy' if lazy_load else 'eager':<6}"
+                    f" {results['load_ms']:>10.1f} {results['load_kb']:>10.0f}"
+                    f" {results['section_ms']:>13.3f}"
+                    f" {results['first_table_ms']:>15.1f}"
+                    f" {results['table_ms']:>11.3f}"
+                )
+
+
+if __name__ == "__main__":
+    run_benchmarks()
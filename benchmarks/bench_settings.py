@@ -0,0 +1,24 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Name:
+        bench_settings.py
+    Description:
+        Run the benchmark suite along with its comparisons of each
+        optimisation against what it replaced. Takes the same arguments
+        as bench_suite.py.
+
+        python benchmarks/bench_settings.py
+    Version:
+        1 - Initial release
+    Author:
+        J.MacGrillen <macgrillen@gmail.com>
+    Copyright:
+        Copyright (c) John MacGrillen. All rights reserved.
+"""
+import sys
+from bench_suite import main
+
+
+if __name__ == "__main__":
+    main(["--compare"] + sys.argv[1:])
@@ -0,0 +1,126 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Name:
+        bench_settings_manager.py
+    Description:
+        Benchmark holding many settings stores in one MacSettingsManager.
+        For an increasing number of settings files this measures the time
+        to open (create and load) them all, the memory used per store, and
+        the number of threads the process ends up with.
+
+        python benchmarks/bench_settings_manager.py
+    Version:
+        1 - Initial release
+    Author:
+        J.MacGrillen <macgrillen@gmail.com>
+    Copyright:
+        Copyright (c) John MacGrillen. All rights reserved.
+"""
+import gc
+import os
+import sys
+import time
+import tempfile
+import threading
+import tracemalloc
+import yaml
+from maclib.mac_settings_manager import MacSettingsManager
+
+
+def generate_settings(sections: int = 10, keys: int = 10) -> dict:
+    """
+    Build a settings tree of a typical size for a tenant.
+
+    Args:
+        sections (int):
+            The number of top level sections.
+        keys (int):
+            The number of settings in each section.
+
+    Returns:
+        dict:
+            The settings tree.
+    """
+    return {
+        f"section{section}": {
+            f"key{key}": f"value {section}.{key}" for key in range(keys)
+        }
+        for section in range(sections)
+    }
+
+
+def bench_stores(store_count: int, watch: str) -> dict:
+    """
+    Open store_count settings stores and measure the cost.
+
+    Args:
+        store_count (int):
+            The number of settings files to open.
+        watch (str):
+            The file watcher to share between the stores.
+
+    Returns:
+        dict:
+            The open time, memory per store and thread count.
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        default_file = os.path.join(work_dir, "defaults.yaml")
+        with open(default_file, "w") as settings_file:
+            yaml.safe_dump(generate_settings(), settings_file)
+        settings_manager = MacSettingsManager(
+            settings_directory=os.path.join(work_dir, "tenants"),
+            default_settings_path=default_file,
+            watch=watch,
+        )
+        # Open one up front, so one off imports and the shared watcher
+        # aren't counted against the stores.
+        settings_manager.open("warm_up")
+        gc.collect()
+        tracemalloc.start()
+        memory_start = tracemalloc.get_traced_memory()[0]
+        open_start = time.perf_counter()
+        for tenant in range(store_count):
+            settings_manager.open(f"tenant{tenant}")
+        open_time = time.perf_counter() - open_start
+        gc.collect()
+        memory_used = tracemalloc.get_traced_memory()[0] - memory_start
+        tracemalloc.stop()
+        thread_count = threading.active_count()
+        settings_manager.close_all()
+    return {
+        "open_ms": open_time * 1e3,
+        "open_per_store_ms": open_time * 1e3 / store_count,
+        "kb_per_store": memory_used / 1024 / store_count,
+        "threads": thread_count,
+    }
+
+
+def run_benchmarks() -> None:
+    """
+    Benchmark managers with an increasing number of settings files.
+    """
+    watchers = ["poll"]
+    if sys.platform.startswith("linux"):
+        watchers.append("inotify")
+    watchers.append("watchdog")
+    print(
+        "Watcher    stores   open (ms)  per store (ms)  KB/store  threads"
+    )
+    for watch in watchers:
+        for store_count in (10, 100, 500):
+            if watch == "watchdog" and store_count > 100:
+                # watchdog needs an inotify instance per file on Linux,
+                # and the default limit is 128.
+                continue
+            results = bench_stores(store_count=store_count, watch=watch)
+            print(
+                f"{watch:<10} {store_count:>6} {results['open_ms']:>11.1f}"
+                f" {results['open_per_store_ms']:>15.3f}"
+                f" {results['kb_per_store']:>9.1f}"
+                f" {results['threads']:>8}"
+            )
+
+
+if __name__ == "__main__":
+    run_benchmarks()
@@ -0,0 +1,145 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Name:
+        bench_storage.py
+    Description:
+        Compare the settings storage backends in maclib.mac_storage. For
+        each backend this times loading the settings, looking a setting
+        up, and changing a setting (including saving it).
+
+        python benchmarks/bench_storage.py
+    Version:
+        1 - Initial release
+    Author:
+        J.MacGrillen <macgrillen@gmail.com>
+    Copyright:
+        Copyright (c) John MacGrillen. All rights reserved.
+"""
+import os
+import tempfile
+import timeit
+import yaml
+from bench_helpers import generate_settings
+from maclib.mac_settings import MacSettingsStore
+
+
+def toml_document(settings: dict, table: tuple = ()) -> str:
+    """
+    Write settings of nested sections with string values as TOML, as the
+    standard library can only read TOML.
+
+    Args:
+        settings (dict):
+            The settings.
+        table (tuple):
+            The key path of the table being written.
+
+    Returns:
+        str:
+            The TOML.
+    """
+    lines = []
+    if table:
+        lines.append(f"[{'.'.join(table)}]")
+    sections = []
+    for key, value in settings.items():
+        if isinstance(value, dict):
+            sections.append((key, value))
+        else:
+            lines.append(f'{key} = "{value}"')
+    document = "\n".join(lines) + "\n"
+    for key, value in sections:
+        document += toml_document(value, table + (key,))
+    return document
+
+
+def bench_backend(
+    work_dir: str, settings: dict, depth: int, storage: str, iterations: int
+) -> dict:
+    """
+    Time loading, getting and setting for one backend.
+
+    Args:
+        work_dir (str):
+            A scratch directory for the settings files.
+        settings (dict):
+            The settings to store.
+        depth (int):
+            The number of levels in the settings.
+        storage (str):
+            The storage backend.
+        iterations (int):
+            The number of times to repeat each measurement.
+
+    Returns:
+        dict:
+            The load and set times in milliseconds, and the get time in
+            nanoseconds.
+    """
+    default_path = os.path.join(work_dir, "defaults.yaml")
+    with open(default_path, "w") as default_file:
+        yaml.safe_dump(settings, default_file)
+    extension = {"sqlite": "db"}.get(storage, storage)
+    settings_path = os.path.join(work_dir, f"bench_{storage}.{extension}")
+    if storage == "toml":
+        with open(settings_path, "w") as settings_file:
+            settings_file.write(toml_document(settings))
+    settings_store = MacSettingsStore(
+        app_name="bench_app",
+        default_settings_path=default_path,
+        settings_file_path=settings_path,
+        storage=storage,
+        watch=False,
+    )
+    load_time = timeit.timeit(settings_store.load_settings, number=iterations)
+    key_path = ("section1",) * (depth - 1) + ("key3",)
+    lookups = 100000
+    get_time = timeit.timeit(
+        lambda: settings_store[key_path], number=lookups
+    )
+    results = {
+        "load_ms": load_time * 1e3 / iterations,
+        "get_ns": get_time * 1e9 / lookups,
+        "set_ms": None,
+    }
+    if not settings_store.storage.read_only:
+        counter = iter(range(iterations * 2))
+
+        def set_setting():
+            settings_store[key_path] = f"changed {next(counter)}"
+
+        set_time = timeit.timeit(set_setting, number=iterations)
+        results["set_ms"] = set_time * 1e3 / iterations
+    settings_store.close()
+    return results
+
+
+def run_benchmarks() -> None:
+    """
+    Compare every backend at a few sizes of settings.
+    """
+    for width, depth in ((10, 2), (20, 3), (30, 3)):
+        settings = generate_settings(width=width, depth=depth)
+        print(f"{width ** depth} settings ({width} wide, {depth} deep):")
+        print("  backend     load (ms)   get (ns)   set (ms)")
+        for storage in ("yaml", "json", "toml", "sqlite"):
+            with tempfile.TemporaryDirectory() as work_dir:
+                results = bench_backend(
+                    work_dir=work_dir,
+                    settings=settings,
+                    depth=depth,
+                    storage=storage,
+                    iterations=5,
+                )
+            set_time = "read only"
+            if results["set_ms"] is not None:
+                set_time = f"{results['set_ms']:.3f}"
+            print(
+                f"  {storage:<10} {results['load_ms']:>10.3f}"
+                f" {results['get_ns']:>10.1f} {set_time:>10}"
+            )
+
+
+if __name__ == "__main__":
+    run_benchmarks()
@@ -0,0 +1,746 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Name:
+        bench_suite.py
+    Description:
+        A benchmark suite for maclib.mac_settings, for tracking performance
+        across versions. Generates settings of a given width and depth and
+        measures constructing a settings store, load_settings, __getitem__
+        with string and tuple keys, __contains__, __setitem__ (which saves
+        the file), reload_settings_from_file and dict_diff.
+
+        Each measurement is repeated and reported as the median, minimum
+        and maximum microseconds per operation. With --json the results,
+        along with the parameters, Python version and platform, are
+        written out as JSON so runs from different versions can be
+        compared.
+
+        With --compare it also compares each optimisation against what
+        it replaced: the flattened path index against walking the tree
+        with functools.reduce, the recursive settings diff, the pure
+        Python YAML loader and dumper against libyaml, loading with and
+        without the compiled settings cache, routing a change to path
+        subscribers against every subscriber filtering it, the memory
+        held by each version kept in the settings history, get, get_many
+        and set_many against looking up and setting keys one at a time,
+        and reloading one changed fragment of the settings against
+        reloading them from a single file.
+
+        python benchmarks/bench_suite.py --width 10 --depth 3
+        python benchmarks/bench_suite.py --json results.json
+        python benchmarks/bench_suite.py --compare
+    Version:
+        1 - Initial release
+    Author:
+        J.MacGrillen <macgrillen@gmail.com>
+    Copyright:
+        Copyright (c) John MacGrillen. All rights reserved.
+"""
+import os
+import sys
+import copy
+import json
+import time
+import timeit
+import argparse
+import operator
+import platform
+import statistics
+import tempfile
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+from functools import reduce
+from importlib import metadata
+from threading import Lock
+from typing import Any, Callable, Optional
+import yaml
+from bench_helpers import generate_settings
+from maclib.mac_settings import (
+    MacSettings,
+    MacSettingsException,
+    MacSettingsPathRouter,
+    MacSettingsStore,
+    dict_diff,
+    dict_diff_paths,
+    replace_setting,
+    retained_size,
+)
+
+
+def measure(
+    operation: Callable[[], Any],
+    number: int,
+    repeat: int,
+    setup: Optional[Callable[[], Any]] = None,
+) -> dict:
+    """
+    Time an operation, repeating the measurement to smooth out noise.
+
+    Args:
+        operation (Callable):
+            The operation to time.
+        number (int):
+            The number of times to run the operation in each repeat.
+        repeat (int):
+            The number of repeats.
+        setup (Callable):
+            Run, untimed, before every run of the operation.
+
+    Returns:
+        dict:
+            The median, minimum and maximum microseconds per operation
+            across the repeats, and the number of operations timed.
+    """
+    per_operation = []
+    for _ in range(repeat):
+        elapsed = 0.0
+        if setup is None:
+            start = time.perf_counter()
+            for _ in range(number):
+                operation()
+            elapsed = time.perf_counter() - start
+        else:
+            for _ in range(number):
+                setup()
+                start = time.perf_counter()
+                operation()
+                elapsed += time.perf_counter() - start
+        per_operation.append(elapsed * 1e6 / number)
+    return {
+        "median_us": statistics.median(per_operation),
+        "min_us": min(per_operation),
+        "max_us": max(per_operation),
+        "operations": number * repeat,
+    }
+
+
+def run_suite(
+    width: int, depth: int, number: int, repeat: int, storage: str
+) -> dict:
+    """
+    Run every benchmark on generated settings.
+
+    Args:
+        width (int):
+            The number of keys at each level.
+        depth (int):
+            The number of levels in the tree.
+        number (int):
+            The number of lookups timed in each repeat. Slower operations,
+            which read or write the settings file, are run a tenth as
+            often.
+        repeat (int):
+            The number of repeats of each measurement.
+        storage (str):
+            The storage backend of the user's settings file.
+
+    Returns:
+        dict:
+            The results by benchmark name.
+    """
+    settings = generate_settings(width=width, depth=depth)
+    changed_settings = copy.deepcopy(settings)
+    leaf_path = tuple(f"section{width - 1}" for _ in range(depth - 1))
+    leaf_path = leaf_path + (f"key{width - 1}",)
+    changed_leaf = changed_settings
+    for key in leaf_path[:-1]:
+        changed_leaf = changed_leaf[key]
+    changed_leaf[leaf_path[-1]] = "changed"
+    missing_path = leaf_path[:-1] + ("missing",)
+    file_number = max(1, number // 10)
+    results: dict = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        default_path = os.path.join(work_dir, "defaults.yaml")
+        with open(default_path, "w") as default_file:
+            yaml.safe_dump(settings, default_file)
+        extension = {"sqlite": "db"}.get(storage, storage)
+        settings_path = os.path.join(work_dir, f"bench_app.{extension}")
+
+        def create_store() -> MacSettingsStore:
+            return MacSettingsStore(
+                app_name="bench_app",
+                default_settings_path=default_path,
+                settings_file_path=settings_path,
+                storage=storage,
+                watch=False,
+            )
+
+        results["construct"] = measure(
+            lambda: create_store().close(), file_number, repeat
+        )
+        settings_store = create_store()
+        results["load_settings"] = measure(
+            settings_store.load_settings, file_number, repeat
+        )
+        top_key = f"section{width - 1}" if depth > 1 else f"key{width - 1}"
+        dotted_key = ".".join(leaf_path)
+        results["getitem_str"] = measure(
+            lambda: settings_store[top_key], number, repeat
+        )
+        results["getitem_dotted"] = measure(
+            lambda: settings_store[dotted_key], number, repeat
+        )
+        results["getitem_tuple"] = measure(
+            lambda: settings_store[leaf_path], number, repeat
+        )
+        results["contains"] = measure(
+            lambda: leaf_path in settings_store, number, repeat
+        )
+        results["contains_missing"] = measure(
+            lambda: missing_path in settings_store, number, repeat
+        )
+        counter = iter(range(file_number * repeat))
+        results["setitem_save"] = measure(
+            lambda: settings_store.__setitem__(
+                leaf_path, f"value {next(counter)}"
+            ),
+            file_number,
+            repeat,
+        )
+        results["reload_unchanged"] = measure(
+            settings_store.reload_settings_from_file, file_number, repeat
+        )
+        # Alternate the file between two versions, so every reload sees a
+        # change and has to parse, merge and diff.
+        alternate = iter(range(file_number * repeat))
+
+        def change_file() -> None:
+            settings_store.storage.write(
+                settings_path,
+                changed_settings if next(alternate) % 2 else settings,
+            )
+
+        results["reload_changed"] = measure(
+            settings_store.reload_settings_from_file,
+            file_number,
+            repeat,
+            setup=change_file,
+        )
+        settings_store.close()
+    results["dict_diff"] = measure(
+        lambda: dict_diff(settings, changed_settings), file_number, repeat
+    )
+    return results
+
+
+def create_settings(
+    work_dir: str, settings: dict, **settings_args
+) -> MacSettings:
+    """
+    Create a MacSettings object whose files live in a scratch directory.
+
+    Args:
+        work_dir (str):
+            The scratch directory used as the home directory.
+        settings (dict):
+            The settings to write to the default settings file.
+        settings_args (dict):
+            Any extra MacSettings arguments.
+
+    Returns:
+        MacSettings:
+            The loaded settings object.
+    """
+    os.environ["HOME"] = work_dir
+    default_path = os.path.join(work_dir, "defaults.yaml")
+    with open(default_path, "w") as default_file:
+        yaml.safe_dump(settings, default_file)
+    MacSettings.clear()
+    settings_args.setdefault("watch", False)
+    mac_settings = MacSettings(
+        app_name="bench_app",
+        default_settings_path=default_path,
+        **settings_args,
+    )
+    mac_settings.load_settings()
+    return mac_settings
+
+
+def bench_lookups(width: int = 8, depth: int = 5, number: int = 100000):
+    """
+    Time tuple lookups through the index against the reduce walk.
+
+    Args:
+        width (int):
+            The number of keys at each level.
+        depth (int):
+            The number of levels in the tree.
+        number (int):
+            The number of lookups to time.
+    """
+    key_path = tuple(f"section{width - 1}" for _ in range(depth - 1))
+    key_path = key_path + (f"key{width - 1}",)
+    dotted_key = ".".join(key_path)
+    with tempfile.TemporaryDirectory() as work_dir:
+        mac_settings = create_settings(
+            work_dir=work_dir,
+            settings=generate_settings(width=width, depth=depth),
+        )
+        tree = mac_settings.get_all_settings()
+        thread_lock = Lock()
+
+        def reduce_lookup():
+            # The lookup as it was done before the path index.
+            with thread_lock:
+                return reduce(operator.getitem, key_path, tree)
+
+        results = {
+            "reduce": timeit.timeit(reduce_lookup, number=number),
+            "index (tuple)": timeit.timeit(
+                lambda: mac_settings[key_path], number=number
+            ),
+            "index (dotted)": timeit.timeit(
+                lambda: mac_settings[dotted_key], number=number
+            ),
+            "contains": timeit.timeit(
+                lambda: key_path in mac_settings, number=number
+            ),
+        }
+        MacSettings.clear()
+    print(f"Lookups of a depth {depth} key, {number} iterations:")
+    for name, seconds in results.items():
+        print(f"  {name:<16} {seconds * 1e9 / number:10.1f} ns/lookup")
+
+
+def bench_diff(width: int = 22, depth: int = 3, number: int = 20):
+    """
+    Time diffing a large tree with one leaf changed. The recursive diff is
+    timed on a freshly parsed copy (as after a reload) and on a copy that
+    shares structure (as after __setitem__).
+
+    Args:
+        width (int):
+            The number of keys at each level.
+        depth (int):
+            The number of levels in the tree.
+        number (int):
+            The number of diffs to time.
+    """
+    key_path = ("section0", "section0", "key0")
+    old_tree = generate_settings(width=width, depth=depth)
+    parsed_tree = copy.deepcopy(old_tree)
+    parsed_tree["section0"]["section0"]["key0"] = "changed"
+    shared_tree = replace_setting(old_tree, key_path, "changed")[0]
+    results = {
+        "dict_diff": timeit.timeit(
+            lambda: dict_diff(old_tree, parsed_tree), number=number
+        ),
+        "paths (parsed)": timeit.timeit(
+            lambda: dict_diff_paths(old_tree, parsed_tree), number=number
+        ),
+        "paths (shared)": timeit.timeit(
+            lambda: dict_diff_paths(old_tree, shared_tree), number=number
+        ),
+    }
+    print(f"Diffs of a {width ** depth} leaf tree, {number} iterations:")
+    for name, seconds in results.items():
+        print(f"  {name:<16} {seconds * 1e6 / number:10.1f} us/diff")
+
+
+def bench_yaml(number: int = 3):
+    """
+    Time parsing and dumping small, medium and large generated settings
+    with the pure Python YAML classes and with libyaml (if available).
+
+    Args:
+        number (int):
+            The number of loads and dumps to time for each size.
+    """
+    backends = {"python": (yaml.SafeLoader, yaml.SafeDumper)}
+    if yaml.__with_libyaml__:
+        backends["libyaml"] = (yaml.CSafeLoader, yaml.CSafeDumper)
+    sizes = {"small": (5, 2), "medium": (12, 3), "large": (12, 4)}
+    print(f"YAML load/dump, {number} iterations:")
+    for size_name, (width, depth) in sizes.items():
+        settings = generate_settings(width=width, depth=depth)
+        document = yaml.safe_dump(settings, indent=4)
+        print(f"  {size_name} ({len(document) / 1024:.0f} KB):")
+        for backend_name, (loader, dumper) in backends.items():
+            load_time = timeit.timeit(
+                lambda: yaml.load(document, Loader=loader), number=number
+            )
+            dump_time = timeit.timeit(
+                lambda: yaml.dump(settings, Dumper=dumper, indent=4),
+                number=number,
+            )
+            print(
+                f"    {backend_name:<8} load {load_time * 1e3 / number:9.2f}"
+                f" ms  dump {dump_time * 1e3 / number:9.2f} ms"
+            )
+
+
+def bench_cache(width: int = 12, depth: int = 4, number: int = 5):
+    """
+    Time load_settings parsing the YAML against using the compiled cache.
+
+    Args:
+        width (int):
+            The number of keys at each level.
+        depth (int):
+            The number of levels in the tree.
+        number (int):
+            The number of loads to time.
+    """
+    settings = generate_settings(width=width, depth=depth)
+    results = {}
+    for use_cache in (False, True):
+        with tempfile.TemporaryDirectory() as work_dir:
+            mac_settings = create_settings(
+                work_dir=work_dir, settings=settings, use_cache=use_cache
+            )
+            results[use_cache] = timeit.timeit(
+                mac_settings.load_settings, number=number
+            )
+            MacSettings.clear()
+    print(f"load_settings of {width ** depth} leaves, {number} iterations:")
+    print(f"  yaml             {results[False] * 1e3 / number:10.2f} ms")
+    print(f"  compiled cache   {results[True] * 1e3 / number:10.2f} ms")
+
+
+def bench_routing(subscribers: int = 1000, number: int = 10000):
+    """
+    Time routing one change to the subscribers interested in it, against
+    calling every subscriber to filter the change itself.
+
+    Args:
+        subscribers (int):
+            The number of subscribers, each to its own section.
+        number (int):
+            The number of changes to time.
+    """
+    changes = {("section7", "key3"): ("old", "new")}
+    path_router = MacSettingsPathRouter()
+    filters = []
+    for section in range(subscribers):
+        key_path = (f"section{section}",)
+        path_router.subscribe(key_path, lambda event: None)
+
+        def filter_change(changes, key_path=key_path):
+            return [
+                changed_path
+                for changed_path in changes
+                if changed_path[: len(key_path)] == key_path
+            ]
+
+        filters.append(filter_change)
+
+    def call_every_subscriber():
+        for filter_change in filters:
+            filter_change(changes)
+
+    results = {
+        "every subscriber": timeit.timeit(
+            call_every_subscriber, number=number // 10
+        )
+        * 10,
+        "path router": timeit.timeit(
+            lambda: path_router.route(changes), number=number
+        ),
+    }
+    print(f"Routing a change to {subscribers} subscribers:")
+    for name, seconds in results.items():
+        print(f"  {name:<16} {seconds * 1e6 / number:10.2f} us/change")
+
+
+def bench_history(width: int = 12, depth: int = 4, versions: int = 10):
+    """
+    Measure the memory each version in the history holds, when versions
+    come from setting one value and from reloading the file with one
+    value changed.
+
+    Args:
+        width (int):
+            The number of keys at each level.
+        depth (int):
+            The number of levels in the tree.
+        versions (int):
+            The number of versions to make.
+    """
+    settings = generate_settings(width=width, depth=depth)
+    key_path = ("section1",) * (depth - 1) + ("key1",)
+    with tempfile.TemporaryDirectory() as work_dir:
+        mac_settings = create_settings(
+            work_dir=work_dir, settings=settings, history_size=versions
+        )
+        full_size = retained_size(mac_settings.get_all_settings(), set())
+        for version in range(versions):
+            mac_settings[key_path] = f"set {version}"
+        set_bytes = [
+            version["retained_bytes"]
+            for version in mac_settings.history(measure_memory=True)
+        ]
+        for version in range(versions):
+            changed = copy.deepcopy(mac_settings.get_layer_settings("user"))
+            reduce(operator.getitem, key_path[:-1], changed)[
+                key_path[-1]
+            ] = f"reloaded {version}"
+            with open(mac_settings.settings_file_path, "w") as file:
+                yaml.safe_dump(changed, file)
+            mac_settings.reload_settings_from_file()
+        reload_bytes = [
+            version["retained_bytes"]
+            for version in mac_settings.history(measure_memory=True)
+        ]
+        MacSettings.clear()
+    print(f"History of {width ** depth} leaves ({full_size / 1024:.0f} KB):")
+    print(
+        f"  set one value    {sum(set_bytes) / len(set_bytes) / 1024:10.2f}"
+        " KB/version"
+    )
+    print(
+        "  reload the file  "
+        f"{sum(reload_bytes) / len(reload_bytes) / 1024:10.2f} KB/version"
+    )
+
+
+def bench_bulk(width: int = 8, depth: int = 4, number: int = 2000):
+    """
+    Time get with a default against catching the exception for a missing
+    setting, get_many against 20 lookups, and set_many against 20
+    separate changes.
+
+    Args:
+        width (int):
+            The number of keys at each level.
+        depth (int):
+            The number of levels in the tree.
+        number (int):
+            The number of times to repeat each lookup.
+    """
+    key_paths = [
+        (f"section{i % width}",) * (depth - 1) + (f"key{i % width}",)
+        for i in range(20)
+    ]
+    missing_path = "section1.missing.key1"
+    with tempfile.TemporaryDirectory() as work_dir:
+        # Hold the writes back, so the file writes don't swamp the times.
+        mac_settings = create_settings(
+            work_dir=work_dir,
+            settings=generate_settings(width=width, depth=depth),
+            write_behind_ms=60000,
+        )
+
+        def catch_missing():
+            try:
+                return mac_settings[missing_path]
+            except MacSettingsException:
+                return None
+
+        def get_each():
+            return [mac_settings[key_path] for key_path in key_paths]
+
+        counter = iter(range(number * 100))
+
+        def set_each():
+            with mac_settings.transaction():
+                for key_path in key_paths:
+                    mac_settings[key_path] = next(counter)
+
+        def set_many():
+            mac_settings.set_many(
+                {key_path: next(counter) for key_path in key_paths}
+            )
+
+        results = {
+            "missing, except": timeit.timeit(catch_missing, number=number)
+            / number,
+            "missing, get": timeit.timeit(
+                lambda: mac_settings.get(missing_path), number=number
+            )
+            / number,
+            "20 x getitem": timeit.timeit(get_each, number=number) / number,
+            "get_many(20)": timeit.timeit(
+                lambda: mac_settings.get_many(key_paths), number=number
+            )
+            / number,
+            "20 x setitem": timeit.timeit(set_each, number=20) / 20,
+            "set_many(20)": timeit.timeit(set_many, number=20) / 20,
+        }
+        mac_settings.close()
+        MacSettings.clear()
+    print("Bulk and default-aware access:")
+    for name, seconds in results.items():
+        print(f"  {name:<16} {seconds * 1e6:10.2f} us")
+
+
+def bench_fragments(
+    fragments: int = 10, width: int = 10, depth: int = 3, number: int = 5
+):
+    """
+    Time reloading after a change to one team's settings, when they're
+    all in one settings file, and when each team has its own fragment.
+
+    Args:
+        fragments (int):
+            The number of teams.
+        width (int):
+            The number of keys at each level of a team's settings.
+        depth (int):
+            The number of levels in a team's settings.
+        number (int):
+            The number of reloads to time.
+    """
+    team_settings = generate_settings(width=width, depth=depth)
+    teams = {f"team{team}": team_settings for team in range(fragments)}
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        fragments_dir = os.path.join(work_dir, "conf.d")
+        os.mkdir(fragments_dir)
+        for team in range(fragments):
+            fragment_path = os.path.join(fragments_dir, f"team{team}.yaml")
+            with open(fragment_path, "w") as fragment_file:
+                yaml.safe_dump({f"team{team}": team_settings}, fragment_file)
+        monolithic = create_settings(work_dir=work_dir, settings=teams)
+        counter = iter(range(number * 2))
+
+        def reload_file():
+            changed = dict(teams)
+            changed["team0"] = {"changed": next(counter)}
+            with open(monolithic.settings_file_path, "w") as settings_file:
+                yaml.safe_dump(changed, settings_file)
+            monolithic.reload_settings_from_file()
+
+        results["one file"] = timeit.timeit(reload_file, number=number)
+        monolithic.close()
+        split = create_settings(
+            work_dir=work_dir, settings={}, fragments_dir=fragments_dir
+        )
+        fragment_path = os.path.join(fragments_dir, "team0.yaml")
+
+        def reload_fragment():
+            with open(fragment_path, "w") as fragment_file:
+                yaml.safe_dump(
+                    {"team0": {"changed": next(counter)}}, fragment_file
+                )
+            split.reload_fragments([fragment_path])
+
+        results["one fragment"] = timeit.timeit(reload_fragment, number=number)
+        split.close()
+        MacSettings.clear()
+    print(
+        f"Reloading after a change to 1 of {fragments} teams' settings"
+        " (including the write):"
+    )
+    for name, seconds in results.items():
+        print(f"  {name:<16} {seconds * 1e3 / number:10.2f} ms")
+
+
+def run_comparisons() -> None:
+    """
+    Run the comparisons of each optimisation against what it replaced,
+    printing the results.
+    """
+    bench_lookups()
+    bench_diff()
+    bench_yaml()
+    bench_cache()
+    bench_routing()
+    bench_history()
+    bench_bulk()
+    bench_fragments()
+
+
+def package_version() -> Optional[str]:
+    """
+    The installed version of maclib, if it's installed.
+
+    Returns:
+        str:
+            The version, or None.
+    """
+    try:
+        return metadata.version("maclib")
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def main(arguments: Optional[list] = None) -> dict:
+    """
+    Parse the command line, run the suite and report the results.
+
+    Args:
+        arguments (list):
+            The command line arguments, defaults to sys.argv.
+
+    Returns:
+        dict:
+            The report.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark maclib.mac_settings."
+    )
+    parser.add_argument("--width", type=int, default=10)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--number", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--storage",
+        default="yaml",
+        choices=("yaml", "json", "sqlite"),
+    )
+    parser.add_argument(
+        "--json",
+        metavar="PATH",
+        help="Write the results as JSON, - for stdout.",
+    )
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="Also compare each optimisation against what it replaced.",
+    )
+    options = parser.parse_args(arguments)
+    # Keep anything printed while running off stdout, so the JSON can be
+    # written there.
+    with redirect_stdout(sys.stderr):
+        results = run_suite(
+            width=options.width,
+            depth=options.depth,
+            number=options.number,
+            repeat=options.repeat,
+            storage=options.storage,
+        )
+    report = {
+        "suite": "mac_settings",
+        "version": package_version(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "parameters": {
+            "width": options.width,
+            "depth": options.depth,
+            "leaves": options.width**options.depth,
+            "number": options.number,
+            "repeat": options.repeat,
+            "storage": options.storage,
+        },
+        "results": results,
+    }
+    if options.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        if options.json:
+            with open(options.json, "w") as json_file:
+                json.dump(report, json_file, indent=2)
+        print(
+            f"{report['parameters']['leaves']} settings ({options.width}"
+            f" wide, {options.depth} deep, {options.storage}):"
+        )
+        print("  benchmark           median (us)    min (us)    max (us)")
+        for name, result in results.items():
+            print(
+                f"  {name:<18} {result['median_us']:>12.2f}"
+                f" {result['min_us']:>11.2f} {result['max_us']:>11.2f}"
+            )
+    if options.compare:
+        with redirect_stdout(
+            sys.stderr if options.json == "-" else sys.stdout
+        ):
+            run_comparisons()
+    return report
+
+
+if __name__ == "__main__":
+    main()
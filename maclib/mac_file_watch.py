@@ -0,0 +1,688 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Name:
+        mac_file_watch.py
+    Description:
+        Pluggable ways of watching files for changes. Each watcher drives a
+        watchdog style event handler (on_modified, on_created, ...) so the
+        handler doesn't need to know how the change was spotted.
+
+         - MacWatchdogWatcher: uses a single, shared watchdog observer.
+         - MacPollWatcher: checks the size, modification time and inode of
+           every watched file from a single thread at a set interval.
+         - MacInotifyWatcher: Linux only. Uses inotify directly on the
+           parent directory, so atomic rename saves are seen, with a single
+           thread for every watched file.
+
+        from maclib.mac_file_watch import get_file_watcher
+
+        file_watcher = get_file_watcher("poll")
+        file_watcher.watch(path="settings.yaml", handler=my_handler)
+    Version:
+        1 - Initial release
+    Author:
+        J.MacGrillen <macgrillen@gmail.com>
+    Copyright:
+        Copyright (c) John MacGrillen. All rights reserved.
+"""
+import os
+import sys
+import select
+import struct
+import logging
+import ctypes
+import ctypes.util
+from abc import ABC, abstractmethod
+from typing import Optional
+from threading import Event, Lock, Thread
+from watchdog.observers import Observer
+from watchdog.events import (
+    FileCreatedEvent,
+    FileDeletedEvent,
+    FileModifiedEvent,
+    FileSystemEventHandler,
+)
+import maclib.mac_logger as mac_logger
+from maclib.mac_exception import MacException
+
+
+# The observer shared by every file watched through watchdog. It's only
+# created once the first file is watched.
+_shared_observer: Optional[Observer] = None
+_shared_observer_lock = Lock()
+
+
+def get_shared_observer() -> Observer:
+    """
+    Return the process wide watchdog observer, creating and starting it
+    the first time a file needs watching.
+
+    Args:
+        None
+
+    Return:
+        Observer:
+            The running observer.
+    """
+    global _shared_observer
+    with _shared_observer_lock:
+        if _shared_observer is None or not _shared_observer.is_alive():
+            _shared_observer = Observer()
+            _shared_observer.start()
+        return _shared_observer
+
+
+class MacFileWatchException(MacException):
+    """
+    Exception from the file watchers.
+    """
+
+    pass
+
+
+class MacFileWatcher(ABC):
+    """
+    The interface every file watcher provides. A watcher has to provide
+    watch and unwatch before it can be created.
+
+    Methods:
+        watch(path, handler):
+            Start passing changes to path on to handler.
+        unwatch(path, handler):
+            Stop passing changes to path on to handler.
+        stop():
+            Stop watching everything.
+    """
+
+    @abstractmethod
+    def watch(self, path: str, handler: FileSystemEventHandler) -> None:
+        """
+        Start passing changes to the file on to the handler.
+
+        Args:
+            path (str):
+                The file to watch.
+            handler (FileSystemEventHandler):
+                The handler to dispatch the change events to.
+
+        Return:
+            None
+        """
+
+    @abstractmethod
+    def unwatch(self, path: str, handler: FileSystemEventHandler) -> None:
+        """
+        Stop passing changes to the file on to the handler.
+
+        Args:
+            path (str):
+                The file being watched.
+            handler (FileSystemEventHandler):
+                The handler the change events were dispatched to.
+
+        Return:
+            None
+        """
+
+    def stop(self) -> None:
+        """
+        Stop watching everything and stop any threads.
+
+        Args:
+            None
+
+        Return:
+            None
+        """
+        pass
+
+
+class MacWatchdogWatcher(MacFileWatcher):
+    """
+    Watch files using the shared watchdog observer.
+
+    Attributes:
+        __watches (dict):
+            The (observer, ObservedWatch) for each (path, handler).
+        __lock (Lock):
+            Guards the watches.
+    """
+
+    __watches: dict
+    __lock: Lock
+
+    def __init__(self) -> None:
+        """
+        Nothing is started until the first file is watched.
+        """
+        super(MacWatchdogWatcher, self).__init__()
+        self.__watches = dict()
+        self.__lock = Lock()
+
+    def watch(self, path: str, handler: FileSystemEventHandler) -> None:
+        """
+        Schedule the file on the shared watchdog observer.
+
+        Args:
+            path (str):
+                The file to watch.
+            handler (FileSystemEventHandler):
+                The handler to dispatch the change events to.
+
+        Return:
+            None
+        """
+        file_observer = get_shared_observer()
+        observed_watch = file_observer.schedule(
+            event_handler=handler, path=path, recursive=False
+        )
+        with self.__lock:
+            self.__watches[(path, handler)] = (file_observer, observed_watch)
+
+    def unwatch(self, path: str, handler: FileSystemEventHandler) -> None:
+        """
+        Unschedule the file from the shared watchdog observer.
+
+        Args:
+            path (str):
+                The file being watched.
+            handler (FileSystemEventHandler):
+                The handler the change events were dispatched to.
+
+        Return:
+            None
+        """
+        with self.__lock:
+            observed = self.__watches.pop((path, handler), None)
+        if observed is not None:
+            file_observer, observed_watch = observed
+            try:
+                file_observer.unschedule(observed_watch)
+            except KeyError:
+                pass
+
+
+def _file_signature(path: str) -> Optional[tuple]:
+    """
+    The cheap to fetch details that change whenever a file does.
+
+    Args:
+        path (str):
+            The file to check.
+
+    Return:
+        tuple:
+            The file's size, modification time and inode, or None if it
+            doesn't exist.
+    """
+    try:
+        file_stat = os.stat(path)
+    except OSError:
+        return None
+    return (file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino)
+
+
+class MacPollWatcher(MacFileWatcher):
+    """
+    Watch files by checking their size, modification time and inode at a
+    set interval. Every file is checked from the one thread. This works on
+    any platform and file system, and sees atomic rename saves, at the
+    cost of up to interval seconds of delay.
+
+    Attributes:
+        interval (float):
+            The number of seconds between checks.
+        mac_logger (logging.Logger):
+            The logger object for this class.
+        __watches (dict):
+            The last signature seen for each (path, handler).
+        __lock (Lock):
+            Guards the watches.
+        __stopping (Event):
+            Tells the polling thread to stop.
+        __poll_thread (Thread):
+            The polling thread, started with the first watch.
+    """
+
+    interval: float
+    mac_logger: logging.Logger
+    __watches: dict
+    __lock: Lock
+    __stopping: Event
+    __poll_thread: Optional[Thread]
+
+    def __init__(self, interval_ms: int = 500) -> None:
+        """
+        Set up the watcher. The thread isn't started until the first file
+        is watched.
+
+        Args:
+            interval_ms (int):
+                The number of milliseconds between checks.
+        """
+        super(MacPollWatcher, self).__init__()
+        self.interval = interval_ms / 1000
+        self.mac_logger = logging.getLogger(mac_logger.LOGGER_NAME)
+        self.__watches = dict()
+        self.__lock = Lock()
+        self.__stopping = Event()
+        self.__poll_thread = None
+
+    def watch(self, path: str, handler: FileSystemEventHandler) -> None:
+        """
+        Start checking the file.
+
+        Args:
+            path (str):
+                The file to watch.
+            handler (FileSystemEventHandler):
+                The handler to dispatch the change events to.
+
+        Return:
+            None
+        """
+        with self.__lock:
+            self.__watches[(path, handler)] = _file_signature(path)
+            if self.__poll_thread is None:
+                self.__stopping.clear()
+                self.__poll_thread = Thread(
+                    target=self._poll_loop,
+                    name=self.__class__.__name__,
+                    daemon=True,
+                )
+                self.__poll_thread.start()
+
+    def unwatch(self, path: str, handler: FileSystemEventHandler) -> None:
+        """
+        Stop checking the file.
+
+        Args:
+            path (str):
+                The file being watched.
+            handler (FileSystemEventHandler):
+                The handler the change events were dispatched to.
+
+        Return:
+            None
+        """
+        with self.__lock:
+            self.__watches.pop((path, handler), None)
+
+    def stop(self) -> None:
+        """
+        Stop the polling thread and forget every watched file.
+
+        Args:
+            None
+
+        Return:
+            None
+        """
+        with self.__lock:
+            poll_thread = self.__poll_thread
+            self.__poll_thread = None
+            self.__watches.clear()
+        self.__stopping.set()
+        if poll_thread is not None:
+            poll_thread.join()
+
+    def check(self) -> None:
+        """
+        Check every watched file once, dispatching an event to the handler
+        of any that have changed.
+
+        Args:
+            None
+
+        Return:
+            None
+        """
+        with self.__lock:
+            watches = list(self.__watches.items())
+        for (path, handler), last_signature in watches:
+            signature = _file_signature(path)
+            if signature == last_signature:
+                continue
+            with self.__lock:
+                if (path, handler) not in self.__watches:
+                    continue
+                self.__watches[(path, handler)] = signature
+            if last_signature is None:
+                event = FileCreatedEvent(path)
+            elif signature is None:
+                event = FileDeletedEvent(path)
+            else:
+                event = FileModifiedEvent(path)
+            try:
+                handler.dispatch(event)
+            except Exception as err:
+                self.mac_logger.error(f"Error handling {event}. {err}")
+
+    def _poll_loop(self) -> None:
+        """
+        Check the watched files until told to stop.
+
+        Args:
+            None
+
+        Return:
+            None
+        """
+        while not self.__stopping.wait(self.interval):
+            self.check()
+
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+_INOTIFY_EVENT = struct.Struct("iIII")
+_INOTIFY_MASK = (
+    IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+)
+
+
+class MacInotifyWatcher(MacFileWatcher):
+    """
+    Watch files with Linux inotify. The parent directory is watched rather
+    than the file itself, so a save that writes a new file and renames it
+    over the old one is still seen. One inotify descriptor and one thread
+    serve every watched file.
+
+    Attributes:
+        mac_logger (logging.Logger):
+            The logger object for this class.
+        __libc (ctypes.CDLL):
+            The C library providing the inotify calls.
+        __inotify_fd (int):
+            The inotify file descriptor, or None until the first watch.
+        __wake_pipe (tuple):
+            A pipe used to wake the reader thread when stopping.
+        __directories (dict):
+            The watch descriptor for each watched directory.
+        __watches (dict):
+            For each watch descriptor, the handlers for each file name.
+        __lock (Lock):
+            Guards the watches.
+        __read_thread (Thread):
+            The thread reading inotify events.
+    """
+
+    mac_logger: logging.Logger
+    __libc: ctypes.CDLL
+    __inotify_fd: Optional[int]
+    __wake_pipe: Optional[tuple]
+    __directories: dict
+    __watches: dict
+    __lock: Lock
+    __read_thread: Optional[Thread]
+
+    def __init__(self) -> None:
+        """
+        Load the inotify calls from the C library.
+        """
+        super(MacInotifyWatcher, self).__init__()
+        if not sys.platform.startswith("linux"):  # pragma: no cover
+            raise MacFileWatchException(
+                "The inotify file watcher is only available on Linux."
+            )
+        self.mac_logger = logging.getLogger(mac_logger.LOGGER_NAME)
+        self.__libc = ctypes.CDLL(
+            ctypes.util.find_library("c") or "libc.so.6", use_errno=True
+        )
+        self.__inotify_fd = None
+        self.__wake_pipe = None
+        self.__directories = dict()
+        self.__watches = dict()
+        self.__lock = Lock()
+        self.__read_thread = None
+
+    def watch(self, path: str, handler: FileSystemEventHandler) -> None:
+        """
+        Watch the file's parent directory for changes to the file.
+
+        Args:
+            path (str):
+                The file to watch.
+            handler (FileSystemEventHandler):
+                The handler to dispatch the change events to.
+
+        Return:
+            None
+        """
+        directory, file_name = os.path.split(os.path.abspath(path))
+        with self.__lock:
+            if self.__inotify_fd is None:
+                self._start()
+            watch_descriptor = self.__directories.get(directory)
+            if watch_descriptor is None:
+                watch_descriptor = self.__libc.inotify_add_watch(
+                    self.__inotify_fd, os.fsencode(directory), _INOTIFY_MASK
+                )
+                if watch_descriptor < 0:
+                    error_number = ctypes.get_errno()
+                    raise MacFileWatchException(
+                        f"Unable to watch {directory}. "
+                        f"{os.strerror(error_number)}"
+                    )
+                self.__directories[directory] = watch_descriptor
+                self.__watches[watch_descriptor] = (directory, dict())
+            file_handlers = self.__watches[watch_descriptor][1]
+            file_handlers.setdefault(file_name, dict())[handler] = path
+
+    def unwatch(self, path: str, handler: FileSystemEventHandler) -> None:
+        """
+        Stop watching the file, and its directory once nothing else in it
+        is being watched.
+
+        Args:
+            path (str):
+                The file being watched.
+            handler (FileSystemEventHandler):
+                The handler the change events were dispatched to.
+
+        Return:
+            None
+        """
+        directory, file_name = os.path.split(os.path.abspath(path))
+        with self.__lock:
+            watch_descriptor = self.__directories.get(directory)
+            if watch_descriptor is None:
+                return
+            file_handlers = self.__watches[watch_descriptor][1]
+            file_handlers.get(file_name, dict()).pop(handler, None)
+            if not file_handlers.get(file_name, True):
+                del file_handlers[file_name]
+            if not file_handlers:
+                self.__libc.inotify_rm_watch(
+                    self.__inotify_fd, watch_descriptor
+                )
+                del self.__directories[directory]
+                del self.__watches[watch_descriptor]
+
+    def stop(self) -> None:
+        """
+        Stop the reader thread and close the inotify descriptor.
+
+        Args:
+            None
+
+        Return:
+            None
+        """
+        with self.__lock:
+            read_thread = self.__read_thread
+            self.__read_thread = None
+            if read_thread is not None:
+                os.write(self.__wake_pipe[1], b"x")
+        if read_thread is not None:
+            read_thread.join()
+        with self.__lock:
+            if self.__inotify_fd is not None:
+                os.close(self.__inotify_fd)
+                os.close(self.__wake_pipe[0])
+                os.close(self.__wake_pipe[1])
+            self.__inotify_fd = None
+            self.__wake_pipe = None
+            self.__directories.clear()
+            self.__watches.clear()
+
+    def _start(self) -> None:
+        """
+        Create the inotify descriptor and start the reader thread. The
+        caller must hold the lock.
+
+        Args:
+            None
+
+        Return:
+            None
+        """
+        inotify_fd = self.__libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if inotify_fd < 0:
+            error_number = ctypes.get_errno()
+            raise MacFileWatchException(
+                f"Unable to start inotify. {os.strerror(error_number)}"
+            )
+        self.__inotify_fd = inotify_fd
+        self.__wake_pipe = os.pipe()
+        self.__read_thread = Thread(
+            target=self._read_loop,
+            args=(inotify_fd, self.__wake_pipe[0]),
+            name=self.__class__.__name__,
+            daemon=True,
+        )
+        self.__read_thread.start()
+
+    def _read_loop(self, inotify_fd: int, wake_fd: int) -> None:
+        """
+        Read and dispatch inotify events until woken to stop.
+
+        Args:
+            inotify_fd (int):
+                The inotify file descriptor.
+            wake_fd (int):
+                The read end of the wake up pipe.
+
+        Return:
+            None
+        """
+        while True:
+            ready, _, _ = select.select([inotify_fd, wake_fd], [], [])
+            if wake_fd in ready:
+                return
+            try:
+                buffer = os.read(inotify_fd, 65536)
+            except BlockingIOError:
+                continue
+            self._dispatch_buffer(buffer)
+
+    def _dispatch_buffer(self, buffer: bytes) -> None:
+        """
+        Turn a buffer of raw inotify events into handler events.
+
+        Args:
+            buffer (bytes):
+                The raw events read from the inotify descriptor.
+
+        Return:
+            None
+        """
+        offset = 0
+        while offset < len(buffer):
+            watch_descriptor, mask, _, name_length = (
+                _INOTIFY_EVENT.unpack_from(buffer, offset)
+            )
+            offset += _INOTIFY_EVENT.size
+            file_name = os.fsdecode(
+                buffer[offset:offset + name_length].rstrip(b"\0")
+            )
+            offset += name_length
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so treat every file as modified.
+                with self.__lock:
+                    watched = [
+                        (handler, path)
+                        for _, file_handlers in self.__watches.values()
+                        for handlers in file_handlers.values()
+                        for handler, path in handlers.items()
+                    ]
+                for handler, path in watched:
+                    self._dispatch(handler, FileModifiedEvent(path))
+                continue
+            with self.__lock:
+                directory_watch = self.__watches.get(watch_descriptor)
+                if directory_watch is None:
+                    continue
+                handlers = list(
+                    directory_watch[1].get(file_name, dict()).items()
+                )
+            for handler, path in handlers:
+                if mask & IN_CREATE:
+                    self._dispatch(handler, FileCreatedEvent(path))
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self._dispatch(handler, FileDeletedEvent(path))
+                else:
+                    self._dispatch(handler, FileModifiedEvent(path))
+
+    def _dispatch(self, handler: FileSystemEventHandler, event) -> None:
+        """
+        Pass an event on to a handler, logging rather than raising errors
+        so the reader thread keeps going.
+
+        Args:
+            handler (FileSystemEventHandler):
+                The handler to dispatch the event to.
+            event (FileSystemEvent):
+                The event.
+
+        Return:
+            None
+        """
+        try:
+            handler.dispatch(event)
+        except Exception as err:
+            self.mac_logger.error(f"Error handling {event}. {err}")
+
+
+_FILE_WATCHERS = {
+    "watchdog": MacWatchdogWatcher,
+    "poll": MacPollWatcher,
+    "inotify": MacInotifyWatcher,
+}
+_shared_watchers: dict = dict()
+_shared_watchers_lock = Lock()
+
+
+def get_file_watcher(backend: str = "watchdog") -> MacFileWatcher:
+    """
+    Return the process wide watcher for a backend, creating it on first
+    use so that every watched file shares its thread.
+
+    Args:
+        backend (str):
+            One of "watchdog", "poll" or "inotify".
+
+    Return:
+        MacFileWatcher:
+            The shared watcher.
+    """
+    if backend not in _FILE_WATCHERS:
+        raise MacFileWatchException(
+            f"Unknown file watcher {backend}. Use one of "
+            f"{', '.join(_FILE_WATCHERS)}."
+        )
+    with _shared_watchers_lock:
+        if backend not in _shared_watchers:
+            _shared_watchers[backend] = _FILE_WATCHERS[backend]()
+        return _shared_watchers[backend]
+
+
+if __name__ == "__main__":  # pragma: no cover
+    pass
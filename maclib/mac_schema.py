@@ -0,0 +1,472 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Name:
+        mac_schema.py
+    Description:
+        Compile a settings schema into typed, validated settings objects.
+        The schema is either a (preferably frozen) dataclass, with nested
+        dataclasses for each section, or a dict spec such as:
+
+            {
+                "pool": {"size": int, "timeout": (float, 2.5)},
+                "debug": (bool, False),
+            }
+
+        where each value is a type (a required setting), a (type, default)
+        tuple, or a nested dict spec for a section. A dict spec is turned
+        into frozen dataclasses.
+
+        The schema is compiled once into a converter for every field, so
+        building the typed settings is a single pass with no type
+        inspection, and reading them is plain attribute access:
+
+            schema = compile_schema(AppSettings)
+            typed_settings = schema.build(settings.get_all_settings())
+            typed_settings.pool.size
+
+        Sections that are the same object as in the last build are reused
+        rather than built again.
+    Version:
+        1 - Initial release
+    Author:
+        J.MacGrillen <macgrillen@gmail.com>
+    Copyright:
+        Copyright (c) John MacGrillen. All rights reserved.
+"""
+import copy
+import dataclasses
+import typing
+from types import NoneType, UnionType
+from enum import Enum
+from typing import Any, Callable, Union
+from maclib.mac_exception import MacException
+
+
+# Marks a setting that isn't in the settings file.
+_MISSING = object()
+
+_TRUE_STRINGS = frozenset(("true", "yes", "on", "1"))
+_FALSE_STRINGS = frozenset(("false", "no", "off", "0"))
+
+
+class MacSchemaException(MacException):
+    """
+    Exception from the settings schema.
+    """
+
+    pass
+
+
+def _dotted(key_path: tuple) -> str:
+    """
+    Format a key path for an error message.
+
+    Args:
+        key_path (tuple):
+            The key path.
+
+    Return:
+        str:
+            The key path as a dotted string.
+    """
+    return ".".join(str(key) for key in key_path) or "the settings"
+
+
+def _to_int(value: Any, key_path: tuple) -> int:
+    """
+    Coerce a setting to an int.
+
+    Args:
+        value (any):
+            The setting's value.
+        key_path (tuple):
+            The key path of the setting.
+
+    Return:
+        int:
+            The value as an int.
+    """
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        try:
+            return int(value.strip())
+        except ValueError:
+            pass
+    raise MacSchemaException(
+        f"{_dotted(key_path)} should be an int, not {value!r}."
+    )
+
+
+def _to_float(value: Any, key_path: tuple) -> float:
+    """
+    Coerce a setting to a float.
+
+    Args:
+        value (any):
+            The setting's value.
+        key_path (tuple):
+            The key path of the setting.
+
+    Return:
+        float:
+            The value as a float.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value.strip())
+        except ValueError:
+            pass
+    raise MacSchemaException(
+        f"{_dotted(key_path)} should be a float, not {value!r}."
+    )
+
+
+def _to_bool(value: Any, key_path: tuple) -> bool:
+    """
+    Coerce a setting to a bool.
+
+    Args:
+        value (any):
+            The setting's value.
+        key_path (tuple):
+            The key path of the setting.
+
+    Return:
+        bool:
+            The value as a bool.
+    """
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str):
+        if value.strip().lower() in _TRUE_STRINGS:
+            return True
+        if value.strip().lower() in _FALSE_STRINGS:
+            return False
+    raise MacSchemaException(
+        f"{_dotted(key_path)} should be a bool, not {value!r}."
+    )
+
+
+def _to_str(value: Any, key_path: tuple) -> str:
+    """
+    Coerce a setting to a str.
+
+    Args:
+        value (any):
+            The setting's value.
+        key_path (tuple):
+            The key path of the setting.
+
+    Return:
+        str:
+            The value as a str.
+    """
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise MacSchemaException(
+        f"{_dotted(key_path)} should be a str, not {value!r}."
+    )
+
+
+def _pass_through(value: Any, key_path: tuple) -> Any:
+    """
+    Use a setting as it is.
+
+    Args:
+        value (any):
+            The setting's value.
+        key_path (tuple):
+            The key path of the setting.
+
+    Return:
+        any:
+            The value.
+    """
+    return value
+
+
+_SCALAR_CONVERTERS = {
+    int: _to_int,
+    float: _to_float,
+    bool: _to_bool,
+    str: _to_str,
+    Any: _pass_through,
+    object: _pass_through,
+}
+
+
+def spec_to_dataclass(spec: dict, name: str = "Settings") -> type:
+    """
+    Turn a dict spec into frozen dataclasses, one for each section.
+
+    Args:
+        spec (dict):
+            The dict spec.
+        name (str):
+            The name of the dataclass.
+
+    Return:
+        type:
+            The dataclass.
+    """
+    fields = []
+    for key, field_spec in spec.items():
+        if not isinstance(key, str) or not key.isidentifier():
+            raise MacSchemaException(
+                f"{key!r} can't be used as a setting name in a schema."
+            )
+        default = dataclasses.MISSING
+        if isinstance(field_spec, tuple):
+            field_spec, default = field_spec
+        if isinstance(field_spec, dict):
+            field_spec = spec_to_dataclass(field_spec, name=f"{name}_{key}")
+        if isinstance(default, (list, dict, set)):
+            field_info = dataclasses.field(
+                default_factory=lambda value=default: copy.copy(value)
+            )
+        else:
+            field_info = dataclasses.field(default=default)
+        fields.append((key, field_spec, field_info))
+    return dataclasses.make_dataclass(name, fields, frozen=True)
+
+
+class MacSchema(object):
+    """
+    A compiled settings schema.
+
+    Attributes:
+        schema_class (type):
+            The dataclass the settings are built into.
+        __converter (Callable):
+            The compiled converter for the whole settings.
+        __sections (dict):
+            The section objects built last time, with the settings mapping
+            each was built from, by dataclass and the mapping's id.
+    """
+
+    schema_class: type
+    __converter: Callable
+    __sections: dict
+
+    def __init__(self, schema: Union[type, dict]) -> None:
+        """
+        Compile the schema.
+
+        Args:
+            schema (type or dict):
+                A dataclass or a dict spec.
+        """
+        if isinstance(schema, dict):
+            schema = spec_to_dataclass(schema)
+        if not dataclasses.is_dataclass(schema):
+            raise MacSchemaException(
+                "A settings schema must be a dataclass or a dict spec."
+            )
+        self.schema_class = schema
+        self.__sections = dict()
+        self.__converter = self._compile_type(schema)
+
+    def build(self, settings: Any) -> Any:
+        """
+        Build the typed settings, validating and coercing every setting in
+        the schema. Nothing is changed unless every setting is valid.
+
+        Args:
+            settings (any):
+                The settings tree.
+
+        Return:
+            any:
+                An instance of the schema's dataclass.
+        """
+        sections: dict = dict()
+        typed_settings = self.__converter(settings, (), sections)
+        self.__sections = sections
+        return typed_settings
+
+    def _compile_type(self, field_type: Any) -> Callable:
+        """
+        Compile a type annotation into a converter.
+
+        Args:
+            field_type (any):
+                The type annotation.
+
+        Return:
+            Callable:
+                A converter taking the value, its key path and the sections
+                being built.
+        """
+        if dataclasses.is_dataclass(field_type):
+            return self._compile_section(field_type)
+        if field_type in _SCALAR_CONVERTERS:
+            scalar = _SCALAR_CONVERTERS[field_type]
+            return lambda value, key_path, sections: scalar(value, key_path)
+        origin = typing.get_origin(field_type)
+        arguments = typing.get_args(field_type)
+        if origin in (Union, UnionType):
+            options = [option for option in arguments if option != NoneType]
+            if len(options) == 1 and len(options) < len(arguments):
+                optional = self._compile_type(options[0])
+                return lambda value, key_path, sections: (
+                    None
+                    if value is None
+                    else optional(value, key_path, sections)
+                )
+            raise MacSchemaException(
+                f"Only Optional unions are supported, not {field_type}."
+            )
+        if origin in (list, tuple, set, frozenset):
+            item = self._compile_type(arguments[0] if arguments else Any)
+
+            def convert_items(value: Any, key_path: tuple, sections: dict):
+                if not isinstance(value, (list, tuple, set, frozenset)):
+                    raise MacSchemaException(
+                        f"{_dotted(key_path)} should be a list, "
+                        f"not {value!r}."
+                    )
+                return origin(
+                    item(entry, key_path + (index,), sections)
+                    for index, entry in enumerate(value)
+                )
+
+            return convert_items
+        if origin is dict:
+            entry = self._compile_type(arguments[1] if arguments else Any)
+
+            def convert_entries(value: Any, key_path: tuple, sections: dict):
+                if not isinstance(value, dict):
+                    raise MacSchemaException(
+                        f"{_dotted(key_path)} should be a mapping, "
+                        f"not {value!r}."
+                    )
+                return {
+                    key: entry(child, key_path + (key,), sections)
+                    for key, child in value.items()
+                }
+
+            return convert_entries
+        if isinstance(field_type, type) and issubclass(field_type, Enum):
+
+            def convert_enum(value: Any, key_path: tuple, sections: dict):
+                try:
+                    return field_type(value)
+                except ValueError:
+                    pass
+                try:
+                    return field_type[value]
+                except KeyError:
+                    raise MacSchemaException(
+                        f"{_dotted(key_path)} should be one of "
+                        f"{[member.name for member in field_type]}, "
+                        f"not {value!r}."
+                    )
+
+            return convert_enum
+        if isinstance(field_type, type):
+
+            def convert_other(value: Any, key_path: tuple, sections: dict):
+                if isinstance(value, field_type):
+                    return value
+                try:
+                    return field_type(value)
+                except (TypeError, ValueError) as err:
+                    raise MacSchemaException(
+                        f"{_dotted(key_path)} should be a "
+                        f"{field_type.__name__}, not {value!r}. {err}"
+                    )
+
+            return convert_other
+        raise MacSchemaException(
+            f"{field_type} isn't supported in a settings schema."
+        )
+
+    def _compile_section(self, section_class: type) -> Callable:
+        """
+        Compile a dataclass into a converter that builds it from a
+        settings mapping.
+
+        Args:
+            section_class (type):
+                The dataclass for the section.
+
+        Return:
+            Callable:
+                The converter for the section.
+        """
+        type_hints = typing.get_type_hints(section_class)
+        fields = []
+        for field_info in dataclasses.fields(section_class):
+            if not field_info.init:
+                continue
+            required = (
+                field_info.default is dataclasses.MISSING
+                and field_info.default_factory is dataclasses.MISSING
+            )
+            fields.append(
+                (
+                    field_info.name,
+                    self._compile_type(type_hints[field_info.name]),
+                    required,
+                )
+            )
+
+        def convert_section(value: Any, key_path: tuple, sections: dict):
+            if not isinstance(value, dict):
+                raise MacSchemaException(
+                    f"{_dotted(key_path)} should be a mapping, "
+                    f"not {value!r}."
+                )
+            # Settings trees share unchanged mappings between snapshots,
+            # so a mapping we built last time can be used as it is.
+            section_key = (section_class, id(value))
+            built = self.__sections.get(section_key)
+            if built is not None and built[0] is value:
+                sections[section_key] = built
+                return built[1]
+            arguments = {}
+            for name, convert, required in fields:
+                child = value.get(name, _MISSING)
+                if child is _MISSING:
+                    if required:
+                        raise MacSchemaException(
+                            f"{_dotted(key_path + (name,))} is missing."
+                        )
+                    continue
+                arguments[name] = convert(child, key_path + (name,), sections)
+            section = section_class(**arguments)
+            sections[section_key] = (value, section)
+            return section
+
+        return convert_section
+
+
+def compile_schema(schema: Union[type, dict, MacSchema]) -> MacSchema:
+    """
+    Compile a settings schema.
+
+    Args:
+        schema (type, dict or MacSchema):
+            A dataclass, a dict spec, or an already compiled schema.
+
+    Return:
+        MacSchema:
+            The compiled schema.
+    """
+    if isinstance(schema, MacSchema):
+        return schema
+    return MacSchema(schema)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    pass
@@ -7,6 +7,60 @@ Description:
     Manage applicatuon settings from a YAML file.
     There should be a set of defaults.
 Version:
+    28 - Settings can be split into fragments in a conf.d style
+         directory. Each fragment is parsed and cached separately, and a
+         change to one only parses and merges that fragment again.
+    27 - Added an opt-in concurrent_writes mode, where processes saving
+         the same settings file take a lock file holding a generation,
+         and apply their changes on top of any newer save rather than
+         writing over it.
+    26 - Added derive, which memoises a value derived from a setting and
+         rebuilds it only after a change touches that setting.
+    25 - Optionally collect timings of reading, parsing, merging,
+         diffing, saving and event dispatch, and of waiting for the
+         write lock, see stats().
+    24 - Added get with a default, get_many and set_many. Lookups that
+         miss return the default rather than raising.
+    23 - Keep a bounded history of previous settings, sharing everything
+         that didn't change, which can be rolled back to.
+    22 - Added a lazy loading mode, where the top level sections of a
+         YAML settings file are only parsed when they are first used.
+    21 - Added an asyncio API: aload, asave, wait_for_change and
+         watch_changes.
+    20 - Callbacks can subscribe to the changes under a key path, and
+         are only called when a change touches it.
+    19 - The settings file can be stored as YAML, JSON, TOML (read only)
+         or SQLite, which saves only the settings that have changed.
+    18 - The settings logic is in MacSettingsStore, which isn't a
+         singleton, so MacSettingsManager can hold many settings files.
+         File change reloads can share a single dispatcher thread.
+    17 - A schema can be registered to build typed, validated settings
+         whenever they change.
+    16 - Settings are resolved from layers: the defaults, the user's
+         settings file, environment variables and runtime overrides.
+         Only the layer that changed is merged again.
+    15 - The way the settings file is watched can be chosen per instance,
+         from watchdog, stat polling or inotify.
+    14 - The watchdog observer is only created when the first settings
+         file is watched, is shared by every watched file, and watching
+         can be turned off.
+    13 - Bursts of file events are coalesced into a single reload, and
+         the reload is skipped when the file's content hasn't changed.
+    12 - Added an optional compiled cache of the parsed settings, so the
+         YAML only needs parsing when it has changed.
+    11 - Use the libyaml C loader and dumper when PyYAML has been built
+         with libyaml.
+    10 - settings_changed events carry a recursive diff of the key paths
+         that have been added, removed or changed.
+    9 - Settings are held in immutable snapshots that are swapped on
+        load and change, so readers never take a lock and reloads no
+        longer deep copy the settings.
+    8 - Added an opt-in write-behind mode that coalesces saves onto a
+        background writer thread.
+    7 - Added transactions so many settings can be changed with a single
+        write and a single change event.
+    6 - Added a flattened key path index so tuple and dotted string
+        lookups are a single dictionary probe.
     5 - Switched to event messages from direct callback.
     4 - Added callback support to notify objects of settings changes.
     3 - Added a file watcher to pickup when the settings are
@@ -20,8 +74,9 @@ Author:
 Copyright:
     Copyright (c) John MacGrillen. All rights reserved.
 """
-from typing import Optional, Any
-from functools import reduce
+from typing import AsyncIterator, Iterable, Iterator, Optional, Any, Union
+from dataclasses import dataclass, replace
+from functools import reduce, lru_cache
 import operator
 import logging
 import yaml
@@ -30,14 +85,51 @@ import pathlib
 import os
 import sys
 import copy
+import time
+import marshal
+import hashlib
+import asyncio
+import atexit
+import itertools
+import weakref
+from collections import deque
 from enum import Enum, auto
-from threading import Lock
-from watchdog.observers import Observer
+from contextlib import contextmanager, nullcontext
+from threading import (
+    Condition,
+    Event,
+    Lock,
+    RLock,
+    Thread,
+    Timer,
+    local,
+)
 from watchdog.events import FileSystemEventHandler
 import maclib.mac_logger as mac_logger
 from maclib.mac_single import MacSingleInstance
 from maclib.mac_exception import MacException
-from maclib.mac_events import MacEventPublisher, MacEvent
+from maclib.mac_events import MacEventException, MacEventPublisher, MacEvent
+from maclib.mac_file_watch import MacFileWatcher, get_file_watcher
+from maclib.mac_settings_derived import MacSettingsDerived
+from maclib.mac_settings_lock import MacSettingsFileLock
+from maclib.mac_settings_stats import (
+    NOT_TIMED,
+    MacSettingsStats,
+    MacSettingsTimedLock,
+)
+from maclib.mac_schema import MacSchema, MacSchemaException, compile_schema
+from maclib.mac_storage import (
+    YAML_BACKEND,
+    YamlLoader,
+    MacSettingsStorage,
+    MacStorageException,
+    get_settings_storage,
+    storage_for_path,
+)
+
+
+# Marks a key that isn't in the settings, as None is a valid setting value.
+_MISSING = object()
 
 
 def dict_diff(dict_a: dict, dict_b: dict) -> dict:
@@ -67,6 +159,502 @@ def dict_diff(dict_a: dict, dict_b: dict) -> dict:
     return changes
 
 
+def dict_diff_paths(dict_a: Any, dict_b: Any, prefix: tuple = ()) -> dict:
+    """
+    Return the difference between two settings trees as the minimal set of
+    key paths that have been added, removed, or changed. Mappings are
+    compared key by key, everything else (including lists) is compared as
+    a value. Subtrees that are the same object are skipped without looking
+    inside them, so diffing two snapshots that share structure only costs
+    as much as the parts that differ. Equal subtrees are skipped using the
+    built in (C level) comparison, only descending into those that differ.
+
+    Args:
+        dict_a (Any):
+            The first settings tree to compare against.
+        dict_b (Any):
+            The second settings tree to compare against.
+        prefix (tuple):
+            The key path of the trees being compared.
+
+    Return:
+        dict:
+            The same shape as dict_diff, but keyed by key path tuple, e.g.
+            {"added": {("a", "b"): 1}, "removed": {},
+             "changed": {("a", "c"): (old, new)}}
+    """
+    added: dict = {}
+    removed: dict = {}
+    changed: dict = {}
+    changes = {"added": added, "removed": removed, "changed": changed}
+    if dict_a is dict_b:
+        return changes
+    if not (isinstance(dict_a, dict) and isinstance(dict_b, dict)):
+        if dict_a != dict_b:
+            changed[prefix] = (dict_a, dict_b)
+        return changes
+    pending = [(prefix, dict_a, dict_b)]
+    while pending:
+        key_path, node_a, node_b = pending.pop()
+        for key in node_a.keys() - node_b.keys():
+            removed[key_path + (key,)] = node_a[key]
+        for key, value_b in node_b.items():
+            value_a = node_a.get(key, _MISSING)
+            if value_a is _MISSING:
+                added[key_path + (key,)] = value_b
+            elif value_a is value_b or value_a == value_b:
+                continue
+            elif isinstance(value_a, dict) and isinstance(value_b, dict):
+                pending.append((key_path + (key,), value_a, value_b))
+            else:
+                changed[key_path + (key,)] = (value_a, value_b)
+    return changes
+
+
+def flatten_settings(settings: Any, prefix: tuple = ()) -> dict:
+    """
+    Flatten a settings tree into a dictionary keyed by the key path tuple of
+    every mapping and leaf value below the root. Lists are treated as leaf
+    values and are not descended into.
+
+    Args:
+        settings (Any):
+            The settings tree (or subtree) to flatten.
+        prefix (tuple):
+            The key path of the subtree being flattened.
+
+    Return:
+        dict:
+            A dictionary of key path tuples to their values.
+    """
+    path_index: dict = {}
+    if not isinstance(settings, dict):
+        return path_index
+    pending = [(prefix, settings)]
+    while pending:
+        parent_path, node = pending.pop()
+        for key, value in node.items():
+            key_path = parent_path + (key,)
+            path_index[key_path] = value
+            if isinstance(value, dict):
+                pending.append((key_path, value))
+    return path_index
+
+
+@lru_cache(maxsize=1024)
+def split_key_path(keys: str) -> tuple:
+    """
+    Split a dotted key string, e.g. "level1.level2", into a key path
+    tuple. The results are cached as the same strings are looked up over
+    and over again.
+
+    Args:
+        keys (str):
+            The dotted key string.
+
+    Return:
+        tuple:
+            The key path.
+    """
+    return tuple(keys.split("."))
+
+
+def _close_at_exit(settings_ref: weakref.ref) -> None:
+    """
+    Close a settings object at interpreter exit so any pending writes are
+    flushed. A weak reference is used so the settings can still be
+    garbage collected.
+
+    Args:
+        settings_ref (weakref.ref):
+            A weak reference to the settings object.
+
+    Return:
+        None
+    """
+    settings = settings_ref()
+    if settings is not None:
+        settings.close()
+
+
+def replace_setting(
+    settings: Any, key_path: tuple, value: Any, create_parents: bool = False
+) -> list:
+    """
+    Copy-on-write replacement of a value in a settings tree. Only the
+    mappings (and lists) along the key path are copied, everything else is
+    shared with the original tree, which is left untouched.
+
+    Args:
+        settings (Any):
+            The root of the settings tree.
+        key_path (tuple):
+            The keys leading to the value to replace.
+        value (Any):
+            The new value, or _MISSING to remove the key.
+        create_parents (bool):
+            Create any missing mappings along the key path rather than
+            raising a KeyError.
+
+    Return:
+        list:
+            The new node at each depth of the key path, starting with the
+            new root and ending with the new value.
+    """
+    old_nodes = [settings]
+    for key in key_path[:-1]:
+        node = old_nodes[-1]
+        if create_parents and isinstance(node, dict) and key not in node:
+            old_nodes.append(dict())
+        else:
+            old_nodes.append(node[key])
+    new_nodes = [value]
+    for depth in range(len(key_path) - 1, -1, -1):
+        new_node = copy.copy(old_nodes[depth])
+        if new_nodes[0] is _MISSING:
+            del new_node[key_path[depth]]
+        else:
+            new_node[key_path[depth]] = new_nodes[0]
+        new_nodes.insert(0, new_node)
+    return new_nodes
+
+
+def apply_changed_paths(
+    settings: Any, changed_settings: Any, key_paths: Iterable[tuple]
+) -> Any:
+    """
+    Copy-on-write application of the settings at some key paths from one
+    settings tree onto another, e.g. our unsaved changes onto settings
+    saved by another process. A key path missing from changed_settings is
+    removed. When the other tree has no room for a key path, such as a
+    value where a mapping was, the nearest parent that fits is replaced.
+
+    Args:
+        settings (any):
+            The settings to apply the changes to. They aren't changed.
+        changed_settings (any):
+            The settings holding the changes.
+        key_paths (Iterable):
+            The key paths that changed.
+
+    Return:
+        any:
+            The settings with the changes applied.
+    """
+    if not isinstance(settings, dict):
+        settings = dict()
+    for key_path in sorted(key_paths, key=len):
+        if not key_path:
+            settings = changed_settings
+            continue
+        for depth in range(len(key_path), 0, -1):
+            try:
+                value = reduce(
+                    operator.getitem, key_path[:depth], changed_settings
+                )
+            except (KeyError, IndexError, TypeError):
+                value = _MISSING
+            try:
+                if value is _MISSING:
+                    reduce(operator.getitem, key_path[:depth], settings)
+                settings = replace_setting(
+                    settings, key_path[:depth], value, create_parents=True
+                )[0]
+                break
+            except (KeyError, IndexError, TypeError):
+                if value is _MISSING:
+                    # It isn't in either, so there's nothing to remove.
+                    break
+    return settings
+
+
+def share_unchanged(old_settings: Any, new_settings: Any) -> Any:
+    """
+    Return new_settings, reusing every subtree of old_settings that is
+    equal to the subtree it replaces. After a reload this means only what
+    has actually changed takes up new memory, and later diffs and merges
+    skip the shared subtrees without looking inside them.
+
+    Args:
+        old_settings (any):
+            The previous settings tree.
+        new_settings (any):
+            The new settings tree, e.g. just parsed from the file.
+
+    Return:
+        any:
+            A tree equal to new_settings.
+    """
+    if old_settings is new_settings:
+        return old_settings
+    if not (isinstance(old_settings, dict) and isinstance(new_settings, dict)):
+        if type(old_settings) is type(new_settings) and (
+            old_settings == new_settings
+        ):
+            return old_settings
+        return new_settings
+    if old_settings == new_settings:
+        return old_settings
+    return {
+        key: (
+            share_unchanged(old_settings[key], value)
+            if key in old_settings
+            else value
+        )
+        for key, value in new_settings.items()
+    }
+
+
+def retained_size(root: Any, seen: set) -> int:
+    """
+    Measure the memory held by a settings tree that isn't held by anything
+    already measured. Containers are followed, everything else is counted
+    with sys.getsizeof.
+
+    Args:
+        root (any):
+            The settings tree, or any dict, list or tuple of them.
+        seen (set):
+            The ids of the objects already measured, which is updated.
+
+    Return:
+        int:
+            The size in bytes of the objects not seen before.
+    """
+    size = 0
+    pending = [root]
+    while pending:
+        node = pending.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        size += sys.getsizeof(node)
+        if isinstance(node, dict):
+            pending.extend(node.keys())
+            pending.extend(node.values())
+        elif isinstance(node, (list, tuple)):
+            pending.extend(node)
+    return size
+
+
+def merge_settings(
+    base: Any, overlay: Any, previous: Optional[tuple] = None
+) -> Any:
+    """
+    Deep merge one settings tree over another. Mappings are merged key by
+    key, anything else in the overlay replaces what is in the base. The
+    trees are never changed, and anything that doesn't need merging is
+    shared with them.
+
+    Passing the result of the last merge of this layer lets unchanged
+    subtrees be reused rather than merged again, so after a copy-on-write
+    change only the mappings along the changed key paths are rebuilt.
+
+    Args:
+        base (Any):
+            The lower settings tree.
+        overlay (Any):
+            The settings tree that takes precedence.
+        previous (tuple):
+            The (base, overlay, merged) of the last merge, if there was one.
+
+    Return:
+        any:
+            The merged settings tree.
+    """
+    if previous is not None and base is previous[0] and overlay is previous[1]:
+        return previous[2]
+    if not (isinstance(base, dict) and isinstance(overlay, dict)):
+        return overlay
+    if not overlay:
+        return base
+    if not base:
+        return overlay
+    old_base, old_overlay, old_merged = previous or (None, None, None)
+    reusable = (
+        isinstance(old_base, dict)
+        and isinstance(old_overlay, dict)
+        and isinstance(old_merged, dict)
+    )
+    merged = dict(base)
+    for key, value in overlay.items():
+        if key not in base:
+            merged[key] = value
+            continue
+        child_previous = None
+        if reusable and key in old_base and key in old_overlay:
+            child_previous = (old_base[key], old_overlay[key], old_merged[key])
+        merged[key] = merge_settings(base[key], value, child_previous)
+    return merged
+
+
+def environment_settings(prefix: str, environ: Optional[dict] = None) -> dict:
+    """
+    Build a settings tree from the environment variables that start with
+    prefix. The rest of the name is split on double underscores into a
+    lower case key path, and the value is parsed as YAML, so
+    MYAPP_SERVER__PORT=8080 becomes {"server": {"port": 8080}}.
+
+    Args:
+        prefix (str):
+            The prefix of the environment variables to use, e.g. "MYAPP_".
+        environ (dict):
+            The environment to read, defaults to os.environ.
+
+    Return:
+        dict:
+            The settings from the environment.
+    """
+    if environ is None:
+        environ = os.environ
+    settings: dict = {}
+    for name, raw_value in sorted(environ.items()):
+        if not name.startswith(prefix):
+            continue
+        key_path = tuple(
+            key.lower() for key in name[len(prefix) :].split("__")
+        )
+        if "" in key_path:
+            continue
+        try:
+            value = yaml.load(stream=raw_value, Loader=YamlLoader)
+        except yaml.YAMLError:
+            value = raw_value
+        try:
+            settings = replace_setting(
+                settings, key_path, value, create_parents=True
+            )[0]
+        except TypeError:
+            # A shorter variable has already set a value part way along
+            # this key path.
+            continue
+    return settings
+
+
+@dataclass(frozen=True)
+class MacSettingsSnapshot(object):
+    """
+    An immutable view of the settings. A new snapshot is swapped in
+    whenever the settings are loaded or changed, so a reader holding a
+    snapshot always sees a consistent set of settings.
+
+    Attributes:
+        settings (dict):
+            The settings tree. It is shared, so never change it in place.
+        path_index (dict):
+            Every key path in the settings mapped to its value.
+        version (int):
+            Incremented for every new snapshot.
+        layers (dict):
+            The settings tree of each layer, by layer name.
+        merged (tuple):
+            The cumulative merge of the layers, in SETTINGS_LAYERS order.
+            The last one is the settings.
+        typed (any):
+            The settings built with the registered schema, or None when
+            there isn't a schema.
+        lazy_sections (dict):
+            The documents of the user's top level sections that haven't
+            been parsed yet, by key.
+    """
+
+    settings: Any
+    path_index: dict
+    version: int
+    layers: dict
+    merged: tuple
+    typed: Any
+    lazy_sections: dict
+
+
+# The settings layers, lowest precedence first.
+SETTINGS_LAYERS = (
+    "defaults",
+    "user",
+    "fragments",
+    "environment",
+    "overrides",
+)
+
+# The files in a fragments directory that are settings fragments.
+FRAGMENT_EXTENSIONS = (".yaml", ".yml", ".json", ".toml")
+
+
+def update_path_index(
+    path_index: dict, key_path: tuple, old_value: Any, new_value: Any
+) -> None:
+    """
+    Keep a path index in step with a value being replaced. Any paths
+    under the old value are dropped and the paths under the new value are
+    added.
+
+    Args:
+        path_index (dict):
+            The path index to update in place.
+        key_path (tuple):
+            The key path of the value that has changed.
+        old_value (any):
+            The value being replaced, or _MISSING for a new key.
+        new_value (any):
+            The replacement value, or _MISSING if the key was removed.
+
+    Return:
+        None
+    """
+    for stale_path in flatten_settings(old_value, key_path):
+        path_index.pop(stale_path, None)
+    if new_value is _MISSING:
+        path_index.pop(key_path, None)
+        return
+    path_index[key_path] = new_value
+    path_index.update(flatten_settings(new_value, key_path))
+
+
+def patch_path_index(path_index: dict, settings: Any, changes: dict) -> dict:
+    """
+    Build the path index for a new settings tree from the index of the
+    old one and the diff between them (see dict_diff_paths), so only the
+    paths that changed are indexed again.
+
+    Args:
+        path_index (dict):
+            The path index of the old settings tree. It isn't changed.
+        settings (any):
+            The new settings tree.
+        changes (dict):
+            The key paths added, removed and changed between the trees.
+
+    Return:
+        dict:
+            The path index of the new settings tree.
+    """
+    if not isinstance(settings, dict):
+        return flatten_settings(settings)
+    path_index = dict(path_index)
+    for key_path, old_value in changes["removed"].items():
+        update_path_index(path_index, key_path, old_value, _MISSING)
+    for key_path, new_value in changes["added"].items():
+        update_path_index(path_index, key_path, _MISSING, new_value)
+    for key_path, (old_value, new_value) in changes["changed"].items():
+        update_path_index(path_index, key_path, old_value, new_value)
+    # The mappings above a change are new copies, so point the index at
+    # them, parents first.
+    ancestors = set()
+    for section in changes.values():
+        for key_path in section:
+            ancestors.update(
+                key_path[:depth] for depth in range(1, len(key_path))
+            )
+    for key_path in sorted(ancestors, key=len):
+        parent = path_index[key_path[:-1]] if len(key_path) > 1 else settings
+        path_index[key_path] = parent[key_path[-1]]
+    return path_index
+
+
+# Bump when the layout of the compiled settings cache changes.
+SETTINGS_CACHE_VERSION = 1
+
+
 class MacSettingsException(MacException):
     """
     Exception from MacSettings.
@@ -85,6 +673,274 @@ class MacSettingsWatchdogEvents(Enum):
     settings_file_deleted = auto()
 
 
+class MacSettingsDispatcher(object):
+    """
+    Run callbacks on a single background thread once they have gone
+    quiet for the debounce interval. Scheduling a callback that is already
+    waiting pushes it back, so a burst of file events becomes one call.
+    A dispatcher can be shared by any number of file change handlers, so
+    many settings files only need one thread between them.
+
+    Attributes:
+        mac_logger (logging.Logger):
+            The logger object for this class.
+        debounce_interval (float):
+            How many seconds a callback must go unscheduled before it runs.
+        __pending (dict):
+            The monotonic time each waiting callback is due, by callback.
+        __condition (Condition):
+            Guards the pending callbacks and wakes the dispatch thread.
+        __thread (Thread):
+            The dispatch thread, started by the first schedule.
+        __stopping (bool):
+            Tells the dispatch thread to stop.
+    """
+
+    mac_logger: logging.Logger
+    debounce_interval: float
+    __pending: dict
+    __condition: Condition
+    __thread: Optional[Thread]
+    __stopping: bool
+
+    def __init__(self, debounce_ms: int = 100) -> None:
+        """
+        Create the dispatcher. The thread isn't started until there is
+        something to run.
+
+        Args:
+            debounce_ms (int):
+                How many milliseconds a callback must go unscheduled
+                before it runs.
+        """
+        self.mac_logger = logging.getLogger(mac_logger.LOGGER_NAME)
+        self.debounce_interval = debounce_ms / 1000
+        self.__pending = dict()
+        self.__condition = Condition()
+        self.__thread = None
+        self.__stopping = False
+
+    def schedule(self, callback) -> None:
+        """
+        Run the callback on the dispatch thread once the debounce interval
+        has passed without it being scheduled again.
+
+        Args:
+            callback (Callable):
+                The function to call, with no arguments.
+
+        Return:
+            None
+        """
+        with self.__condition:
+            self.__pending[callback] = (
+                time.monotonic() + self.debounce_interval
+            )
+            if self.__thread is None:
+                self.__stopping = False
+                self.__thread = Thread(
+                    target=self._dispatch_loop,
+                    name=f"{self.__class__.__name__}",
+                    daemon=True,
+                )
+                self.__thread.start()
+            self.__condition.notify()
+
+    def cancel(self, callback) -> None:
+        """
+        Drop a callback that is waiting to run.
+
+        Args:
+            callback (Callable):
+                The scheduled function.
+
+        Return:
+            None
+        """
+        with self.__condition:
+            self.__pending.pop(callback, None)
+
+    def stop(self) -> None:
+        """
+        Stop the dispatch thread, dropping anything waiting to run.
+
+        Args:
+            None
+
+        Return:
+            None
+        """
+        with self.__condition:
+            self.__stopping = True
+            self.__pending.clear()
+            dispatch_thread = self.__thread
+            self.__thread = None
+            self.__condition.notify()
+        if dispatch_thread is not None:
+            dispatch_thread.join()
+
+    def _dispatch_loop(self) -> None:
+        """
+        Wait for callbacks to fall due and run them.
+
+        Args:
+            None
+
+        Return:
+            None
+        """
+        while True:
+            with self.__condition:
+                due_callbacks: list = []
+                while not self.__stopping:
+                    now = time.monotonic()
+                    due_callbacks = [
+                        callback
+                        for callback, due_time in self.__pending.items()
+                        if due_time <= now
+                    ]
+                    if due_callbacks:
+                        break
+                    timeout = None
+                    if self.__pending:
+                        timeout = min(self.__pending.values()) - now
+                    self.__condition.wait(timeout)
+                if self.__stopping:
+                    return
+                for callback in due_callbacks:
+                    del self.__pending[callback]
+            for callback in due_callbacks:
+                try:
+                    callback()
+                except Exception as err:
+                    # Keep going, the other callbacks still need to run.
+                    self.mac_logger.error(
+                        f"Error dispatching {callback}. Error: {err}"
+                    )
+
+
+class MacSettingsPathRouter(object):
+    """
+    Route settings changes to the callbacks subscribed to the key paths
+    they touch. Subscriptions are held in a trie keyed by the parts of
+    their key paths, so routing a change only visits the subscriptions
+    along its key path and below it, however many there are elsewhere.
+
+    A subscription to a key path is interested in changes to the key path
+    itself, to anything under it (e.g. ("database",) and
+    ("database", "host")) and to anything above it, since replacing
+    ("database",) can change ("database", "host").
+
+    Attributes:
+        __root (list):
+            The root node of the trie. A node is a list of [its key path,
+            its children by key, its callbacks].
+        __lock (Lock):
+            Guards changes to the trie.
+    """
+
+    __root: list
+    __lock: Lock
+
+    def __init__(self) -> None:
+        """
+        Create an empty router.
+        """
+        super(MacSettingsPathRouter, self).__init__()
+        self.__root = [(), dict(), list()]
+        self.__lock = Lock()
+
+    def subscribe(self, key_path: tuple, call_back) -> None:
+        """
+        Subscribe a callback to a key path.
+
+        Args:
+            key_path (tuple):
+                The key path, () for every change.
+            call_back (Callable):
+                The function to call with the matching changes.
+
+        Return:
+            None
+        """
+        with self.__lock:
+            node = self.__root
+            for depth, key in enumerate(key_path, start=1):
+                children = node[1]
+                if key not in children:
+                    children[key] = [key_path[:depth], dict(), list()]
+                node = children[key]
+            if call_back not in node[2]:
+                node[2].append(call_back)
+
+    def unsubscribe(self, key_path: tuple, call_back) -> None:
+        """
+        Unsubscribe a callback from a key path, pruning any branch of the
+        trie left without subscriptions.
+
+        Args:
+            key_path (tuple):
+                The key path it was subscribed to.
+            call_back (Callable):
+                The subscribed function.
+
+        Return:
+            None
+        """
+        with self.__lock:
+            nodes = [self.__root]
+            for key in key_path:
+                node = nodes[-1][1].get(key)
+                if node is None:
+                    return
+                nodes.append(node)
+            if call_back not in nodes[-1][2]:
+                return
+            nodes[-1][2].remove(call_back)
+            for key, node in zip(reversed(key_path), reversed(nodes)):
+                if node[1] or node[2]:
+                    break
+                parent = nodes[len(node[0]) - 1]
+                del parent[1][key]
+
+    def route(self, key_paths: Any) -> dict:
+        """
+        Find the callbacks interested in a set of changed key paths.
+
+        Args:
+            key_paths (Iterable):
+                The changed key paths.
+
+        Return:
+            dict:
+                The changed key paths for each (subscribed key path,
+                callback), in the order they were found.
+        """
+        routes: dict = {}
+        with self.__lock:
+            for key_path in key_paths:
+                node = self.__root
+                interested = [node]
+                for key in key_path:
+                    node = node[1].get(key)
+                    if node is None:
+                        break
+                    interested.append(node)
+                else:
+                    # Everything subscribed under a changed key path is
+                    # affected too.
+                    pending = list(node[1].values())
+                    while pending:
+                        node = pending.pop()
+                        interested.append(node)
+                        pending.extend(node[1].values())
+                for node in interested:
+                    for call_back in node[2]:
+                        route_key = (node[0], call_back)
+                        routes.setdefault(route_key, []).append(key_path)
+        return routes
+
+
 class MacSettingsWatchdogHandler(FileSystemEventHandler):
     """
     Set a watcher on the settings file, so we can check
@@ -101,6 +957,18 @@ class MacSettingsWatchdogHandler(FileSystemEventHandler):
             The event publisher object.
         events (list):
             A list of events that can be published.
+        debounce_interval (float):
+            How many seconds to wait for a burst of file changes to finish
+            before posting a single reload event. Zero posts straight away.
+        __pending_paths (list):
+            The paths changed during the current burst.
+        __pending_timer (Timer):
+            Posts the reload event once the burst is over.
+        __pending_lock (Lock):
+            Guards the pending paths and timer.
+        __dispatcher (MacSettingsDispatcher):
+            When set, posts the reload event once the burst is over
+            instead of a timer of our own.
 
     Methods:
         on_modified(event):
@@ -110,19 +978,44 @@ class MacSettingsWatchdogHandler(FileSystemEventHandler):
             Register whether the file has been created or not.
         on_delete(event):
             Register when the file has been deleted.
+        cancel():
+            Drop any reload event waiting for a burst to finish.
     """
 
     mac_logger: logging.Logger
     _pause_observer: bool = False
     events_publisher: MacEventPublisher
-
-    def __init__(self):
+    debounce_interval: float
+    __pending_paths: list
+    __pending_timer: Optional[Timer]
+    __pending_lock: Lock
+    __dispatcher: Optional[MacSettingsDispatcher]
+
+    def __init__(
+        self,
+        debounce_ms: int = 0,
+        dispatcher: Optional[MacSettingsDispatcher] = None,
+    ):
         """
         Store the main settings object
+
+        Args:
+            debounce_ms (int):
+                How many milliseconds of quiet to wait for before posting
+                the reload event. A single editor save can cause several
+                file events, and this turns them into a single reload.
+            dispatcher (MacSettingsDispatcher):
+                Post the reload event from a shared dispatcher, using its
+                debounce interval, rather than a timer thread of our own.
         """
         super(MacSettingsWatchdogHandler).__init__()
         self.mac_logger = logging.getLogger(mac_logger.LOGGER_NAME)
         self.events_publisher = MacEventPublisher(MacSettingsWatchdogEvents)
+        self.debounce_interval = debounce_ms / 1000
+        self.__pending_paths = list()
+        self.__pending_timer = None
+        self.__pending_lock = Lock()
+        self.__dispatcher = dispatcher
 
     def on_modified(self, event) -> None:
         """
@@ -136,324 +1029,2570 @@ class MacSettingsWatchdogHandler(FileSystemEventHandler):
         Return:
             None
         """
-        if not self._pause_observer:
-            self.mac_logger.debug("File change detected.")
-            update_event = MacEvent(
-                event_action=MacSettingsWatchdogEvents.reload_settings_file
+        if self._pause_observer:
+            return
+        self.mac_logger.debug("File change detected.")
+        src_path = getattr(event, "src_path", None)
+        if self.__dispatcher is not None:
+            with self.__pending_lock:
+                if src_path and src_path not in self.__pending_paths:
+                    self.__pending_paths.append(src_path)
+            self.__dispatcher.schedule(self._post_pending_reload)
+            return
+        if not self.debounce_interval:
+            update_event = MacEvent(
+                event_action=MacSettingsWatchdogEvents.reload_settings_file,
+                event_info={"paths": [src_path] if src_path else []},
+            )
+            self.events_publisher.post_event(event=update_event)
+            return
+        with self.__pending_lock:
+            if src_path and src_path not in self.__pending_paths:
+                self.__pending_paths.append(src_path)
+            if self.__pending_timer is not None:
+                self.__pending_timer.cancel()
+            self.__pending_timer = Timer(
+                self.debounce_interval, self._post_pending_reload
+            )
+            self.__pending_timer.daemon = True
+            self.__pending_timer.start()
+
+    def _post_pending_reload(self) -> None:
+        """
+        The burst of file changes is over, so post one reload event for
+        all of them.
+
+        Args:
+            None
+
+        Return:
+            None
+        """
+        with self.__pending_lock:
+            changed_paths = self.__pending_paths
+            self.__pending_paths = list()
+            self.__pending_timer = None
+        self.mac_logger.debug(f"Reloading after changes to {changed_paths}.")
+        update_event = MacEvent(
+            event_action=MacSettingsWatchdogEvents.reload_settings_file,
+            event_info={"paths": changed_paths},
+        )
+        try:
+            self.events_publisher.post_event(event=update_event)
+        except MacException:
+            # Already logged, and there is no caller to hand it back to.
+            pass
+
+    def cancel(self) -> None:
+        """
+        Drop any reload event waiting for a burst of changes to finish.
+
+        Args:
+            None
+
+        Return:
+            None
+        """
+        if self.__dispatcher is not None:
+            self.__dispatcher.cancel(self._post_pending_reload)
+        with self.__pending_lock:
+            if self.__pending_timer is not None:
+                self.__pending_timer.cancel()
+            self.__pending_timer = None
+            self.__pending_paths = list()
+
+    def on_created(self, event) -> None:
+        """
+        Register whether the file has been created or not.
+
+        Args:
+            event (_type_):
+                The file ceate event.
+
+        Return:
+            None
+        """
+        if not self._pause_observer:
+            self.mac_logger.debug("File created detected")
+            create_event = MacEvent(
+                event_action=MacSettingsWatchdogEvents.settings_file_created
+            )
+            self.events_publisher.post_event(event=create_event)
+
+    def on_delete(self, event) -> None:
+        """
+        Register when the file has been deleted
+
+        Args:
+            event (_type_):
+                The file delete event.
+
+        Return:
+            None
+        """
+        if not self._pause_observer:
+            self.mac_logger.debug("File delete detected")
+            delete_event = MacEvent(
+                event_action=MacSettingsWatchdogEvents.settings_file_deleted
+            )
+            self.events_publisher.post_event(event=delete_event)
+
+
+class MacSettingsEvents(Enum):
+    """
+    Events for the settings file.
+
+    The event_info of settings_changed always holds the "added", "removed"
+    and "changed" key paths from dict_diff_paths. Changes made through
+    __setitem__ also include "setting_changed" and "new_value", and those
+    made in a transaction include "settings_changed". settings_timing is
+    only posted when stats are collected with events, and its event_info
+    holds the "name" and "seconds" of a timing. Callbacks
+    subscribed to a key path with MacSettingsStore.subscribe get just the
+    changes that touch it, plus the "key_path" subscribed to.
+    """
+
+    settings_changed = auto()
+    settings_loaded = auto()
+    settings_timing = auto()
+
+
+class MacSettingsWriteLock(object):
+    """
+    A reentrant lock that knows whether the current thread holds it.
+
+    Attributes:
+        __lock (RLock):
+            The lock.
+        __state (local):
+            How many times each thread has acquired the lock.
+    """
+
+    __lock: RLock
+    __state: local
+
+    def __init__(self) -> None:
+        """
+        Set up the lock.
+
+        Args:
+            None
+        """
+        self.__lock = RLock()
+        self.__state = local()
+
+    def acquire(self) -> bool:
+        """
+        Acquire the lock.
+
+        Args:
+            None
+
+        Return:
+            bool:
+                True once the lock is held.
+        """
+        self.__lock.acquire()
+        state = self.__state
+        state.depth = getattr(state, "depth", 0) + 1
+        return True
+
+    def release(self) -> None:
+        """
+        Release the lock.
+
+        Args:
+            None
+
+        Return:
+            None
+        """
+        self.__state.depth -= 1
+        self.__lock.release()
+
+    def held(self) -> bool:
+        """
+        Whether the current thread holds the lock.
+
+        Args:
+            None
+
+        Return:
+            bool:
+                True if it does.
+        """
+        return bool(getattr(self.__state, "depth", 0))
+
+    def __enter__(self) -> "MacSettingsWriteLock":
+        """
+        Acquire the lock.
+
+        Args:
+            None
+
+        Return:
+            MacSettingsWriteLock:
+                The lock.
+        """
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """
+        Release the lock.
+
+        Args:
+            exc_info (any):
+                The exception raised while holding the lock, if any.
+
+        Return:
+            None
+        """
+        self.release()
+
+
+class MacSettingsStore(object):
+    """
+    The settings for a single settings file. Use MacSettings for the
+    application's settings, or MacSettingsManager to hold many stores in
+    one process.
+    Make sure the logger is initialised before calling this class.
+
+    Attributes:
+        mac_logger (logging.Logger):
+            The logger object for this class.
+        settings_file_directory (str):
+            The directory where the settings file should be.
+        settings_file_path (str):
+            The full path to the settings file.
+        settings_cache_path (str):
+            The full path to the compiled settings cache, or None when the
+            cache isn't in use.
+        storage (MacSettingsStorage):
+            The storage backend for the settings file.
+        default_settings_path (str):
+            The full path to the default settings file.
+        merge_defaults (bool):
+            Whether the default settings are merged under the user's.
+        env_prefix (str):
+            The prefix of the environment variables that override the
+            settings, or None to ignore the environment.
+        lazy_load (bool or frozenset):
+            Whether the top level sections of the user's settings are
+            parsed when first used, or the keys of the sections that are.
+        events_publisher (MacEventPublisher):
+            The event publisher object.
+        __path_router (MacSettingsPathRouter):
+            The callbacks subscribed to changes under a key path.
+        __file_watcher (MacFileWatcher):
+            The watcher for the settings file, or None when the file isn't
+            being watched.
+        __file_change_handler (MacSettingsWatchdogHandler):
+            The file change handler object.
+        __snapshot (MacSettingsSnapshot):
+            The current settings, their layers, their key path index and
+            their typed view. Readers take a reference to it without
+            locking.
+        __schema (MacSchema):
+            The compiled schema for the typed settings, or None.
+        __write_lock (MacSettingsWriteLock):
+            Serialises writers, and is held for the life of a transaction.
+        __transaction_depth (int):
+            How many transactions are currently open.
+        __transaction_log (list):
+            The (key path, new value) of every change made in the open
+            transaction(s).
+        __write_behind_interval (float):
+            The minimum number of seconds between background writes, or
+            None when every change is saved straight away.
+        __dirty (bool):
+            Whether there are changes waiting to be written.
+        __dirty_event (Event):
+            Wakes the background writer when there are changes to write.
+        __writer_stopping (Event):
+            Tells the background writer to stop.
+        __writer_thread (Thread):
+            The background writer thread.
+        __last_flush (float):
+            The monotonic time of the last background write.
+        __write_stats (dict):
+            Counts of the writes requested, flushed and coalesced.
+        __settings_digest (str):
+            The SHA-256 of the settings file when we last loaded or saved
+            it, used to skip reloads when the content hasn't changed.
+        __unsaved_paths (set):
+            The key paths changed in the user's settings since they were
+            last loaded or saved, for storage that can save just those.
+        __file_lock (MacSettingsFileLock):
+            The lock file shared with other writers when concurrent_writes
+            is set, otherwise None.
+        __file_generation (int):
+            The generation of the settings file when we last loaded or
+            saved it.
+        fragments_dir (str):
+            The directory of settings fragments, or None.
+        __fragments (dict):
+            The (file signature, digest, settings) of each fragment, by
+            path, in the order they're merged.
+        __fragment_merges (dict):
+            The (base, fragment, merged) of the last merge of each
+            fragment, by path, so unchanged fragments aren't merged again.
+        __history (deque):
+            The (time, snapshot, fragment cache) of the most recent
+            previous settings, oldest first, without their path indexes.
+            The fragment cache is the (__fragments, __fragment_merges)
+            the snapshot's fragments layer was built from.
+        __pending_timings (deque):
+            The (name, seconds) of the timings waiting to be posted as
+            settings_timing events.
+        __dispatch_state (local):
+            How deep each thread is in posting events.
+        __stats (MacSettingsStats):
+            The timings and counters, or None when they aren't collected.
+        events (list):
+            The list of valid events that can be published.
+        yaml_backend (str):
+            "libyaml" when the C loader and dumper are in use, otherwise
+            "python".
+    """
+
+    mac_logger: logging.Logger
+    settings_file_directory: str
+    settings_file_path: str
+    settings_cache_path: Optional[str]
+    storage: MacSettingsStorage
+    default_settings_path: str
+    merge_defaults: bool
+    env_prefix: Optional[str]
+    lazy_load: Union[bool, frozenset]
+    events_publisher: MacEventPublisher
+    __path_router: MacSettingsPathRouter
+    __file_watcher: Optional[MacFileWatcher]
+    __file_change_handler: MacSettingsWatchdogHandler
+    __snapshot: MacSettingsSnapshot
+    __schema: Optional[MacSchema]
+    __write_lock: MacSettingsWriteLock
+    __transaction_depth: int
+    __transaction_log: list
+    __write_behind_interval: Optional[float]
+    __dirty: bool
+    __dirty_event: Event
+    __writer_stopping: Event
+    __writer_thread: Optional[Thread]
+    __last_flush: float
+    __write_stats: dict
+    __settings_digest: Optional[str]
+    __unsaved_paths: set
+    __file_lock: Optional[MacSettingsFileLock]
+    __file_generation: Optional[int]
+    fragments_dir: Optional[str]
+    __fragments: dict
+    __fragment_merges: dict
+    __history: deque
+    __pending_timings: deque
+    __dispatch_state: local
+    __stats: Optional[MacSettingsStats]
+    events = ["settings_change", "settings_loaded"]
+    yaml_backend: str = YAML_BACKEND
+
+    def __init__(
+        self,
+        app_name: str,
+        default_settings_path: str,
+        write_behind_ms: Optional[int] = None,
+        use_cache: bool = False,
+        reload_debounce_ms: int = 100,
+        watch: Union[bool, str, MacFileWatcher] = True,
+        merge_defaults: bool = False,
+        env_prefix: Optional[str] = None,
+        schema: Union[type, dict, MacSchema, None] = None,
+        settings_file_path: Optional[str] = None,
+        dispatcher: Optional[MacSettingsDispatcher] = None,
+        storage: Union[str, MacSettingsStorage, None] = None,
+        lazy_load: Union[bool, Iterable[str]] = False,
+        history_size: int = 10,
+        collect_stats: bool = False,
+        concurrent_writes: bool = False,
+        fragments_dir: Optional[str] = None,
+    ) -> None:
+        """
+        Initialise the settings store.
+
+        The settings are resolved from layers, each overriding the one
+        before: the default settings file (when merge_defaults is set), the
+        user's settings file, environment variables (when env_prefix is
+        set) and runtime overrides (see set_override). Only the user's
+        settings are saved.
+
+        Args:
+            app_name (str):
+                The name of the app. This will translate into the name of the
+                settings file/directory to make things easy to find.
+            default_settings_path (str):
+                The path where the settings file should exist.
+            write_behind_ms (int):
+                When set, changes are written by a background thread at most
+                once every write_behind_ms milliseconds, instead of on the
+                caller's thread. Pending changes are written by flush(),
+                close() and at exit.
+            use_cache (bool):
+                Keep a compiled copy of the parsed settings next to the
+                settings file, and use it instead of parsing the YAML while
+                the file's size, modification time and hash are unchanged.
+            reload_debounce_ms (int):
+                How many milliseconds to wait for a burst of file events
+                to finish before reloading the settings once.
+            watch (bool, str or MacFileWatcher):
+                Watch the settings file for changes made by other
+                processes. True uses watchdog, or name a watcher from
+                mac_file_watch ("watchdog", "poll" or "inotify"), or pass
+                a watcher object. Turn this off for short lived or read
+                only processes to avoid starting a file watcher at all.
+            merge_defaults (bool):
+                Merge the default settings under the user's settings, so
+                new default settings show up without the user's file
+                needing to be recreated.
+            env_prefix (str):
+                Override settings with the environment variables starting
+                with this prefix, e.g. "MYAPP_" lets MYAPP_SERVER__PORT
+                override the "server", "port" setting.
+            schema (type, dict or MacSchema):
+                A schema for the typed settings, see register_schema.
+            settings_file_path (str):
+                Use this settings file instead of the one for app_name in
+                the platform's settings directory.
+            dispatcher (MacSettingsDispatcher):
+                Reload the settings from a shared dispatcher thread, using
+                its debounce interval instead of reload_debounce_ms.
+            storage (str or MacSettingsStorage):
+                The format of the settings file, "yaml" (the default),
+                "json", "toml" (read only) or "sqlite", or a storage
+                backend from mac_storage. The default settings file can be
+                in any of the formats.
+            lazy_load (bool or Iterable):
+                Only parse the top level sections of the user's settings
+                when they are first used, e.g. for large lookup tables
+                that few code paths need. True makes every section lazy,
+                or give the keys of the sections to make lazy. Only YAML
+                settings files can be loaded lazily, and not when there's
+                a schema. Saving, get_all_settings and get_layer_settings
+                parse every section. A change to a section that hasn't
+                been used is picked up when it's first used, without a
+                settings_changed event.
+            history_size (int):
+                How many previous versions of the settings to keep for
+                rollback. Versions share everything that didn't change.
+            collect_stats (bool):
+                Collect timings and counters, see enable_stats.
+            concurrent_writes (bool):
+                Set this in every process that saves the settings file.
+                Saves take a lock file (the settings file with .lock
+                added) holding a generation that each save bumps. If
+                another process has saved since we loaded, the file is
+                read again and only the settings we changed are applied
+                on top of it. Otherwise the last save wins and the other
+                process's changes are lost.
+            fragments_dir (str):
+                A conf.d style directory of settings fragments, e.g. one
+                per team. Every YAML, JSON and TOML file in it is merged
+                over the user's settings in file name order, and a
+                change to one is picked up by parsing and merging just
+                that fragment. Fragments aren't saved, and a setting
+                made in a fragment can only be overridden by the
+                environment or set_override. Fragments added to or
+                removed from the directory are picked up by
+                reload_fragments() or load_settings().
+        """
+        super().__init__()
+        self.storage = get_settings_storage(storage)
+        if settings_file_path is not None:
+            self.settings_file_directory = os.path.dirname(
+                os.path.abspath(settings_file_path)
+            )
+            self.settings_file_path = settings_file_path
+        elif "win32" == sys.platform:  # pragma: no cover
+            # Use the standard Windows config file storage area
+            self.settings_file_directory = os.getenv("LOCALAPPDATA")
+        elif "darwin" == sys.platform:  # pragma: no cover
+            self.settings_file_directory = os.path.expanduser(
+                "~/Library/Application Support"
+            )
+        else:
+            # Not using Windows, nor mac so assume Linux/BSD
+            self.settings_file_directory = os.path.expanduser("~/.config")
+
+        if settings_file_path is None:
+            self.settings_file_directory = (
+                f"{self.settings_file_directory}/" f"{app_name}"
+            )
+            self.settings_file_path = (
+                f"{self.settings_file_directory}"
+                f"/{app_name}.{self.storage.extension}"
+            )
+        self.settings_cache_path = None
+        if use_cache:
+            self.settings_cache_path = f"{self.settings_file_path}.cache"
+        self.default_settings_path = default_settings_path
+        if lazy_load is not True and lazy_load:
+            lazy_load = frozenset(lazy_load)
+        self.lazy_load = lazy_load or False
+        self.merge_defaults = merge_defaults
+        self.env_prefix = env_prefix
+        self.mac_logger = logging.getLogger(mac_logger.LOGGER_NAME)
+        self.__snapshot = MacSettingsSnapshot(
+            settings=dict(),
+            path_index=dict(),
+            version=0,
+            layers={layer: dict() for layer in SETTINGS_LAYERS},
+            merged=(),
+            typed=None,
+            lazy_sections=dict(),
+        )
+        self.__schema = None
+        if schema is not None:
+            self.__schema = compile_schema(schema)
+        self.__write_lock = MacSettingsWriteLock()
+        self.__transaction_depth = 0
+        self.__transaction_log = list()
+        self.__write_behind_interval = None
+        if write_behind_ms is not None:
+            self.__write_behind_interval = write_behind_ms / 1000
+            # Once for the life of the store, however many times the
+            # background writer is started.
+            atexit.register(_close_at_exit, weakref.ref(self))
+        self.__dirty = False
+        self.__dirty_event = Event()
+        self.__writer_stopping = Event()
+        self.__writer_thread = None
+        self.__last_flush = 0.0
+        self.__write_stats = {
+            "writes_requested": 0,
+            "writes_flushed": 0,
+            "writes_coalesced": 0,
+        }
+        self.__settings_digest = None
+        self.__unsaved_paths = set()
+        self.__file_lock = None
+        if concurrent_writes:
+            self.__file_lock = MacSettingsFileLock(
+                f"{self.settings_file_path}.lock"
+            )
+        self.__file_generation = None
+        self.fragments_dir = None
+        if fragments_dir is not None:
+            self.fragments_dir = os.path.abspath(fragments_dir)
+        self.__fragments = dict()
+        self.__fragment_merges = dict()
+        self.__history = deque(maxlen=history_size)
+        # Bounded, in case nothing is ever posted to flush them.
+        self.__pending_timings = deque(maxlen=10000)
+        self.__dispatch_state = local()
+        self.__stats = None
+        if collect_stats:
+            self.enable_stats()
+        self.events_publisher = MacEventPublisher(MacSettingsEvents)
+        self.__path_router = MacSettingsPathRouter()
+        if not pathlib.Path(self.default_settings_path).exists():
+            raise MacSettingsException(
+                str_message="The default settings file"
+                f" {self.default_settings_path} does "
+                "not exist. This is a terminal "
+                "failure."
+            )
+        if not pathlib.Path(self.settings_file_path).exists():
+            self.mac_logger.info(
+                f"The settings file {self.settings_file_path} does "
+                "not exist. Creating a new one..."
+            )
+            self._copy_default_settings()
+        # Set the file watchdog to pick up any changes made to the settings
+        # file from outside this process.
+        self.__file_change_handler = MacSettingsWatchdogHandler(
+            debounce_ms=reload_debounce_ms, dispatcher=dispatcher
+        )
+        self.__file_watcher = None
+        if watch is True:
+            watch = "watchdog"
+        if isinstance(watch, str):
+            watch = get_file_watcher(backend=watch)
+        if watch:
+            watch.watch(
+                path=self.settings_file_path,
+                handler=self.__file_change_handler,
+            )
+            self.__file_watcher = watch
+        # Register ourseleves with the event service to pick up
+        # file change notifications.
+        self.__file_change_handler.events_publisher.register(
+            event_action=MacSettingsWatchdogEvents.reload_settings_file,
+            subscriber_callback=self.reload_settings_from_file,
+        )
+
+    def load_settings(self) -> Optional[dict]:
+        """
+        Load the settings direct from the file.
+
+        Args:
+            None
+
+        Return:
+            dict:
+                A dictionary of the settings in the YAML file to make walking
+                the setting very easy. When loading lazily, it doesn't
+                have the sections that haven't been used yet.
+        """
+        with self._locked():
+            with self._file_locked() as file_lock:
+                document, file_stat = self._read_settings_file()
+            digest = hashlib.sha256(document).hexdigest()
+            user_settings, lazy_sections = self._parse_user_settings(
+                document=document, file_stat=file_stat, digest=digest
+            )
+            layers = {"user": user_settings}
+            if self.merge_defaults:
+                layers["defaults"] = self._read_default_settings()
+            fragment_cache = None
+            if self.fragments_dir is not None:
+                layers["fragments"], *fragment_cache = self._read_fragments()
+            if self.env_prefix:
+                layers["environment"] = environment_settings(
+                    prefix=self.env_prefix
+                )
+            # A section in another layer is merged with the user's, so it
+            # has to be parsed now.
+            layers["user"], lazy_sections = self._parse_lazy_sections(
+                user_settings=user_settings,
+                lazy_sections=lazy_sections,
+                keys=self._layered_sections(
+                    lazy_sections,
+                    layers.get("defaults"),
+                    layers.get("fragments"),
+                    layers.get("environment"),
+                    self.__snapshot.layers["overrides"],
+                ),
+            )
+            for layer, layer_settings in layers.items():
+                layers[layer] = share_unchanged(
+                    self.__snapshot.layers[layer], layer_settings
+                )
+            self._swap_layers(lazy_sections=lazy_sections, **layers)
+            if fragment_cache is not None:
+                self._set_fragment_cache(*fragment_cache)
+            self.__settings_digest = digest
+            self.__unsaved_paths = set()
+            if file_lock is not None:
+                self.__file_generation = file_lock.generation
+            app_settings = self.__snapshot.settings
+        self.mac_logger.info("Successfully loaded the settings.")
+        change_event = MacEvent(event_action=MacSettingsEvents.settings_loaded)
+        with self._dispatching(), self._timed("dispatch"):
+            self.events_publisher.post_event(event=change_event)
+        return app_settings
+
+    def reload_settings_from_file(
+        self, event: Optional[MacEvent] = None
+    ) -> None:
+        """
+        Reload the settings. Nothing is parsed if the file's content is the
+        same as when we last loaded or saved it, e.g. the file event was
+        caused by our own save or only touched the file.
+
+        Args:
+            event (MacEvent):
+                The file change event when called by the file watcher.
+                When it's only for fragments, just those are reloaded.
+
+        Return:
+            None
+        """
+        paths = []
+        if event is not None and isinstance(event.event_info, dict):
+            paths = event.event_info.get("paths") or []
+        if self.fragments_dir is not None and paths:
+            fragment_paths = [
+                path for path in paths if self._is_fragment_path(path)
+            ]
+            if fragment_paths:
+                self.reload_fragments(fragment_paths)
+                if len(fragment_paths) == len(paths):
+                    return
+        self.mac_logger.debug("Reloading the settings from the file.")
+        with self._locked():
+            with self._file_locked() as file_lock:
+                document, file_stat = self._read_settings_file()
+            if file_lock is not None:
+                self.__file_generation = file_lock.generation
+            digest = hashlib.sha256(document).hexdigest()
+            if digest == self.__settings_digest:
+                self.mac_logger.debug("The settings file has not changed.")
+                if self.__stats is not None:
+                    self.__stats.count("reloads_skipped")
+                return
+            # Only the user's layer has changed, so only it is parsed and
+            # merged again.
+            user_settings, lazy_sections = self._parse_user_settings(
+                document=document, file_stat=file_stat, digest=digest
+            )
+            # Sections that have been used are parsed again, so their
+            # changes are posted.
+            snapshot = self.__snapshot
+            user_settings, lazy_sections = self._parse_lazy_sections(
+                user_settings=user_settings,
+                lazy_sections=lazy_sections,
+                keys=self._layered_sections(
+                    lazy_sections,
+                    *snapshot.layers.values(),
+                ),
+            )
+            unsaved_paths = set()
+            if self.__unsaved_paths:
+                # Keep the changes we haven't saved yet, e.g. in
+                # write-behind mode, on top of the file's settings.
+                unsaved_paths = self.__unsaved_paths
+                user_settings, lazy_sections = self._parse_lazy_sections(
+                    user_settings=user_settings,
+                    lazy_sections=lazy_sections,
+                    keys={
+                        key_path[0] for key_path in unsaved_paths if key_path
+                    },
+                )
+                user_settings = apply_changed_paths(
+                    user_settings, snapshot.layers["user"], unsaved_paths
+                )
+            changes = self._swap_layers(
+                lazy_sections=lazy_sections,
+                user=share_unchanged(
+                    snapshot.layers["user"], user_settings
+                ),
+            )
+            self.__settings_digest = digest
+            self.__unsaved_paths = unsaved_paths
+        self.mac_logger.info("Successfully loaded the settings.")
+        change_event = MacEvent(event_action=MacSettingsEvents.settings_loaded)
+        with self._dispatching(), self._timed("dispatch"):
+            self.events_publisher.post_event(event=change_event)
+        self._post_changes(changes)
+
+    def _parse_user_settings(
+        self, document: bytes, file_stat: os.stat_result, digest: str
+    ) -> tuple:
+        """
+        Parse the user's settings file. When loading lazily, the sections
+        that can be are split out to parse when they're first used.
+
+        Args:
+            document (bytes):
+                The document of the settings file.
+            file_stat (os.stat_result):
+                The stat of the settings file.
+            digest (str):
+                The SHA-256 of the document.
+
+        Return:
+            tuple:
+                The parsed settings and the documents of the sections
+                still to be parsed, by key.
+        """
+        if self.lazy_load and self.__schema is None:
+            split_document = self.storage.split_sections(
+                document, None if self.lazy_load is True else self.lazy_load
+            )
+            if split_document is not None:
+                user_settings = self._parse_settings(
+                    document=split_document[0],
+                    file_stat=file_stat,
+                    digest=digest,
+                    file_path=self.settings_file_path,
+                    cache_path=None,
+                    storage=self.storage,
+                )
+                if user_settings is None:
+                    user_settings = dict()
+                if isinstance(user_settings, dict):
+                    return user_settings, split_document[1]
+        user_settings = self._parse_settings(
+            document=document,
+            file_stat=file_stat,
+            digest=digest,
+            file_path=self.settings_file_path,
+            cache_path=self.settings_cache_path,
+            storage=self.storage,
+        )
+        return user_settings, dict()
+
+    @staticmethod
+    def _layered_sections(lazy_sections: dict, *layers: Any) -> list:
+        """
+        Find the sections still to be parsed that are in other settings.
+
+        Args:
+            lazy_sections (dict):
+                The sections still to be parsed, by key.
+            layers (any):
+                The other settings.
+
+        Return:
+            list:
+                The keys of the sections found.
+        """
+        return [
+            key
+            for key in lazy_sections
+            if any(
+                isinstance(layer, dict) and key in layer for layer in layers
+            )
+        ]
+
+    def _parse_lazy_sections(
+        self, user_settings: Any, lazy_sections: dict, keys: Iterable[str]
+    ) -> tuple:
+        """
+        Parse some of the sections still to be parsed into the user's
+        settings.
+
+        Args:
+            user_settings (any):
+                The user's settings. They aren't changed.
+            lazy_sections (dict):
+                The sections still to be parsed, by key. They aren't
+                changed.
+            keys (Iterable):
+                The keys of the sections to parse.
+
+        Return:
+            tuple:
+                The new user's settings and sections still to be parsed.
+        """
+        keys = [key for key in keys if key in lazy_sections]
+        if not keys:
+            return user_settings, lazy_sections
+        user_settings = dict(user_settings or {})
+        lazy_sections = dict(lazy_sections)
+        for key in keys:
+            try:
+                with self._timed("parse"):
+                    user_settings[key] = self.storage.parse_section(
+                        key=key,
+                        section_document=lazy_sections.pop(key),
+                        file_path=self.settings_file_path,
+                    )
+            except MacStorageException as storage_error:
+                raise MacSettingsException(str(storage_error))
+            self.mac_logger.debug(f"Parsed the {key} section.")
+        return user_settings, lazy_sections
+
+    def _load_lazy_sections(self, keys: Optional[Iterable] = None) -> None:
+        """
+        Parse sections still to be parsed and swap them into the settings.
+        This doesn't change the settings, so no event is posted.
+
+        Args:
+            keys (Iterable):
+                The keys of the sections, or None for all of them.
+
+        Return:
+            None
+        """
+        with self.__write_lock:
+            snapshot = self.__snapshot
+            if keys is None:
+                keys = list(snapshot.lazy_sections)
+            user_settings, lazy_sections = self._parse_lazy_sections(
+                user_settings=snapshot.layers["user"],
+                lazy_sections=snapshot.lazy_sections,
+                keys=keys,
+            )
+            if lazy_sections is not snapshot.lazy_sections:
+                self._swap_layers(
+                    lazy_sections=lazy_sections,
+                    record_history=False,
+                    user=user_settings,
+                )
+
+    def _read_settings_file(
+        self,
+        file_path: Optional[str] = None,
+        storage: Optional[MacSettingsStorage] = None,
+    ) -> tuple:
+        """
+        Read the raw settings file.
+
+        Args:
+            file_path (str):
+                The file to read, defaults to the settings file.
+            storage (MacSettingsStorage):
+                The storage backend for the file, defaults to ours.
+
+        Return:
+            tuple:
+                The file's document as bytes and its os.stat_result.
+        """
+        if file_path is None:
+            file_path = self.settings_file_path
+        if storage is None:
+            storage = self.storage
+        self.mac_logger.debug(f"Loading settings from {file_path}")
+        try:
+            with self._timed("read"):
+                return storage.read(file_path)
+        except MacStorageException as storage_error:
+            raise MacSettingsException(str(storage_error))
+
+    def _read_default_settings(self) -> Any:
+        """
+        Read and parse the default settings file, in whichever format its
+        extension says it's in. When the compiled cache is in use, the
+        defaults have a cache of their own.
+
+        Args:
+            None
+
+        Return:
+            any:
+                The default settings.
+        """
+        storage = storage_for_path(self.default_settings_path)
+        document, file_stat = self._read_settings_file(
+            file_path=self.default_settings_path, storage=storage
+        )
+        cache_path = None
+        if self.settings_cache_path is not None:
+            cache_path = f"{self.settings_file_path}.defaults.cache"
+        return self._parse_settings(
+            document=document,
+            file_stat=file_stat,
+            digest=hashlib.sha256(document).hexdigest(),
+            file_path=self.default_settings_path,
+            cache_path=cache_path,
+            storage=storage,
+        )
+
+    def _is_fragment_path(self, path: str) -> bool:
+        """
+        Check whether a changed path is the fragments directory or a file
+        in it.
+
+        Args:
+            path (str):
+                The changed path.
+
+        Returns:
+            bool:
+                True if it's for the fragments.
+        """
+        path = os.path.abspath(path)
+        return self.fragments_dir in (path, os.path.dirname(path))
+
+    def _fragment_paths(self) -> list:
+        """
+        List the fragments in the fragments directory, in the order
+        they're merged. Hidden files and files of other types, such as an
+        editor's backups, are skipped.
+
+        Args:
+            None
+
+        Returns:
+            list:
+                The paths of the fragments.
+        """
+        try:
+            file_names = sorted(os.listdir(self.fragments_dir))
+        except OSError:
+            return []
+        return [
+            os.path.join(self.fragments_dir, file_name)
+            for file_name in file_names
+            if not file_name.startswith(".")
+            and os.path.splitext(file_name)[1].lower() in FRAGMENT_EXTENSIONS
+            and os.path.isfile(os.path.join(self.fragments_dir, file_name))
+        ]
+
+    def _read_fragments(self, paths: Optional[Iterable[str]] = None) -> tuple:
+        """
+        Read the fragments and merge them into the fragments layer. Only
+        fragments whose file has changed are parsed, and only those and
+        the fragments after them are merged again. The caller must hold
+        the write lock, and keeps the fragment cache returned once the
+        layer has been swapped in.
+
+        Args:
+            paths (Iterable):
+                The fragments that may have changed, or None to check the
+                whole directory, picking up new and removed fragments.
+
+        Returns:
+            tuple:
+                The fragments layer, and the fragments and fragment merges
+                it was built from.
+        """
+        fragments = dict(self.__fragments)
+        if paths is None:
+            paths = self._fragment_paths()
+            for path in set(fragments) - set(paths):
+                del fragments[path]
+        for path in paths:
+            try:
+                file_stat = os.stat(path)
+            except OSError:
+                fragments.pop(path, None)
+                continue
+            signature = (file_stat.st_size, file_stat.st_mtime_ns)
+            fragment = fragments.get(path)
+            if fragment is not None and fragment[0] == signature:
+                continue
+            storage = storage_for_path(path)
+            document, file_stat = self._read_settings_file(
+                file_path=path, storage=storage
+            )
+            digest = hashlib.sha256(document).hexdigest()
+            if fragment is not None and fragment[1] == digest:
+                fragments[path] = (signature, digest, fragment[2])
+                continue
+            cache_path = None
+            if self.settings_cache_path is not None:
+                cache_path = (
+                    f"{self.settings_file_path}."
+                    f"{os.path.basename(path)}.cache"
+                )
+            fragment_settings = self._parse_settings(
+                document=document,
+                file_stat=file_stat,
+                digest=digest,
+                file_path=path,
+                cache_path=cache_path,
+                storage=storage,
+            )
+            self.mac_logger.debug(f"Parsed the settings fragment {path}.")
+            fragments[path] = (signature, digest, fragment_settings)
+        fragments = {path: fragments[path] for path in sorted(fragments)}
+        merged = None
+        fragment_merges = dict()
+        for path, (_, _, fragment_settings) in fragments.items():
+            result = merge_settings(
+                merged, fragment_settings, self.__fragment_merges.get(path)
+            )
+            fragment_merges[path] = (merged, fragment_settings, result)
+            merged = result
+        if merged is None:
+            merged = dict()
+        return merged, fragments, fragment_merges
+
+    def _set_fragment_cache(
+        self, fragments: dict, fragment_merges: dict
+    ) -> None:
+        """
+        Keep the fragments and fragment merges the current fragments layer
+        was built from, watching the fragments that have been added and no
+        longer watching those that have gone. The caller must hold the
+        write lock.
+
+        Args:
+            fragments (dict):
+                The (file signature, digest, settings) of each fragment,
+                by path.
+            fragment_merges (dict):
+                The (base, fragment, merged) of each fragment, by path.
+
+        Return:
+            None
+        """
+        self._watch_fragments(self.__fragments, fragments)
+        self.__fragments = fragments
+        self.__fragment_merges = fragment_merges
+
+    def _watch_fragments(
+        self, old_paths: Iterable, new_paths: Iterable
+    ) -> None:
+        """
+        Watch the fragments that have been added, and stop watching those
+        that have been removed.
+
+        Args:
+            old_paths (Iterable):
+                The fragments watched.
+            new_paths (Iterable):
+                The fragments to watch.
+
+        Return:
+            None
+        """
+        if self.__file_watcher is None:
+            return
+        for path in set(old_paths) - set(new_paths):
+            self.__file_watcher.unwatch(
+                path=path, handler=self.__file_change_handler
+            )
+        for path in set(new_paths) - set(old_paths):
+            self.__file_watcher.watch(
+                path=path, handler=self.__file_change_handler
+            )
+
+    def reload_fragments(self, paths: Optional[Iterable[str]] = None) -> None:
+        """
+        Reload the settings fragments, parsing and merging only those that
+        have changed.
+
+        Args:
+            paths (Iterable):
+                The fragments that have changed, or None (or the fragments
+                directory) to check them all, picking up new and removed
+                fragments.
+
+        Return:
+            None
+        """
+        if self.fragments_dir is None:
+            return
+        if paths is not None:
+            paths = [os.path.abspath(path) for path in paths]
+            if self.fragments_dir in paths:
+                paths = None
+        with self._locked():
+            fragments_layer, *fragment_cache = self._read_fragments(paths)
+            snapshot = self.__snapshot
+            if fragments_layer is snapshot.layers["fragments"]:
+                self._set_fragment_cache(*fragment_cache)
+                return
+            # The user's sections the fragments are merged with have to be
+            # parsed first.
+            self._load_lazy_sections(
+                self._layered_sections(
+                    snapshot.lazy_sections, fragments_layer
+                )
+            )
+            changes = self._swap_layers(fragments=fragments_layer)
+            self._set_fragment_cache(*fragment_cache)
+        self.mac_logger.info("Successfully reloaded the settings fragments.")
+        self._post_changes(changes)
+
+    def _parse_settings(
+        self,
+        document: bytes,
+        file_stat: os.stat_result,
+        digest: str,
+        file_path: str,
+        cache_path: Optional[str],
+        storage: MacSettingsStorage,
+    ) -> Any:
+        """
+        Parse the document of a settings file.
+
+        Args:
+            document (bytes):
+                The document of the settings file.
+            file_stat (os.stat_result):
+                The stat of the settings file.
+            digest (str):
+                The SHA-256 of the document.
+            file_path (str):
+                The settings file the document came from.
+            cache_path (str):
+                The compiled cache for the file, or None to parse it.
+            storage (MacSettingsStorage):
+                The storage backend for the file.
+
+        Return:
+            any:
+                The parsed settings.
+        """
+        try:
+            with self._timed("parse"):
+                if cache_path is None or not storage.cacheable:
+                    return storage.parse(document, file_path)
+                return self._load_through_cache(
+                    document=document,
+                    file_stat=file_stat,
+                    digest=digest,
+                    cache_path=cache_path,
+                    file_path=file_path,
+                    storage=storage,
+                )
+        except MacStorageException as storage_error:
+            raise MacSettingsException(str(storage_error))
+
+    def _swap_layers(
+        self,
+        lazy_sections: Optional[dict] = None,
+        record_history: bool = True,
+        **changed_layers: Any,
+    ) -> dict:
+        """
+        Replace one or more layers and swap in a new snapshot with the
+        settings resolved from them. The layers are merged again using the
+        last merge of each, so only what has changed is rebuilt, and the
+        key path index is patched from the diff rather than rebuilt. The
+        caller must hold the write lock.
+
+        Args:
+            lazy_sections (dict):
+                The user's sections still to be parsed, or None to keep
+                the current ones.
+            record_history (bool):
+                Keep the current settings in the history if they change.
+            changed_layers (any):
+                The new settings tree for each layer that has changed,
+                by layer name.
+
+        Return:
+            dict:
+                The key paths added, removed and changed in the resolved
+                settings (see dict_diff_paths).
+        """
+        snapshot = self.__snapshot
+        layers = dict(snapshot.layers)
+        for layer, layer_settings in changed_layers.items():
+            if layer_settings is None:
+                layer_settings = dict()
+            layers[layer] = layer_settings
+        merged = []
+        resolved = None
+        with self._timed("merge"):
+            for depth, layer in enumerate(SETTINGS_LAYERS):
+                previous = None
+                if snapshot.merged:
+                    previous = (
+                        snapshot.merged[depth - 1] if depth else None,
+                        snapshot.layers[layer],
+                        snapshot.merged[depth],
+                    )
+                resolved = merge_settings(resolved, layers[layer], previous)
+                merged.append(resolved)
+            # Invalid settings raise here, before anything is swapped in.
+            typed = self._build_typed(resolved)
+        with self._timed("diff"):
+            changes = dict_diff_paths(
+                dict_a=snapshot.settings, dict_b=resolved
+            )
+            path_index = patch_path_index(
+                path_index=snapshot.path_index,
+                settings=resolved,
+                changes=changes,
+            )
+        # There's nothing to go back to before the first load.
+        if record_history and snapshot.merged:
+            if not self.__transaction_depth and any(changes.values()):
+                self._record_history(snapshot)
+        # Build the new snapshot off to the side, then swap it in with a
+        # single assignment.
+        self.__snapshot = MacSettingsSnapshot(
+            settings=resolved,
+            path_index=path_index,
+            version=snapshot.version + 1,
+            layers=layers,
+            merged=tuple(merged),
+            typed=typed,
+            lazy_sections=(
+                snapshot.lazy_sections
+                if lazy_sections is None
+                else lazy_sections
+            ),
+        )
+        return changes
+
+    def _build_typed(self, settings: Any) -> Any:
+        """
+        Build the typed settings with the registered schema.
+
+        Args:
+            settings (any):
+                The resolved settings.
+
+        Return:
+            any:
+                The typed settings, or None when there isn't a schema.
+        """
+        if self.__schema is None:
+            return None
+        try:
+            return self.__schema.build(settings)
+        except MacSchemaException as err:
+            raise MacSettingsException(f"The settings are not valid. {err}")
+
+    def register_schema(self, schema: Union[type, dict, MacSchema]) -> Any:
+        """
+        Register a schema for the typed settings. The schema is compiled
+        once, then the typed settings are built whenever the settings
+        change, so reading them is plain attribute access with no
+        validation or coercion:
+
+            @dataclass(frozen=True)
+            class Pool:
+                size: int
+                timeout: float = 2.5
+
+            @dataclass(frozen=True)
+            class AppSettings:
+                pool: Pool
+
+            settings.register_schema(AppSettings)
+            settings.typed.pool.size
+
+        A dict spec, e.g. {"pool": {"size": int, "timeout": (float, 2.5)}},
+        works the same way. Once registered, settings that don't match the
+        schema are rejected and the current settings are kept.
+
+        Args:
+            schema (type, dict or MacSchema):
+                A dataclass, a dict spec or a compiled schema.
+
+        Return:
+            any:
+                The typed settings.
+        """
+        with self.__write_lock:
+            compiled_schema = compile_schema(schema)
+            self._load_lazy_sections()
+            snapshot = self.__snapshot
+            previous_schema = self.__schema
+            self.__schema = compiled_schema
+            try:
+                typed = self._build_typed(snapshot.settings)
+            except MacSettingsException:
+                self.__schema = previous_schema
+                raise
+            self.__snapshot = MacSettingsSnapshot(
+                settings=snapshot.settings,
+                path_index=snapshot.path_index,
+                version=snapshot.version + 1,
+                layers=snapshot.layers,
+                merged=snapshot.merged,
+                typed=typed,
+                lazy_sections=snapshot.lazy_sections,
+            )
+        return typed
+
+    @property
+    def typed(self) -> Any:
+        """
+        The settings built with the registered schema, or None when no
+        schema has been registered.
+
+        Return:
+            any:
+                The typed settings.
+        """
+        return self.__snapshot.typed
+
+    @property
+    def version(self) -> int:
+        """
+        The version of the settings, which goes up every time the
+        settings are loaded or changed.
+
+        Return:
+            int:
+                The version.
+        """
+        return self.__snapshot.version
+
+    def _record_history(
+        self,
+        snapshot: MacSettingsSnapshot,
+        fragment_cache: Optional[tuple] = None,
+    ) -> None:
+        """
+        Keep a snapshot in the history. The path index isn't kept, as it
+        can't share anything with the other versions. It's rebuilt if the
+        snapshot is rolled back to.
+
+        Args:
+            snapshot (MacSettingsSnapshot):
+                The settings being replaced.
+            fragment_cache (tuple):
+                The fragments and fragment merges the snapshot's fragments
+                layer was built from, or None for the current ones.
+
+        Return:
+            None
+        """
+        if fragment_cache is None:
+            fragment_cache = (self.__fragments, self.__fragment_merges)
+        self.__history.append(
+            (
+                time.time(),
+                MacSettingsSnapshot(
+                    settings=snapshot.settings,
+                    path_index=dict(),
+                    version=snapshot.version,
+                    layers=snapshot.layers,
+                    merged=snapshot.merged,
+                    typed=snapshot.typed,
+                    lazy_sections=snapshot.lazy_sections,
+                ),
+                fragment_cache,
+            )
+        )
+
+    def history(self, measure_memory: bool = False) -> list:
+        """
+        Describe the previous versions of the settings that are kept,
+        newest first. rollback(1) goes back to the first one.
+
+        Args:
+            measure_memory (bool):
+                Also measure the memory each version holds that isn't
+                shared with the current settings or a newer version.
+                This walks every version, so it's slow for large
+                settings.
+
+        Return:
+            list:
+                A dict for each version with its "version", the "time" it
+                was replaced, its "settings", and with measure_memory its
+                "retained_bytes".
+        """
+        history = list(reversed(self.__history))
+        versions = [
+            {
+                "version": old_snapshot.version,
+                "time": replaced_time,
+                "settings": old_snapshot.settings,
+            }
+            for replaced_time, old_snapshot, _ in history
+        ]
+        if measure_memory:
+            # Hold every tree while measuring, so no ids are reused.
+            trees = [self._snapshot_trees(self.__snapshot)] + [
+                self._snapshot_trees(old_snapshot)
+                for _, old_snapshot, _ in history
+            ]
+            seen: set = set()
+            retained_size(trees[0], seen)
+            for version, old_trees in zip(versions, trees[1:]):
+                version["retained_bytes"] = retained_size(old_trees, seen)
+        return versions
+
+    @staticmethod
+    def _snapshot_trees(snapshot: MacSettingsSnapshot) -> tuple:
+        """
+        The settings trees a snapshot holds, for measuring its memory.
+
+        Args:
+            snapshot (MacSettingsSnapshot):
+                The snapshot.
+
+        Return:
+            tuple:
+                The settings trees.
+        """
+        return (
+            snapshot.settings,
+            snapshot.path_index,
+            snapshot.layers,
+            snapshot.merged,
+            snapshot.lazy_sections,
+        )
+
+    def rollback(self, steps: int = 1) -> None:
+        """
+        Go back to a previous version of the settings, e.g. after a bad
+        edit to the settings file has been reloaded. The user's settings
+        from that version are saved to the settings file, and a
+        settings_changed event is posted. The version rolled back from is
+        kept in the history, so the rollback can itself be rolled back.
+        The fragments aren't written, so a fragment whose file has changed
+        since that version is read again when it's next reloaded.
+
+        Args:
+            steps (int):
+                How many versions to go back, 1 for the previous version.
+
+        Return:
+            None
+        """
+        with self._locked():
+            if self.__transaction_depth:
+                raise MacSettingsException(
+                    "The settings can't be rolled back in a transaction."
+                )
+            if not 0 < steps <= len(self.__history):
+                raise MacSettingsException(
+                    f"Can't roll back {steps} versions, there are "
+                    f"{len(self.__history)} versions in the history."
+                )
+            _, old_snapshot, fragment_cache = self.__history[-steps]
+            snapshot = self.__snapshot
+            typed = self._build_typed(old_snapshot.settings)
+            changes = dict_diff_paths(
+                dict_a=snapshot.settings, dict_b=old_snapshot.settings
+            )
+            user_changes = dict_diff_paths(
+                dict_a=snapshot.layers["user"],
+                dict_b=old_snapshot.layers["user"],
+            )
+            self._record_history(snapshot)
+            self.__snapshot = MacSettingsSnapshot(
+                settings=old_snapshot.settings,
+                path_index=flatten_settings(old_snapshot.settings),
+                version=snapshot.version + 1,
+                layers=old_snapshot.layers,
+                merged=old_snapshot.merged,
+                typed=typed,
+                lazy_sections=old_snapshot.lazy_sections,
+            )
+            self._set_fragment_cache(*fragment_cache)
+            for changed_paths in user_changes.values():
+                self.__unsaved_paths.update(changed_paths)
+            self._write_settings_file()
+        self.mac_logger.info(
+            f"Rolled the settings back to version {old_snapshot.version}."
+        )
+        self._post_changes(changes)
+
+    def get_layer_settings(self, layer: str) -> Any:
+        """
+        Return the settings of a single layer, before they are merged with
+        the other layers. Like get_all_settings the result is shared, so
+        don't change it in place.
+
+        Args:
+            layer (str):
+                One of "defaults", "user", "fragments", "environment" or
+                "overrides".
+
+        Return:
+            any:
+                The settings in the layer.
+        """
+        if layer not in SETTINGS_LAYERS:
+            raise MacSettingsException(
+                f"{layer} is not a settings layer, use one of "
+                f"{', '.join(SETTINGS_LAYERS)}."
+            )
+        if self.__snapshot.lazy_sections:
+            self._load_lazy_sections()
+        return self.__snapshot.layers[layer]
+
+    def set_override(self, keys: Any, value: Any) -> None:
+        """
+        Override a setting for the life of this process. Overrides take
+        precedence over every other layer and are never saved.
+
+        Args:
+            keys (any):
+                A key, a tuple of keys or a dotted string, resolved
+                as for __getitem__.
+            value (any):
+                The value to override the setting with
+
+        Return:
+            None
+        """
+        key_path = self._key_path(keys)
+        with self._locked():
+            # An override hides the user's section, so parse it first.
+            self._load_lazy_sections(key_path[:1])
+            overrides = replace_setting(
+                self.__snapshot.layers["overrides"],
+                key_path,
+                value,
+                create_parents=True,
+            )[0]
+            changes = self._swap_layers(overrides=overrides)
+        self._post_changes(changes)
+
+    def clear_override(self, keys: Any = None) -> None:
+        """
+        Remove a runtime override, or all of them.
+
+        Args:
+            keys (any):
+                The keys of the override to remove, or None to remove all
+                the overrides.
+
+        Return:
+            None
+        """
+        with self._locked():
+            overrides = self.__snapshot.layers["overrides"]
+            if keys is None:
+                overrides = dict()
+            else:
+                key_path = self._key_path(keys)
+                try:
+                    new_nodes = replace_setting(overrides, key_path, _MISSING)
+                except (KeyError, IndexError, TypeError):
+                    return
+                overrides = new_nodes[0]
+            changes = self._swap_layers(overrides=overrides)
+        self._post_changes(changes)
+
+    def _post_changes(self, changes: dict) -> None:
+        """
+        Post a settings_changed event if anything in the resolved settings
+        has changed.
+
+        Args:
+            changes (dict):
+                The key paths added, removed and changed.
+
+        Return:
+            None
+        """
+        if any(changes.values()):
+            change_event = MacEvent(
+                event_action=MacSettingsEvents.settings_changed,
+                event_info=changes,
+            )
+            self._post_settings_changed(change_event)
+
+    def _post_settings_changed(self, change_event: MacEvent) -> None:
+        """
+        Post a settings_changed event to everyone registered for it, and
+        to the callbacks subscribed to the key paths it touches.
+
+        Args:
+            change_event (MacEvent):
+                The settings_changed event.
+
+        Return:
+            None
+        """
+        with self._dispatching(), self._timed("dispatch"):
+            self.events_publisher.post_event(event=change_event)
+            changes = change_event.event_info
+            routes = self.__path_router.route(
+                itertools.chain(
+                    changes["added"],
+                    changes["removed"],
+                    changes["changed"],
+                )
+            )
+            for (key_path, call_back), changed_paths in routes.items():
+                event_info = dict(changes)
+                for change_type in ("added", "removed", "changed"):
+                    event_info[change_type] = {
+                        changed_path: changes[change_type][changed_path]
+                        for changed_path in changed_paths
+                        if changed_path in changes[change_type]
+                    }
+                event_info["key_path"] = key_path
+                path_event = MacEvent(
+                    event_action=MacSettingsEvents.settings_changed,
+                    event_info=event_info,
+                )
+                try:
+                    call_back(path_event)
+                except Exception as err:
+                    raise MacEventException(
+                        str_message="Error posting the changes to "
+                        f"{key_path} to subscriber {call_back}. Error: {err}"
+                    )
+
+    def register_for_events(self, event: str, call_back) -> None:
+        """
+        Register a callback for a given event.
+
+        Args:
+            event (str):
+                The name of the event
+            call_back (Any):
+                The function to execute on callback
+
+        Return:
+            None
+        """
+        self.events_publisher.register(
+            event_action=event, subscriber_callback=call_back
+        )
+        self.mac_logger.debug(
+            f"Registered a callback {call_back} for {event}."
+        )
+
+    def unregister_for_events(self, event: str, call_back) -> None:
+        """
+        Unregister a callback for a given event.
+
+        Args:
+            event (str):
+                The name of the event
+            call_back (Any):
+                The function to execute on callback
+
+        Return:
+            None
+        """
+        self.events_publisher.unregister(
+            event_action=event, subscriber_callback=call_back
+        )
+        self.mac_logger.debug(
+            f"Unregistered a callback {call_back} for {event}."
+        )
+
+    def subscribe(self, keys: Any, call_back) -> None:
+        """
+        Subscribe a callback to changes to a setting, or anything under
+        it. Unlike register_for_events, the callback is only called when
+        a change touches its key path, with a settings_changed event
+        holding just those changes and the "key_path" subscribed to.
+
+            settings.subscribe(("database",), reconnect)
+
+        Args:
+            keys (any):
+                The key path, as a tuple of keys or a dotted string, or ()
+                for every change. It doesn't need to exist yet.
+            call_back (Callable):
+                The function to call with the settings_changed event.
+
+        Return:
+            None
+        """
+        key_path = self._key_path(keys)
+        self.__path_router.subscribe(key_path, call_back)
+        self.mac_logger.debug(
+            f"Subscribed a callback {call_back} to {key_path}."
+        )
+
+    def unsubscribe(self, keys: Any, call_back) -> None:
+        """
+        Unsubscribe a callback from changes to a setting.
+
+        Args:
+            keys (any):
+                The key path it was subscribed to.
+            call_back (Callable):
+                The subscribed function.
+
+        Return:
+            None
+        """
+        key_path = self._key_path(keys)
+        self.__path_router.unsubscribe(key_path, call_back)
+        self.mac_logger.debug(
+            f"Unsubscribed a callback {call_back} from {key_path}."
+        )
+
+    def derive(self, keys: Any, derive_value: Any = None) -> Any:
+        """
+        Memoise a value derived from a setting. The value is built the
+        first time it's used, and rebuilt only once the setting (or
+        anything under it) differs, including inside a transaction and
+        after one is undone. Used as a decorator when derive_value isn't
+        given.
+
+            pattern = settings.derive("filters.pattern", re.compile)
+            pattern().match(line)
+
+            @settings.derive(("database",))
+            def pool_config(database):
+                return PoolConfig(**database)
+
+        Args:
+            keys (any):
+                The setting, as a tuple of keys or a dotted string, or ()
+                for all the settings.
+            derive_value (Callable):
+                Builds the value from the setting.
+
+        Returns:
+            MacSettingsDerived:
+                Call it to get the value. Close it to let go of the value
+                when it's no longer needed. Without derive_value, a
+                decorator returning one.
+        """
+        key_path = self._key_path(keys)
+        if derive_value is None:
+            return lambda derive_value: self.derive(key_path, derive_value)
+        return MacSettingsDerived(self, key_path, derive_value)
+
+    async def aload(self) -> Optional[dict]:
+        """
+        Load the settings without blocking the event loop, see
+        load_settings.
+
+        Args:
+            None
+
+        Return:
+            dict:
+                The loaded settings.
+        """
+        return await asyncio.to_thread(self.load_settings)
+
+    async def asave(self) -> None:
+        """
+        Save the settings without blocking the event loop, see
+        save_settings.
+
+        Args:
+            None
+
+        Return:
+            None
+        """
+        await asyncio.to_thread(self.save_settings)
+
+    async def wait_for_change(self, keys: Any = ()) -> MacEvent:
+        """
+        Wait for the next change that touches a setting. The change is
+        handed over to the caller's event loop, whichever thread made it.
+
+            change_event = await settings.wait_for_change(("database",))
+
+        Args:
+            keys (any):
+                The key path to wait for, see subscribe. () waits for any
+                change.
+
+        Return:
+            MacEvent:
+                The settings_changed event, as for subscribe.
+        """
+        event_loop = asyncio.get_running_loop()
+        change_future = event_loop.create_future()
+
+        def deliver_change(change_event: MacEvent) -> None:
+            if not change_future.done():
+                change_future.set_result(change_event)
+
+        def on_change(change_event: MacEvent) -> None:
+            try:
+                event_loop.call_soon_threadsafe(deliver_change, change_event)
+            except RuntimeError:
+                # The event loop has closed, nobody is waiting.
+                pass
+
+        self.subscribe(keys, on_change)
+        try:
+            return await change_future
+        finally:
+            self.unsubscribe(keys, on_change)
+
+    async def watch_changes(self, keys: Any = ()) -> AsyncIterator[MacEvent]:
+        """
+        Iterate over the changes that touch a setting, on the caller's
+        event loop. Changes made while the caller is busy are queued, so
+        none are missed.
+
+            async for change_event in settings.watch_changes("database"):
+                await reconnect(change_event.event_info)
+
+        Args:
+            keys (any):
+                The key path to watch, see subscribe. () watches every
+                change.
+
+        Yields:
+            MacEvent:
+                The settings_changed events, as for subscribe.
+        """
+        event_loop = asyncio.get_running_loop()
+        change_queue: asyncio.Queue = asyncio.Queue()
+
+        def on_change(change_event: MacEvent) -> None:
+            try:
+                event_loop.call_soon_threadsafe(
+                    change_queue.put_nowait, change_event
+                )
+            except RuntimeError:
+                # The event loop has closed, nobody is watching.
+                pass
+
+        self.subscribe(keys, on_change)
+        try:
+            while True:
+                yield await change_queue.get()
+        finally:
+            self.unsubscribe(keys, on_change)
+
+    def _key_path(self, keys: Any) -> tuple:
+        """
+        Turn a key into the key path used by the path index. A string is a
+        top level key unless it isn't one and contains dots, in which case
+        it's treated as a dotted path, e.g. "level1.level2". Reads and
+        writes both resolve their keys here, so they find the same
+        setting.
+
+        Args:
+            keys (any):
+                A tuple of keys, a dotted string or a single key.
+
+        Returns:
+            tuple:
+                The key path.
+        """
+        if isinstance(keys, tuple):
+            return keys
+        key_path = (keys,)
+        if not isinstance(keys, str):
+            return key_path
+        snapshot = self.__snapshot
+        if key_path in snapshot.path_index or keys in snapshot.lazy_sections:
+            return key_path
+        return split_key_path(keys)
+
+    def _walk_settings(self, key_path: tuple) -> Any:
+        """
+        Walk the settings tree to find the value of a key path. This is
+        the slow path for anything the path index can't answer, such as
+        list indexes.
+
+        Args:
+            key_path (tuple):
+                The keys to walk through.
+
+        Returns:
+            any:
+                The value at the end of the key path.
+        """
+        snapshot = self.__snapshot
+        if snapshot.lazy_sections and key_path[:1]:
+            if key_path[0] in snapshot.lazy_sections:
+                self._load_lazy_sections(key_path[:1])
+                snapshot = self.__snapshot
+        return reduce(operator.getitem, key_path, snapshot.settings)
+
+    def __getitem__(self, keys: Any) -> Any:
+        """
+        Get the value from the underlying settings dictionary.
+
+        Args:
+            key (any):
+                If querying a muli-level dictionary, this will be a tuple
+                or a dotted string, e.g. "level1.level2".
+
+        Returns:
+            any:
+                This could either be the menu, or a subset of the full
+                dictionary.
+        """
+        path_index = self.__snapshot.path_index
+        if isinstance(keys, tuple):
+            try:
+                return path_index[keys]
+            except (KeyError, TypeError):
+                return self._walk_settings(keys)
+        if isinstance(keys, str):
+            value = path_index.get((keys,), _MISSING)
+            if value is _MISSING:
+                value = path_index.get(split_key_path(keys), _MISSING)
+            if value is not _MISSING:
+                return value
+            key_path = split_key_path(keys)
+            try:
+                return self._walk_settings(key_path)
+            except (KeyError, IndexError, TypeError):
+                raise MacSettingsException(
+                    f"key {keys} is not in the " "dictionary."
+                )
+        return None
+
+    def _lookup(self, snapshot: MacSettingsSnapshot, keys: Any) -> Any:
+        """
+        Look a setting up in a snapshot without raising when it's missing.
+        Anything the path index can't answer is walked from the deepest
+        key path the index has, e.g. the list holding an item.
+
+        Args:
+            snapshot (MacSettingsSnapshot):
+                The snapshot to look in.
+            keys (any):
+                A key, a tuple of keys or a dotted string.
+
+        Returns:
+            any:
+                The setting, or _MISSING.
+        """
+        path_index = snapshot.path_index
+        if isinstance(keys, tuple):
+            key_path = keys
+        else:
+            key_path = (keys,)
+            value = path_index.get(key_path, _MISSING)
+            if value is not _MISSING or not isinstance(keys, str):
+                return value
+            key_path = split_key_path(keys)
+        try:
+            value = path_index.get(key_path, _MISSING)
+        except TypeError:
+            return _MISSING
+        if value is not _MISSING or not key_path:
+            return value
+        if key_path[0] in snapshot.lazy_sections:
+            self._load_lazy_sections(key_path[:1])
+            return self._lookup(self.__snapshot, key_path)
+        depth = len(key_path) - 1
+        while depth and key_path[:depth] not in path_index:
+            depth -= 1
+        if not depth:
+            return _MISSING
+        value = path_index[key_path[:depth]]
+        for key in key_path[depth:]:
+            if isinstance(value, dict):
+                value = value.get(key, _MISSING)
+                if value is _MISSING:
+                    return value
+            elif (
+                isinstance(value, (list, tuple))
+                and isinstance(key, int)
+                and -len(value) <= key < len(value)
+            ):
+                value = value[key]
+            else:
+                return _MISSING
+        return value
+
+    def get(self, keys: Any, default: Any = None) -> Any:
+        """
+        Get a setting, or a default when it's missing. Nothing is raised
+        or logged for a missing setting, so this is the quickest way to
+        look up a setting that may not be there.
+
+        Args:
+            keys (any):
+                A key, a tuple of keys or a dotted string, e.g.
+                "level1.level2".
+            default (any):
+                The value to return when the setting is missing.
+
+        Returns:
+            any:
+                The setting or the default.
+        """
+        value = self._lookup(self.__snapshot, keys)
+        return default if value is _MISSING else value
+
+    def get_many(self, keys_list: Iterable, default: Any = None) -> list:
+        """
+        Get many settings at once. They all come from the same version of
+        the settings, even if the settings change part way through.
+
+        Args:
+            keys_list (Iterable):
+                The keys of each setting, as for get.
+            default (any):
+                The value for any setting that is missing.
+
+        Returns:
+            list:
+                The settings, in the same order as the keys.
+        """
+        snapshot = self.__snapshot
+        path_index = snapshot.path_index
+        values = []
+        for keys in keys_list:
+            value = _MISSING
+            if isinstance(keys, tuple):
+                try:
+                    value = path_index.get(keys, _MISSING)
+                except TypeError:
+                    pass
+            if value is _MISSING:
+                value = self._lookup(snapshot, keys)
+            if value is _MISSING and snapshot.lazy_sections:
+                # A section may have been parsed for this setting.
+                value = self._lookup(self.__snapshot, keys)
+            values.append(default if value is _MISSING else value)
+        return values
+
+    def set_many(self, new_settings: dict) -> None:
+        """
+        Set many settings at once. They are all made in the user's
+        settings before the settings are merged and indexed again, then
+        written with a single write and posted as a single
+        settings_changed event, like a transaction. If any setting can't
+        be made, none of them are.
+
+        Args:
+            new_settings (dict):
+                The keys (string or tuple) and the values to set them to.
+
+        Return:
+            None
+        """
+        with self._locked():
+            key_paths = [
+                (self._key_path(keys), value)
+                for keys, value in new_settings.items()
+            ]
+            if self.__snapshot.lazy_sections:
+                self._load_lazy_sections(
+                    {key_path[0] for key_path, _ in key_paths if key_path}
+                )
+            snapshot = self.__snapshot
+            user_settings = snapshot.layers["user"]
+            for key_path, value in key_paths:
+                parent_path = key_path[:-1]
+                if parent_path and parent_path not in snapshot.path_index:
+                    # Raises if the parent isn't in the resolved settings
+                    # or made by an earlier setting.
+                    try:
+                        reduce(operator.getitem, parent_path, user_settings)
+                    except (KeyError, IndexError, TypeError):
+                        reduce(
+                            operator.getitem, parent_path, snapshot.settings
+                        )
+                user_settings = replace_setting(
+                    user_settings, key_path, value, create_parents=True
+                )[0]
+            changes = self._swap_layers(user=user_settings)
+            self.__transaction_log.extend(key_paths)
+            self.__unsaved_paths.update(key_path for key_path, _ in key_paths)
+            if self.__transaction_depth:
+                return
+            self.__transaction_log.clear()
+            self._write_settings_file()
+        changes["settings_changed"] = dict(key_paths)
+        change_event = MacEvent(
+            event_action=MacSettingsEvents.settings_changed,
+            event_info=changes,
+        )
+        self._post_settings_changed(change_event)
+
+    def __setitem__(self, keys: Any, value: Any) -> None:
+        """
+        Set the value of an item in the dictionary. This is slightly different
+        from the multi-index pattern in that the key names are passed as a
+        tuple. For example msettings['level1', 'level2'] = value
+
+        Inside a transaction the change is only made in memory, and is
+        written out when the transaction ends.
+
+        Args:
+            keys (any):
+                A key, a tuple of keys or a dotted string, resolved
+                as for __getitem__.
+            value (any):
+                The value to set the key/value to
+
+        Return:
+            None
+        """
+        with self._locked():
+            key_path, changed_setting = self._apply_setting(keys, value)
+            if self.__transaction_depth:
+                return
+            self.__transaction_log.clear()
+            self._write_settings_file()
+        changed_setting.update({"setting_changed": keys, "new_value": value})
+        change_event = MacEvent(
+            event_action=MacSettingsEvents.settings_changed,
+            event_info=changed_setting,
+        )
+        self._post_settings_changed(change_event)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Batch a number of settings changes together. The changes are made
+        in memory as they happen, then the file is written once and a
+        single settings_changed event is posted when the outermost
+        transaction ends. If the block raises, the changes made in it are
+        undone. Other writers wait until the transaction has finished.
+
+            with settings.transaction():
+                settings["level1", "level2"] = value
+                settings["other"] = other_value
+
+        The event info has the key paths added, removed and changed by the
+        whole transaction, plus {"settings_changed": {key path: new value}}
+        for every setting made.
+
+        Args:
+            None
+
+        Yields:
+            MacSettingsStore:
+                This settings object.
+        """
+        with self._locked():
+            log_start = len(self.__transaction_log)
+            start_snapshot = self.__snapshot
+            start_unsaved_paths = set(self.__unsaved_paths)
+            start_fragment_cache = (self.__fragments, self.__fragment_merges)
+            self.__transaction_depth += 1
+            try:
+                yield self
+            except BaseException:
+                # Snapshots are immutable, so undoing is a swap back,
+                # under a new version so nothing built from the undone
+                # changes still looks current.
+                del self.__transaction_log[log_start:]
+                self.__snapshot = replace(
+                    start_snapshot, version=self.__snapshot.version + 1
+                )
+                self.__unsaved_paths = start_unsaved_paths
+                self._set_fragment_cache(*start_fragment_cache)
+                self.mac_logger.debug("Undid the settings changes.")
+                raise
+            finally:
+                self.__transaction_depth -= 1
+            if self.__transaction_depth or not self.__transaction_log:
+                return
+            start_settings = start_snapshot.settings
+            if start_snapshot.lazy_sections is not (
+                self.__snapshot.lazy_sections
+            ):
+                # Sections parsed during the transaction haven't changed
+                # just because they have been parsed.
+                start_settings = self._parse_lazy_sections(
+                    user_settings=start_settings,
+                    lazy_sections=start_snapshot.lazy_sections,
+                    keys=start_snapshot.lazy_sections.keys()
+                    - self.__snapshot.lazy_sections.keys(),
+                )[0]
+            changes = dict_diff_paths(
+                dict_a=start_settings,
+                dict_b=self.__snapshot.settings,
+            )
+            if any(changes.values()):
+                self._record_history(start_snapshot, start_fragment_cache)
+            changes["settings_changed"] = dict(self.__transaction_log)
+            self.__transaction_log.clear()
+            self._write_settings_file()
+        change_event = MacEvent(
+            event_action=MacSettingsEvents.settings_changed,
+            event_info=changes,
+        )
+        self._post_settings_changed(change_event)
+
+    def update(self, new_settings: dict) -> None:
+        """
+        Set many settings at once, with a single write and change event.
+        The same as set_many.
+
+        Args:
+            new_settings (dict):
+                The keys (string or tuple) and the values to set them to.
+
+        Return:
+            None
+        """
+        self.set_many(new_settings)
+
+    def _apply_setting(self, keys: Any, value: Any) -> tuple:
+        """
+        Make a settings change to the user's layer in memory by swapping
+        in a new snapshot, and log it for the transaction. The caller must
+        hold the write lock.
+
+        Args:
+            keys (any):
+                A key, a tuple of keys or a dotted string, resolved
+                as for __getitem__.
+            value (any):
+                The value to set the key/value to
+
+        Return:
+            tuple:
+                The key path and the key paths added, removed and changed
+                in the resolved settings.
+        """
+        key_path = self._key_path(keys)
+        if self.__snapshot.lazy_sections:
+            self._load_lazy_sections(key_path[:1])
+        snapshot = self.__snapshot
+        parent_path = key_path[:-1]
+        if parent_path and parent_path not in snapshot.path_index:
+            # Raises if the parent isn't in the resolved settings.
+            reduce(operator.getitem, parent_path, snapshot.settings)
+        # The parent may only be in the defaults, so create it in the
+        # user's layer if need be.
+        new_nodes = replace_setting(
+            snapshot.layers["user"], key_path, value, create_parents=True
+        )
+        changes = self._swap_layers(user=new_nodes[0])
+        self.__transaction_log.append((key_path, value))
+        self.__unsaved_paths.add(key_path)
+        return key_path, changes
+
+    def _write_settings_file(self) -> None:
+        """
+        Save the settings, or in write-behind mode hand them over to the
+        background writer.
+
+        Args:
+            None
+
+        Return:
+            None
+        """
+        if self.__write_behind_interval is None:
+            self._save_unwatched()
+            return
+        with self.__write_lock:
+            self.__write_stats["writes_requested"] += 1
+            if self.__dirty:
+                self.__write_stats["writes_coalesced"] += 1
+            self.__dirty = True
+            if self.__writer_thread is None:
+                self.__writer_thread = Thread(
+                    target=self._write_behind_loop,
+                    name=f"{self.__class__.__name__}-writer",
+                    daemon=True,
+                )
+                self.__writer_thread.start()
+        self.__dirty_event.set()
+
+    def _write_behind_loop(self) -> None:
+        """
+        Background writer. Waits for changes, then writes them out no
+        more often than the write-behind interval.
+
+        Args:
+            None
+
+        Return:
+            None
+        """
+        while not self.__writer_stopping.is_set():
+            self.__dirty_event.wait()
+            delay = (
+                self.__last_flush
+                + self.__write_behind_interval
+                - time.monotonic()
+            )
+            if delay > 0:
+                self.__writer_stopping.wait(delay)
+            try:
+                self.flush()
+            except MacSettingsException:
+                # Already logged, the changes will be retried on the
+                # next change, flush or close.
+                pass
+
+    def flush(self) -> None:
+        """
+        Write out any changes waiting on the background writer.
+
+        Args:
+            None
+
+        Return:
+            None
+        """
+        with self.__write_lock:
+            self.__dirty_event.clear()
+            if not self.__dirty:
+                return
+            self.__dirty = False
+            try:
+                self._save_unwatched()
+            except MacSettingsException:
+                self.__dirty = True
+                raise
+            finally:
+                self.__last_flush = time.monotonic()
+            self.__write_stats["writes_flushed"] += 1
+        if self.__pending_timings:
+            self._publish_timings()
+
+    def close(self) -> None:
+        """
+        Stop watching the settings file and stop the background writer,
+        writing out any pending changes, then release the storage.
+
+        Args:
+            None
+
+        Return:
+            None
+        """
+        if self.__file_watcher is not None:
+            self.__file_watcher.unwatch(
+                path=self.settings_file_path,
+                handler=self.__file_change_handler,
             )
-            self.events_publisher.post_event(event=update_event)
-
-    def on_created(self, event) -> None:
+            self._watch_fragments(self.__fragments, ())
+            self.__file_watcher = None
+        self.__file_change_handler.cancel()
+        self.__writer_stopping.set()
+        self.__dirty_event.set()
+        if self.__writer_thread is not None:
+            self.__writer_thread.join()
+            self.__writer_thread = None
+        self.__writer_stopping.clear()
+        self.flush()
+        self.storage.close()
+
+    def enable_stats(self, events: bool = False) -> None:
         """
-        Register whether the file has been created or not.
+        Start collecting timings of reading, parsing, merging, diffing
+        and saving the settings, of posting change events, and of waiting
+        for the write lock when loading or changing the settings. Reading
+        a setting never takes a lock, so it isn't timed.
 
         Args:
-            event (_type_):
-                The file ceate event.
+            events (bool):
+                Also post a settings_timing event for every timing.
 
         Return:
             None
         """
-        if not self._pause_observer:
-            self.mac_logger.debug("File created detected")
-            create_event = MacEvent(
-                event_action=MacSettingsWatchdogEvents.settings_file_created
-            )
-            self.events_publisher.post_event(event=create_event)
+        publish = self._post_timing if events else None
+        if self.__stats is None:
+            self.__stats = MacSettingsStats(publish=publish)
+        else:
+            self.__stats.publish = publish
 
-    def on_delete(self, event) -> None:
+    def disable_stats(self) -> None:
         """
-        Register when the file has been deleted
+        Stop collecting timings, and throw away those collected.
 
         Args:
-            event (_type_):
-                The file delete event.
+            None
 
         Return:
             None
         """
-        if not self._pause_observer:
-            self.mac_logger.debug("File delete detected")
-            delete_event = MacEvent(
-                event_action=MacSettingsWatchdogEvents.settings_file_deleted
-            )
-            self.events_publisher.post_event(event=delete_event)
-
-
-class MacSettingsEvents(Enum):
-    """
-    Events for the settings file.
-    """
-
-    settings_changed = auto()
-    settings_loaded = auto()
-
+        self.__stats = None
 
-class MacSettings(metaclass=MacSingleInstance):
-    """
-    Handle global apps setting using a singleton class.
-    Make sure the logger is initialised before calling this class.
+    def stats(self) -> dict:
+        """
+        Return the timings and counters collected since enable_stats, see
+        MacSettingsStats.snapshot. Timings are in milliseconds.
 
-    Attributes:
-        mac_logger (logging.Logger):
-            The logger object for this class.
-        settings_file_directory (str):
-            The directory where the settings file should be.
-        settings_file_path (str):
-            The full path to the settings file.
-        default_settings_path (str):
-            The full path to the default settings file.
-        events_publisher (MacEventPublisher):
-            The event publisher object.
-        __settings_file_observer (Observer):
-            The observer object for the settings file.
-        __file_change_handler (MacSettingsWatchdogHandler):
-            The file change handler object.
-        __app_settings (dict):
-            The dictionary of settings.
-        __thread_lock (Lock):
-            The lock object for the settings dictionary.
-        events (list):
-            The list of valid events that can be published.
-    """
+        Args:
+            None
 
-    mac_logger: logging.Logger
-    settings_file_directory: str
-    settings_file_path: str
-    default_settings_path: str
-    events_publisher: MacEventPublisher
-    __settings_file_observer: Observer = Observer()
-    __file_change_handler: MacSettingsWatchdogHandler
-    __app_settings: dict
-    __thread_lock: Lock
-    events = ["settings_change", "settings_loaded"]
+        Returns:
+            dict:
+                The "timings" and "counters", which are empty when stats
+                aren't being collected.
+        """
+        stats = self.__stats
+        if stats is None:
+            return {"timings": {}, "counters": {}}
+        return stats.snapshot()
 
-    def __init__(self, app_name: str, default_settings_path: str) -> None:
+    def _post_timing(self, name: str, seconds: float) -> None:
         """
-        Initialise the settings singleton.
+        Queue a settings_timing event. Timings are taken while holding the
+        write lock or posting other events, and a subscriber may use the
+        settings, so they're only posted once both are over, see
+        _publish_timings.
 
         Args:
-            app_name (str):
-                The name of the app. This will translate into the name of the
-                settings file/directory to make things easy to find.
-            default_settings_path (str):
-                The path where the settings file should exist.
-        """
-        super(MacSettings, self).__init__()
-        if "win32" == sys.platform:  # pragma: no cover
-            # Use the standard Windows config file storage area
-            self.settings_file_directory = os.getenv("LOCALAPPDATA")
-        elif "darwin" == sys.platform:  # pragma: no cover
-            self.settings_file_directory = os.path.expanduser(
-                "~/Library/Application Support"
-            )
-        else:
-            # Not using Windows, nor mac so assume Linux/BSD
-            self.settings_file_directory = os.path.expanduser("~/.config")
+            name (str):
+                What was timed.
+            seconds (float):
+                How long it took.
 
-        self.settings_file_directory = (
-            f"{self.settings_file_directory}/" f"{app_name}"
-        )
-        self.settings_file_path = (
-            f"{self.settings_file_directory}" f"/{app_name}.yaml"
-        )
-        self.default_settings_path = default_settings_path
-        self.mac_logger = logging.getLogger(mac_logger.LOGGER_NAME)
-        self.__app_settings = dict()
-        self.__thread_lock = Lock()
-        self.events_publisher = MacEventPublisher(MacSettingsEvents)
-        if not pathlib.Path(self.default_settings_path).exists():
-            raise MacSettingsException(
-                str_message="The default settings file"
-                f" {self.default_settings_path} does "
-                "not exist. This is a terminal "
-                "failure."
-            )
-        if not pathlib.Path(self.settings_file_path).exists():
-            self.mac_logger.info(
-                f"The settings file {self.settings_file_path} does "
-                "not exist. Creating a new one..."
-            )
-            self._copy_default_settings()
-        # Set the file watchdog to pick up any changes made to the settings
-        # file from outside this process.
-        self.__file_change_handler = MacSettingsWatchdogHandler()
-        self.__settings_file_observer.schedule(
-            event_handler=self.__file_change_handler,
-            path=self.settings_file_path,
-            recursive=False,
-        )
-        self.__settings_file_observer.start()
-        # Register ourseleves with the event service to pick up
-        # file change notifications.
-        self.__file_change_handler.events_publisher.register(
-            event_action=MacSettingsWatchdogEvents.reload_settings_file,
-            subscriber_callback=self.reload_settings_from_file,
-        )
+        Return:
+            None
+        """
+        self.__pending_timings.append((name, seconds))
 
-    def load_settings(self) -> Optional[dict]:
+    def _publish_timings(self) -> None:
         """
-        Load the settings direct from the file.
+        Post the queued settings_timing events, unless this thread holds
+        the write lock or is posting events. Timings taken by the
+        subscribers wait for the next time.
 
         Args:
             None
 
         Return:
-            dict:
-                A dictionary of the settings in the YAML file to make walking
-                the setting very easy.
+            None
         """
-        # Read the settings from a YAML file.
+        dispatch_state = self.__dispatch_state
+        if getattr(dispatch_state, "depth", 0) or self.__write_lock.held():
+            return
+        dispatch_state.depth = 1
         try:
-            with self.__thread_lock:
+            for _ in range(len(self.__pending_timings)):
                 try:
-                    self.mac_logger.debug(
-                        f"Loading settings from {self.settings_file_path}"
-                    )
-                    with open(
-                        file=self.settings_file_path, mode="rb"
-                    ) as yml_file:
-                        self.__app_settings = yaml.safe_load(stream=yml_file)
-                except IOError as io_error:
-                    raise MacSettingsException(
-                        "Unable to read the settings file "
-                        f"{self.settings_file_path}"
-                        f" {io_error}"
-                    )
-            self.mac_logger.info("Successfully loaded the settings.")
-            change_event = MacEvent(
-                event_action=MacSettingsEvents.settings_loaded
-            )
-            self.events_publisher.post_event(event=change_event)
-        except yaml.YAMLError as yaml_error:
-            raise MacSettingsException(
-                "There was a problem parsing"
-                f" the file {self.settings_file_path}"
-                f" {yaml_error}"
-            )
-        return self.__app_settings
+                    name, seconds = self.__pending_timings.popleft()
+                except IndexError:
+                    break
+                timing_event = MacEvent(
+                    event_action=MacSettingsEvents.settings_timing,
+                    event_info={"name": name, "seconds": seconds},
+                )
+                self.events_publisher.post_event(event=timing_event)
+        finally:
+            dispatch_state.depth = 0
 
-    def reload_settings_from_file(self) -> None:
+    @contextmanager
+    def _dispatching(self) -> Iterator:
         """
-        Reload the settings.
+        Post events, then post any timings queued once this thread has
+        finished posting events.
 
         Args:
             None
 
-        Return:
+        Yields:
             None
         """
-        self.mac_logger.debug("Reloading the settings from the file.")
-        previous_settings = copy.deepcopy(self.__app_settings)
-        self.load_settings()
-        if previous_settings != self.__app_settings:
-            changes = dict_diff(
-                dict_a=previous_settings, dict_b=self.__app_settings
-            )
-            update_event = MacEvent(
-                event_action=MacSettingsEvents.settings_changed,
-                event_info=changes,
-            )
-            self.events_publisher.post_event(update_event)
+        dispatch_state = self.__dispatch_state
+        depth = getattr(dispatch_state, "depth", 0)
+        dispatch_state.depth = depth + 1
+        try:
+            yield
+        finally:
+            dispatch_state.depth = depth
+        if not depth and self.__pending_timings:
+            self._publish_timings()
 
-    def register_for_events(self, event: str, call_back) -> None:
+    def _timed(self, name: str) -> Any:
         """
-        Register a callback for a given event.
+        Time a block of code when stats are being collected.
 
         Args:
-            event (str):
-                The name of the event
-            call_back (Any):
-                The function to execute on callback
+            name (str):
+                What is being timed.
 
-        Return:
-            None
+        Returns:
+            any:
+                A context manager that records the timing, or does
+                nothing when stats aren't being collected.
         """
-        self.events_publisher.register(
-            event_action=event, subscriber_callback=call_back
-        )
-        self.mac_logger.debug(
-            f"Registered a callback {call_back} for {event}."
-        )
+        stats = self.__stats
+        if stats is None:
+            return NOT_TIMED
+        return stats.timer(name)
 
-    def unregister_for_events(self, event: str, call_back) -> None:
+    def _locked(self) -> Any:
         """
-        Unregister a callback for a given event.
+        The write lock, timing how long it takes to acquire when stats
+        are being collected.
 
         Args:
-            event (str):
-                The name of the event
-            call_back (Any):
-                The function to execute on callback
-
-        Return:
             None
+
+        Returns:
+            any:
+                A context manager that holds the write lock.
         """
-        self.events_publisher.unregister(
-            event_action=event, subscriber_callback=call_back
-        )
-        self.mac_logger.debug(
-            f"Unregistered a callback {call_back} for {event}."
-        )
+        stats = self.__stats
+        if stats is None:
+            return self.__write_lock
+        return MacSettingsTimedLock(self.__write_lock, stats)
 
-    def __getitem__(self, keys: Any) -> Any:
+    def write_behind_stats(self) -> dict:
         """
-        Get the value from the underlying settings dictionary.
+        Return how many writes have been requested, how many were actually
+        written to the file and how many were coalesced into another write.
 
         Args:
-            key (any):
-                If querying a muli-level dictionary, this will be a tuple.
+            None
 
         Returns:
-            any:
-                This could either be the menu, or a subset of the full
-                dictionary.
+            dict:
+                The write counters.
         """
-        value = None
-        if isinstance(keys, str):
-            if keys not in self.__app_settings:
-                raise MacSettingsException(
-                    f"key {keys} is not in the " "dictionary."
-                )
-            with self.__thread_lock:
-                value = self.__app_settings[keys]
-        if isinstance(keys, tuple):
-            with self.__thread_lock:
-                value = reduce(operator.getitem, keys, self.__app_settings)
-        return value
+        with self.__write_lock:
+            return dict(self.__write_stats)
 
-    def __setitem__(self, keys: Any, value: Any) -> None:
+    def _save_unwatched(self) -> None:
         """
-        Set the value of an item in the dictionary. This is slightly different
-        from the multi-index pattern in that the key names are passed as a
-        tuple. For example msettings['level1', 'level2'] = value
+        Save the settings without the file watcher picking up our own
+        change as an external one.
 
         Args:
-            keys (any):
-                The keys can be either a string, or a tuple
-            value (any):
-                The value to set the key/value to
+            None
 
         Return:
             None
         """
-        if isinstance(keys, str):
-            with self.__thread_lock:
-                self.__app_settings[keys] = value
-        else:
-            with self.__thread_lock:
-                (reduce(operator.getitem, keys[:-1], self.__app_settings))[
-                    keys[-1]
-                ] = value
         self.__file_change_handler._pause_observer = True
-        self.save_settings()
-        self.__file_change_handler._pause_observer = False
-        changed_setting = {"setting_changed": keys, "new_value": value}
-        change_event = MacEvent(
-            event_action=MacSettingsEvents.settings_changed,
-            event_info=changed_setting,
-        )
-        self.events_publisher.post_event(event=change_event)
+        try:
+            self.save_settings()
+        finally:
+            self.__file_change_handler._pause_observer = False
 
     def __contains__(self, keys: Any) -> bool:
         """
@@ -461,30 +3600,40 @@ class MacSettings(metaclass=MacSingleInstance):
 
         Args:
             keys (any):
-                The name of the key to find. Can be string or tuple.
+                The name of the key to find. Can be string, dotted string or
+                tuple.
 
         Returns:
             bool:
                 True or False based on whether the key exists.
         """
-        if isinstance(keys, str):
-            with self.__thread_lock:
-                bool_value = keys in self.__app_settings
-        elif isinstance(keys, tuple):
-            if keys[0] not in self.__app_settings:
-                bool_value = False
-            else:
-                bool_value = keys[-1] in self.__getitem__(keys[:-1])
-        else:
+        if not isinstance(keys, (str, tuple)):
             raise MacSettingsException(
                 "Use either a single string or a tuple to query whether"
                 " the setting exists."
             )
-        return bool_value
+        if keys == ():
+            return False
+        key_path = self._key_path(keys)
+        snapshot = self.__snapshot
+        try:
+            if key_path in snapshot.path_index:
+                return True
+            if len(key_path) == 1 and key_path[0] in snapshot.lazy_sections:
+                return True
+        except TypeError:
+            pass
+        try:
+            self._walk_settings(key_path)
+        except (KeyError, IndexError, TypeError):
+            return False
+        return True
 
     def get_all_settings(self) -> dict:
         """
-        Return all settings as a dictionary
+        Return all settings as a dictionary. This is the current snapshot
+        and is shared, so change settings through __setitem__ rather than
+        changing the dictionary in place.
 
         Args:
             None
@@ -493,11 +3642,16 @@ class MacSettings(metaclass=MacSingleInstance):
             dict:
                 The settings dictionary
         """
-        return self.__app_settings
+        if self.__snapshot.lazy_sections:
+            self._load_lazy_sections()
+        return self.__snapshot.settings
 
     def save_settings(self) -> None:
         """
-        Save all the settings back to the settings file.
+        Save the user's settings back to the settings file. The defaults,
+        environment and overrides are not saved. Storage that can save
+        individual settings, such as SQLite, only saves those that have
+        changed since the last load or save.
 
         Args:
             None
@@ -505,30 +3659,214 @@ class MacSettings(metaclass=MacSingleInstance):
         Return:
             None
         """
+        changes: dict = {}
         try:
             self.mac_logger.debug(
                 f"Saving settings to {self.settings_file_path}"
             )
-            with self.__thread_lock:
-                with open(
-                    file=self.settings_file_path,
-                    mode="w",
-                ) as yml_file:
-                    yaml.dump(
-                        data=self.__app_settings,
-                        stream=yml_file,
-                        indent=4,
-                        default_flow_style=False,
-                        allow_unicode=True,
-                        encoding="utf8",
+            file_locked = self._file_locked(exclusive=True)
+            with self._locked(), file_locked as file_lock:
+                self._load_lazy_sections()
+                if (
+                    file_lock is not None
+                    and file_lock.generation != self.__file_generation
+                ):
+                    changes = self._rebase_user_settings()
+                app_settings = self.__snapshot.layers["user"]
+                with self._timed("save"):
+                    written = self.storage.write_changes(
+                        self.settings_file_path,
+                        app_settings,
+                        self.__unsaved_paths,
+                    )
+                    if written is None:
+                        written = self.storage.write(
+                            self.settings_file_path, app_settings
+                        )
+                if file_lock is not None:
+                    self.__file_generation = file_lock.bump()
+                document, file_stat = written
+                self.__unsaved_paths = set()
+                # Remember what we wrote, so our own save isn't reloaded.
+                self.__settings_digest = hashlib.sha256(document).hexdigest()
+                if (
+                    self.settings_cache_path is not None
+                    and self.storage.cacheable
+                ):
+                    self._write_cache(
+                        file_stat=file_stat,
+                        digest=self.__settings_digest,
+                        app_settings=app_settings,
+                        cache_path=self.settings_cache_path,
                     )
             self.mac_logger.debug("Successfully saved settings.")
         except Exception as err:
             raise MacSettingsException(f"Unable to save settings. {err}")
+        # Post the changes another process saved after ours were applied
+        # on top of them.
+        self._post_changes(changes)
+        if self.__pending_timings:
+            self._publish_timings()
+
+    def _file_locked(self, exclusive: bool = False) -> Any:
+        """
+        The lock file shared with other writers, when concurrent_writes is
+        set.
+
+        Args:
+            exclusive (bool):
+                Take the lock exclusively, to save.
+
+        Returns:
+            any:
+                A context manager holding the lock file, which gives the
+                MacSettingsFileLock, or None without concurrent_writes.
+        """
+        if self.__file_lock is None:
+            return nullcontext()
+        return self.__file_lock.locked(exclusive=exclusive)
+
+    def _rebase_user_settings(self) -> dict:
+        """
+        Another process has saved the settings file since we last loaded
+        or saved it, so read it again and apply the settings we've changed
+        since on top. The caller must hold the write lock and the lock
+        file, and have parsed every lazy section.
+
+        Args:
+            None
+
+        Returns:
+            dict:
+                The key paths added, removed and changed in the resolved
+                settings by the other process's save.
+        """
+        self.mac_logger.info(
+            "The settings file was saved by another process, applying our"
+            " changes on top."
+        )
+        document, file_stat = self._read_settings_file()
+        digest = hashlib.sha256(document).hexdigest()
+        user_settings, lazy_sections = self._parse_user_settings(
+            document=document, file_stat=file_stat, digest=digest
+        )
+        user_settings = self._parse_lazy_sections(
+            user_settings=user_settings,
+            lazy_sections=lazy_sections,
+            keys=list(lazy_sections),
+        )[0]
+        snapshot = self.__snapshot
+        user_settings = apply_changed_paths(
+            user_settings, snapshot.layers["user"], self.__unsaved_paths
+        )
+        if self.__stats is not None:
+            self.__stats.count("saves_rebased")
+        return self._swap_layers(
+            lazy_sections=dict(),
+            user=share_unchanged(snapshot.layers["user"], user_settings),
+        )
+
+    def _load_through_cache(
+        self,
+        document: bytes,
+        file_stat: os.stat_result,
+        digest: str,
+        cache_path: str,
+        file_path: str,
+        storage: MacSettingsStorage,
+    ) -> Any:
+        """
+        Use the compiled cache if it was built from exactly this file,
+        otherwise parse the file and rebuild the cache.
+
+        Args:
+            document (bytes):
+                The content of the settings file.
+            file_stat (os.stat_result):
+                The stat of the settings file.
+            digest (str):
+                The SHA-256 of the content.
+            cache_path (str):
+                The compiled cache for the file.
+            file_path (str):
+                The settings file the content came from.
+            storage (MacSettingsStorage):
+                The storage backend for the file.
+
+        Returns:
+            any:
+                The parsed settings.
+        """
+        try:
+            with open(file=cache_path, mode="rb") as cache_file:
+                cache = marshal.load(cache_file)
+            if cache[:5] == (
+                SETTINGS_CACHE_VERSION,
+                sys.version_info[:2],
+                file_stat.st_size,
+                file_stat.st_mtime_ns,
+                digest,
+            ):
+                self.mac_logger.debug("Loaded the settings from the cache.")
+                return cache[5]
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+        app_settings = storage.parse(document, file_path)
+        self._write_cache(
+            file_stat=file_stat,
+            digest=digest,
+            app_settings=app_settings,
+            cache_path=cache_path,
+        )
+        return app_settings
+
+    def _write_cache(
+        self,
+        file_stat: os.stat_result,
+        digest: str,
+        app_settings: Any,
+        cache_path: str,
+    ) -> None:
+        """
+        Write the compiled cache for the parsed settings. Settings that
+        marshal can't store (such as dates) are simply not cached. A failure
+        to write the cache isn't an error, the YAML is always the master.
+
+        Args:
+            file_stat (os.stat_result):
+                The stat of the settings file the settings came from.
+            digest (str):
+                The SHA-256 of the settings file.
+            app_settings (any):
+                The parsed settings.
+            cache_path (str):
+                The compiled cache to write.
+
+        Return:
+            None
+        """
+        cache = (
+            SETTINGS_CACHE_VERSION,
+            sys.version_info[:2],
+            file_stat.st_size,
+            file_stat.st_mtime_ns,
+            digest,
+            app_settings,
+        )
+        temporary_path = f"{cache_path}.{os.getpid()}"
+        try:
+            with open(file=temporary_path, mode="wb") as cache_file:
+                marshal.dump(cache, cache_file)
+            os.replace(temporary_path, cache_path)
+        except (OSError, ValueError) as err:
+            self.mac_logger.debug(f"Unable to cache the settings. {err}")
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
 
     def _copy_default_settings(self) -> None:
         """
-        Copy the default settings file into the correct position. If this
+        Copy the default settings file into the correct position, converting
+        it if it's in a different format to the settings file. If this
         fails we want the exception to break the program flow, so don't try
         and catch any exceptions.
 
@@ -550,11 +3888,28 @@ class MacSettings(metaclass=MacSingleInstance):
                 parents=True, exist_ok=True
             )
         self.mac_logger.info("Copying default settings...")
-        shutil.copyfile(
-            src=self.default_settings_path, dst=self.settings_file_path
-        )
+        default_storage = storage_for_path(self.default_settings_path)
+        if default_storage.format_name == self.storage.format_name:
+            shutil.copyfile(
+                src=self.default_settings_path, dst=self.settings_file_path
+            )
+        else:
+            document, _ = default_storage.read(self.default_settings_path)
+            self.storage.write(
+                self.settings_file_path,
+                default_storage.parse(document, self.default_settings_path),
+            )
         self.mac_logger.info("Default settings copied into place.")
 
 
+class MacSettings(MacSettingsStore, metaclass=MacSingleInstance):
+    """
+    Handle global apps setting using a singleton class.
+    Make sure the logger is initialised before calling this class.
+    """
+
+    pass
+
+
 if __name__ == "__main__":  # pragma: no cover
     pass
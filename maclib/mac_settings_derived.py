@@ -0,0 +1,163 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Name:
+        mac_settings_derived.py
+    Description:
+        Memoise values derived from a setting, such as a compiled regex,
+        a parsed URL or a connection pool's config. A derived value is
+        built the first time it's used and rebuilt only after a change
+        touches the setting it's derived from, so it's rebuilt exactly
+        once per relevant change however often it's used.
+
+            pattern = settings.derive("filters.pattern", re.compile)
+            pattern().match(line)
+
+            @settings.derive(("database",))
+            def pool_config(database):
+                return PoolConfig(**database)
+    Version:
+        1 - Initial release
+    Author:
+        J.MacGrillen <macgrillen@gmail.com>
+    Copyright:
+        Copyright (c) John MacGrillen. All rights reserved.
+"""
+from threading import Lock
+from typing import Any, Callable, Optional
+
+
+class MacSettingsDerived(object):
+    """
+    A value derived from a setting, which is rebuilt only after the
+    setting changes. Call it to get the value.
+
+    The value is kept with the version of the settings it was last
+    checked against. Every load, change, transaction and rollback swaps
+    in settings with a new version, so when the version has moved on the
+    setting is looked up again, and the value is only rebuilt if the
+    setting differs from the one it was built from.
+
+    Attributes:
+        settings_store (MacSettingsStore):
+            The settings the value is derived from.
+        key_path (tuple):
+            The setting the value is derived from, () for all of them.
+        derive_value (Callable):
+            Builds the value from the setting.
+        __cached (tuple):
+            The settings version, setting and value of the last check,
+            or None.
+        __lock (Lock):
+            Makes sure concurrent callers only build the value once.
+    """
+
+    settings_store: Any
+    key_path: tuple
+    derive_value: Callable[[Any], Any]
+    __cached: Optional[tuple]
+    __lock: Lock
+
+    def __init__(
+        self,
+        settings_store: Any,
+        key_path: tuple,
+        derive_value: Callable[[Any], Any],
+    ) -> None:
+        """
+        Set up the derived value. Nothing is built until the value is
+        first used.
+
+        Args:
+            settings_store (MacSettingsStore):
+                The settings the value is derived from.
+            key_path (tuple):
+                The setting the value is derived from, () for all of
+                them.
+            derive_value (Callable):
+                Builds the value from the setting.
+        """
+        super(MacSettingsDerived, self).__init__()
+        self.settings_store = settings_store
+        self.key_path = key_path
+        self.derive_value = derive_value
+        self.__cached = None
+        self.__lock = Lock()
+        self.__name__ = getattr(derive_value, "__name__", "derived")
+        self.__doc__ = getattr(derive_value, "__doc__", None)
+
+    def _setting(self) -> Any:
+        """
+        The setting the value is derived from.
+
+        Args:
+            None
+
+        Returns:
+            any:
+                The setting.
+        """
+        if not self.key_path:
+            return self.settings_store.get_all_settings()
+        return self.settings_store[self.key_path]
+
+    def __call__(self) -> Any:
+        """
+        Return the value, building it if the setting has changed since it
+        was last built.
+
+        Args:
+            None
+
+        Returns:
+            any:
+                The derived value.
+        """
+        cached = self.__cached
+        if cached is not None and cached[0] == self.settings_store.version:
+            return cached[2]
+        with self.__lock:
+            # Read the version first, so a change made while the value is
+            # being built leaves it stale.
+            version = self.settings_store.version
+            cached = self.__cached
+            if cached is not None and cached[0] == version:
+                return cached[2]
+            setting = self._setting()
+            if cached is not None and (
+                setting is cached[1] or setting == cached[1]
+            ):
+                self.__cached = (version, cached[1], cached[2])
+                return cached[2]
+            value = self.derive_value(setting)
+            self.__cached = (version, setting, value)
+            return value
+
+    def invalidate(self) -> None:
+        """
+        Throw the value away, so it's rebuilt when it's next used.
+
+        Args:
+            None
+
+        Return:
+            None
+        """
+        self.__cached = None
+
+    def close(self) -> None:
+        """
+        Let go of the value and the setting it was built from. It's built
+        again if it's used after being closed.
+
+        Args:
+            None
+
+        Return:
+            None
+        """
+        self.invalidate()
+
+
+if __name__ == "__main__":  # pragma: no cover
+    pass
@@ -0,0 +1,163 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Name:
+        mac_settings_lock.py
+    Description:
+        A lock file shared by every process writing the same settings
+        file, holding a generation number that's bumped by each save.
+
+        A writer takes the lock exclusively to save. If the generation
+        isn't the one it last loaded or saved, another process has saved
+        since, so the writer reads the file again and applies just the
+        settings it changed on top, rather than blindly writing over the
+        other process's changes. Readers take the lock shared, so they
+        never see a half written file paired with the wrong generation.
+
+            settings_lock = MacSettingsFileLock("app.yaml.lock")
+            with settings_lock.locked(exclusive=True):
+                if settings_lock.generation != loaded_generation:
+                    ...
+                settings_lock.bump()
+    Version:
+        1 - Initial release
+    Author:
+        J.MacGrillen <macgrillen@gmail.com>
+    Copyright:
+        Copyright (c) John MacGrillen. All rights reserved.
+"""
+import os
+from contextlib import contextmanager
+from typing import Iterator, Optional
+from maclib.mac_exception import MacException
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+    import msvcrt
+
+
+class MacSettingsLockException(MacException):
+    """
+    Exception from the settings lock file.
+    """
+
+    pass
+
+
+class MacSettingsFileLock(object):
+    """
+    An advisory lock file holding the generation of a settings file.
+
+    Attributes:
+        lock_path (str):
+            The lock file.
+        generation (int):
+            The generation read when the lock was taken, or bumped to.
+        __file_descriptor (int):
+            The open lock file while it's locked, otherwise None.
+    """
+
+    lock_path: str
+    generation: int
+    __file_descriptor: Optional[int]
+
+    def __init__(self, lock_path: str) -> None:
+        """
+        Set up the lock. The lock file is created when it's first locked.
+
+        Args:
+            lock_path (str):
+                The lock file, e.g. the settings file with .lock added.
+        """
+        super(MacSettingsFileLock, self).__init__()
+        self.lock_path = lock_path
+        self.generation = 0
+        self.__file_descriptor = None
+
+    @contextmanager
+    def locked(self, exclusive: bool = False) -> Iterator:
+        """
+        Hold the lock, reading the generation once it's held.
+
+        Args:
+            exclusive (bool):
+                Take the lock exclusively to write, otherwise it's shared
+                with other readers.
+
+        Return:
+            MacSettingsFileLock:
+                The lock, with the generation read.
+        """
+        try:
+            file_descriptor = os.open(
+                self.lock_path, os.O_RDWR | os.O_CREAT, 0o600
+            )
+        except OSError as err:
+            raise MacSettingsLockException(
+                f"Unable to open the lock file {self.lock_path} {err}"
+            )
+        try:
+            if fcntl is not None:
+                fcntl.flock(
+                    file_descriptor,
+                    fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH,
+                )
+            else:  # pragma: no cover
+                # Windows only has exclusive locks.
+                msvcrt.locking(file_descriptor, msvcrt.LK_LOCK, 1)
+            self.__file_descriptor = file_descriptor
+            self.generation = self._read_generation()
+            yield self
+        finally:
+            self.__file_descriptor = None
+            # Closing the file releases the lock.
+            os.close(file_descriptor)
+
+    def _read_generation(self) -> int:
+        """
+        Read the generation from the locked file.
+
+        Args:
+            None
+
+        Return:
+            int:
+                The generation, 0 before the first save.
+        """
+        os.lseek(self.__file_descriptor, 0, os.SEEK_SET)
+        content = os.read(self.__file_descriptor, 32)
+        try:
+            return int(content.strip() or 0)
+        except ValueError:
+            raise MacSettingsLockException(
+                f"{self.lock_path} doesn't hold a settings generation."
+            )
+
+    def bump(self) -> int:
+        """
+        Bump the generation after saving. The lock must be held
+        exclusively.
+
+        Args:
+            None
+
+        Return:
+            int:
+                The new generation.
+        """
+        if self.__file_descriptor is None:
+            raise MacSettingsLockException(
+                f"The lock {self.lock_path} must be held to bump it."
+            )
+        self.generation += 1
+        content = f"{self.generation}\n".encode("ascii")
+        os.ftruncate(self.__file_descriptor, 0)
+        os.lseek(self.__file_descriptor, 0, os.SEEK_SET)
+        os.write(self.__file_descriptor, content)
+        return self.generation
+
+
+if __name__ == "__main__":  # pragma: no cover
+    pass
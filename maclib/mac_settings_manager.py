@@ -0,0 +1,281 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Name:
+        mac_settings_manager.py
+    Description:
+        Hold many independent settings stores in one process, e.g. one per
+        plugin or tenant, keyed by name. Every store shares the same file
+        watcher and a single dispatcher thread for reloading changed
+        files, so the cost of each extra store is just its settings.
+
+        from maclib.mac_settings_manager import MacSettingsManager
+
+        settings_manager = MacSettingsManager(
+            settings_directory="/etc/my_app/tenants",
+            default_settings_path="tenant_defaults.yaml",
+        )
+        tenant_settings = settings_manager.open("tenant_a")
+        tenant_settings["pool", "size"]
+    Version:
+        1 - Initial release
+    Author:
+        J.MacGrillen <macgrillen@gmail.com>
+    Copyright:
+        Copyright (c) John MacGrillen. All rights reserved.
+"""
+import sys
+import logging
+from threading import Lock
+from typing import Any, Iterator, Optional, Union
+import maclib.mac_logger as mac_logger
+from maclib.mac_exception import MacException
+from maclib.mac_file_watch import MacFileWatcher, get_file_watcher
+from maclib.mac_settings import MacSettingsDispatcher, MacSettingsStore
+from maclib.mac_storage import get_settings_storage
+
+
+class MacSettingsManagerException(MacException):
+    """
+    Exception from MacSettingsManager.
+    """
+
+    pass
+
+
+class MacSettingsManager(object):
+    """
+    Manage many settings stores, keyed by name.
+
+    Attributes:
+        mac_logger (logging.Logger):
+            The logger object for this class.
+        settings_directory (str):
+            The directory holding a {name}.yaml settings file for each
+            store, with the extension of the store's storage backend, or
+            None to use each name's platform settings directory.
+        default_settings_path (str):
+            The default settings for stores that don't have their own.
+        dispatcher (MacSettingsDispatcher):
+            Reloads changed settings files for every store, from a single
+            thread.
+        __file_watcher (MacFileWatcher):
+            The watcher shared by every store, or None when the settings
+            files aren't watched.
+        __store_args (dict):
+            Extra MacSettingsStore arguments used for every store.
+        __stores (dict):
+            The open stores, by name.
+        __lock (Lock):
+            Guards the open stores.
+    """
+
+    mac_logger: logging.Logger
+    settings_directory: Optional[str]
+    default_settings_path: Optional[str]
+    dispatcher: MacSettingsDispatcher
+    __file_watcher: Optional[MacFileWatcher]
+    __store_args: dict
+    __stores: dict
+    __lock: Lock
+
+    def __init__(
+        self,
+        settings_directory: Optional[str] = None,
+        default_settings_path: Optional[str] = None,
+        watch: Union[bool, str, MacFileWatcher] = True,
+        reload_debounce_ms: int = 100,
+        **store_args: Any,
+    ) -> None:
+        """
+        Set up the manager. Nothing is loaded or watched until a store is
+        opened.
+
+        Args:
+            settings_directory (str):
+                The directory holding a {name}.yaml settings file for each
+                store, with the extension of the store's storage backend,
+                e.g. {name}.json for JSON. When None, each store uses the
+                settings file for its name in the platform's settings
+                directory, like MacSettings.
+            default_settings_path (str):
+                The default settings for stores that don't have their own.
+            watch (bool, str or MacFileWatcher):
+                How to watch the settings files, see MacSettingsStore. The
+                one watcher is shared by every store. True uses inotify on
+                Linux and polling elsewhere, as watchdog starts a thread
+                (and on Linux an inotify instance) for every file.
+            reload_debounce_ms (int):
+                How many milliseconds to wait for a burst of file events
+                to finish before reloading a store.
+            store_args (any):
+                Any other MacSettingsStore arguments to use for every store,
+                e.g. use_cache or merge_defaults.
+        """
+        super(MacSettingsManager, self).__init__()
+        self.mac_logger = logging.getLogger(mac_logger.LOGGER_NAME)
+        self.settings_directory = settings_directory
+        self.default_settings_path = default_settings_path
+        self.dispatcher = MacSettingsDispatcher(debounce_ms=reload_debounce_ms)
+        if watch is True:
+            watch = "inotify" if sys.platform.startswith("linux") else "poll"
+        if isinstance(watch, str):
+            watch = get_file_watcher(backend=watch)
+        self.__file_watcher = watch or None
+        self.__store_args = store_args
+        self.__stores = dict()
+        self.__lock = Lock()
+
+    def open(
+        self,
+        name: str,
+        default_settings_path: Optional[str] = None,
+        settings_file_path: Optional[str] = None,
+        **store_args: Any,
+    ) -> MacSettingsStore:
+        """
+        Open and load the settings store for name, or return it if it's
+        already open.
+
+        Args:
+            name (str):
+                The name of the store, e.g. the plugin or tenant.
+            default_settings_path (str):
+                The default settings for this store, instead of the
+                manager's.
+            settings_file_path (str):
+                The settings file for this store, instead of {name}.yaml
+                (or the extension of the storage backend) in the settings
+                directory.
+            store_args (any):
+                Any other MacSettingsStore arguments for this store.
+
+        Return:
+            MacSettingsStore:
+                The loaded settings store.
+        """
+        with self.__lock:
+            settings_store = self.__stores.get(name)
+            if settings_store is not None:
+                return settings_store
+            if default_settings_path is None:
+                default_settings_path = self.default_settings_path
+            if default_settings_path is None:
+                raise MacSettingsManagerException(
+                    f"There are no default settings for {name}."
+                )
+            store_args = {**self.__store_args, **store_args}
+            storage = get_settings_storage(store_args.pop("storage", None))
+            if settings_file_path is None and self.settings_directory:
+                settings_file_path = (
+                    f"{self.settings_directory}/{name}.{storage.extension}"
+                )
+            settings_store = MacSettingsStore(
+                app_name=name,
+                default_settings_path=default_settings_path,
+                settings_file_path=settings_file_path,
+                storage=storage,
+                watch=self.__file_watcher or False,
+                dispatcher=self.dispatcher,
+                **store_args,
+            )
+            try:
+                settings_store.load_settings()
+            except MacException:
+                settings_store.close()
+                raise
+            self.__stores[name] = settings_store
+        self.mac_logger.debug(f"Opened the settings for {name}.")
+        return settings_store
+
+    def __getitem__(self, name: str) -> MacSettingsStore:
+        """
+        Get an open settings store.
+
+        Args:
+            name (str):
+                The name of the store.
+
+        Return:
+            MacSettingsStore:
+                The settings store.
+        """
+        try:
+            return self.__stores[name]
+        except KeyError:
+            raise MacSettingsManagerException(
+                f"The settings for {name} have not been opened."
+            )
+
+    def __contains__(self, name: str) -> bool:
+        """
+        Check whether a settings store is open.
+
+        Args:
+            name (str):
+                The name of the store.
+
+        Return:
+            bool:
+                True if the store is open.
+        """
+        return name in self.__stores
+
+    def __len__(self) -> int:
+        """
+        The number of open settings stores.
+
+        Return:
+            int:
+                The number of open stores.
+        """
+        return len(self.__stores)
+
+    def __iter__(self) -> Iterator[str]:
+        """
+        Iterate over the names of the open settings stores.
+
+        Return:
+            Iterator:
+                The store names.
+        """
+        with self.__lock:
+            return iter(list(self.__stores))
+
+    def close(self, name: str) -> None:
+        """
+        Close a settings store, writing out any pending changes and
+        stopping watching its file.
+
+        Args:
+            name (str):
+                The name of the store.
+
+        Return:
+            None
+        """
+        with self.__lock:
+            settings_store = self.__stores.pop(name, None)
+        if settings_store is not None:
+            settings_store.close()
+
+    def close_all(self) -> None:
+        """
+        Close every settings store and stop the dispatcher thread.
+
+        Args:
+            None
+
+        Return:
+            None
+        """
+        with self.__lock:
+            settings_stores = list(self.__stores.values())
+            self.__stores.clear()
+        for settings_store in settings_stores:
+            settings_store.close()
+        self.dispatcher.stop()
+
+
+if __name__ == "__main__":  # pragma: no cover
+    pass
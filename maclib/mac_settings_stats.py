@@ -0,0 +1,301 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Name:
+        mac_settings_stats.py
+    Description:
+        Counters and timing histograms for the settings, so it's possible
+        to see from the outside where the time goes, e.g. why a reload
+        was slow. The settings only measure anything while stats are
+        being collected, otherwise each measured step costs a method call.
+
+        settings = MacSettings(..., collect_stats=True)
+        ...
+        settings.stats()["timings"]["parse"]["max_ms"]
+    Version:
+        1 - Initial release
+    Author:
+        J.MacGrillen <macgrillen@gmail.com>
+    Copyright:
+        Copyright (c) John MacGrillen. All rights reserved.
+"""
+import time
+from contextlib import nullcontext
+from threading import Lock
+from typing import Any, Callable, Optional
+
+
+# Shared by every settings object that isn't collecting stats.
+NOT_TIMED = nullcontext()
+
+
+class MacSettingsStats(object):
+    """
+    Collect counters, and timings in histograms with a bucket for each
+    power of two microseconds.
+
+    Attributes:
+        publish (Callable):
+            Called with the name and seconds of every timing, or None.
+        __timings (dict):
+            [count, total seconds, max seconds, buckets] by name.
+        __counters (dict):
+            The counters by name.
+        __lock (Lock):
+            Guards the timings and counters.
+    """
+
+    publish: Optional[Callable[[str, float], Any]]
+    __timings: dict
+    __counters: dict
+    __lock: Lock
+
+    def __init__(
+        self, publish: Optional[Callable[[str, float], Any]] = None
+    ) -> None:
+        """
+        Start with no stats.
+
+        Args:
+            publish (Callable):
+                Called with the name and seconds of every timing, e.g. to
+                post them as events.
+        """
+        super(MacSettingsStats, self).__init__()
+        self.publish = publish
+        self.__timings = dict()
+        self.__counters = dict()
+        self.__lock = Lock()
+
+    def record(self, name: str, seconds: float) -> None:
+        """
+        Record a timing.
+
+        Args:
+            name (str):
+                What was timed, e.g. "parse".
+            seconds (float):
+                How long it took.
+
+        Return:
+            None
+        """
+        bucket = int(seconds * 1e6).bit_length()
+        with self.__lock:
+            timing = self.__timings.get(name)
+            if timing is None:
+                timing = self.__timings[name] = [0, 0.0, 0.0, dict()]
+            timing[0] += 1
+            timing[1] += seconds
+            if seconds > timing[2]:
+                timing[2] = seconds
+            timing[3][bucket] = timing[3].get(bucket, 0) + 1
+        if self.publish is not None:
+            self.publish(name, seconds)
+
+    def count(self, name: str, increment: int = 1) -> None:
+        """
+        Add to a counter.
+
+        Args:
+            name (str):
+                The counter, e.g. "reloads_skipped".
+            increment (int):
+                How much to add.
+
+        Return:
+            None
+        """
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + increment
+
+    def timer(self, name: str) -> "MacSettingsTimer":
+        """
+        Time a block of code.
+
+            with stats.timer("parse"):
+                settings = parse(document)
+
+        Args:
+            name (str):
+                What is being timed.
+
+        Return:
+            MacSettingsTimer:
+                The context manager that records the timing.
+        """
+        return MacSettingsTimer(self, name)
+
+    def snapshot(self) -> dict:
+        """
+        Return a copy of the stats.
+
+        Args:
+            None
+
+        Return:
+            dict:
+                {"timings": {name: {"count", "total_ms", "mean_ms",
+                "max_ms", "histogram_us"}}, "counters": {name: count}}.
+                The histogram maps the upper bound of each bucket, in
+                microseconds, to the number of timings in it.
+        """
+        with self.__lock:
+            timings = {
+                name: {
+                    "count": count,
+                    "total_ms": total * 1e3,
+                    "mean_ms": total * 1e3 / count,
+                    "max_ms": longest * 1e3,
+                    "histogram_us": {
+                        1 << bucket: bucket_count
+                        for bucket, bucket_count in sorted(buckets.items())
+                    },
+                }
+                for name, (count, total, longest, buckets) in (
+                    self.__timings.items()
+                )
+            }
+            return {"timings": timings, "counters": dict(self.__counters)}
+
+    def reset(self) -> None:
+        """
+        Clear the stats.
+
+        Args:
+            None
+
+        Return:
+            None
+        """
+        with self.__lock:
+            self.__timings.clear()
+            self.__counters.clear()
+
+
+class MacSettingsTimer(object):
+    """
+    Time a block of code into MacSettingsStats.
+
+    Attributes:
+        stats (MacSettingsStats):
+            Where the timing is recorded.
+        name (str):
+            What is being timed.
+        started (float):
+            The perf_counter when the block started.
+    """
+
+    stats: MacSettingsStats
+    name: str
+    started: float
+
+    def __init__(self, stats: MacSettingsStats, name: str) -> None:
+        """
+        Set up the timer.
+
+        Args:
+            stats (MacSettingsStats):
+                Where the timing is recorded.
+            name (str):
+                What is being timed.
+        """
+        self.stats = stats
+        self.name = name
+        self.started = 0.0
+
+    def __enter__(self) -> "MacSettingsTimer":
+        """
+        Start timing.
+
+        Args:
+            None
+
+        Return:
+            MacSettingsTimer:
+                This timer.
+        """
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """
+        Record how long the block took, even if it raised.
+
+        Args:
+            exc_info (any):
+                The exception raised by the block, if any.
+
+        Return:
+            None
+        """
+        self.stats.record(self.name, time.perf_counter() - self.started)
+
+
+class MacSettingsTimedLock(object):
+    """
+    Acquire a lock, recording how long it took to get it.
+
+    Attributes:
+        lock (Any):
+            The lock.
+        stats (MacSettingsStats):
+            Where the wait is recorded.
+        name (str):
+            The name of the timing.
+    """
+
+    lock: Any
+    stats: MacSettingsStats
+    name: str
+
+    def __init__(
+        self, lock: Any, stats: MacSettingsStats, name: str = "lock_wait"
+    ) -> None:
+        """
+        Set up the timed lock.
+
+        Args:
+            lock (Any):
+                The lock.
+            stats (MacSettingsStats):
+                Where the wait is recorded.
+            name (str):
+                The name of the timing.
+        """
+        self.lock = lock
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self) -> Any:
+        """
+        Acquire the lock, recording how long it took to get it.
+
+        Args:
+            None
+
+        Return:
+            any:
+                The lock.
+        """
+        started = time.perf_counter()
+        self.lock.acquire()
+        self.stats.record(self.name, time.perf_counter() - started)
+        return self.lock
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """
+        Release the lock.
+
+        Args:
+            exc_info (any):
+                The exception raised while holding the lock, if any.
+
+        Return:
+            None
+        """
+        self.lock.release()
+
+
+if __name__ == "__main__":  # pragma: no cover
+    pass
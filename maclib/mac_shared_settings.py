@@ -0,0 +1,502 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Name:
+        mac_shared_settings.py
+    Description:
+        Share one process's settings with many worker processes through
+        a memory mapped file, e.g. for a pre-fork server. The owner
+        process loads and watches the settings file as usual and publishes
+        every new version of the settings into the mapped file. Workers
+        attach read only and never parse or watch the settings file
+        themselves.
+
+        The mapped file has a small header holding a generation counter,
+        used as a seqlock: the owner makes it odd while it's writing and
+        even again when the settings are complete. A worker checks the
+        generation on each access, which is a read from shared memory,
+        and only copies and deserialises the settings when it has changed.
+
+        In the owner, before forking:
+
+            settings = MacSettings(app_name="my_app", ...)
+            settings.load_settings()
+            publisher = MacSharedSettingsPublisher(settings)
+
+        In each worker:
+
+            settings = MacSharedSettingsReader(publisher.shared_path)
+            settings["pool", "size"]
+    Version:
+        1 - Initial release
+    Author:
+        J.MacGrillen <macgrillen@gmail.com>
+    Copyright:
+        Copyright (c) John MacGrillen. All rights reserved.
+"""
+import os
+import mmap
+import time
+import struct
+import marshal
+import operator
+import logging
+from functools import reduce
+from threading import Lock
+from typing import Any, Optional
+import yaml
+import maclib.mac_logger as mac_logger
+from maclib.mac_exception import MacException
+from maclib.mac_settings import (
+    MacSettingsEvents,
+    MacSettingsStore,
+    split_key_path,
+)
+from maclib.mac_storage import YamlDumper, YamlLoader
+
+
+# The header is the magic, the generation, the payload length and the
+# payload format, followed by the payload.
+SHARED_MAGIC = b"MACSHM01"
+SHARED_HEADER = struct.Struct("<8sQQB7x")
+GENERATION = struct.Struct("<Q")
+GENERATION_OFFSET = 8
+PAYLOAD_INFO = struct.Struct("<QB")
+PAYLOAD_INFO_OFFSET = 16
+PAYLOAD_OFFSET = SHARED_HEADER.size
+
+# Settings are marshalled, unless they hold something marshal can't
+# store (such as dates), in which case they're written as YAML.
+PAYLOAD_MARSHAL = 1
+PAYLOAD_YAML = 2
+
+# Plenty for any settings file. The file is sparse, so only the pages
+# actually used take any memory.
+DEFAULT_CAPACITY = 8 * 1024 * 1024
+
+
+class MacSharedSettingsException(MacException):
+    """
+    Exception from the shared settings.
+    """
+
+    pass
+
+
+class MacSharedSettingsPublisher(object):
+    """
+    Publish a settings store's settings into a memory mapped file every
+    time they are loaded or changed.
+
+    Attributes:
+        mac_logger (logging.Logger):
+            The logger object for this class.
+        settings_store (MacSettingsStore):
+            The settings being published.
+        shared_path (str):
+            The memory mapped file.
+        capacity (int):
+            The size of the memory mapped file.
+        generation (int):
+            The generation of the settings last published.
+        __shared_memory (mmap.mmap):
+            The writable mapping of the file.
+        __published_settings (any):
+            The settings tree last published, so the same settings aren't
+            published again.
+        __lock (Lock):
+            Serialises publishing.
+    """
+
+    mac_logger: logging.Logger
+    settings_store: MacSettingsStore
+    shared_path: str
+    capacity: int
+    generation: int
+    __shared_memory: Optional[mmap.mmap]
+    __published_settings: Any
+    __lock: Lock
+
+    def __init__(
+        self,
+        settings_store: MacSettingsStore,
+        shared_path: Optional[str] = None,
+        capacity: int = DEFAULT_CAPACITY,
+    ) -> None:
+        """
+        Create (or take over) the memory mapped file and publish the
+        current settings.
+
+        Args:
+            settings_store (MacSettingsStore):
+                The loaded settings to publish.
+            shared_path (str):
+                The memory mapped file, defaults to the settings file with
+                .shm added. A file under /dev/shm avoids any disk writes.
+            capacity (int):
+                The size of the memory mapped file, which limits the size
+                of the serialised settings.
+        """
+        super(MacSharedSettingsPublisher, self).__init__()
+        self.mac_logger = logging.getLogger(mac_logger.LOGGER_NAME)
+        self.settings_store = settings_store
+        if shared_path is None:
+            shared_path = f"{settings_store.settings_file_path}.shm"
+        self.shared_path = shared_path
+        self.capacity = max(capacity, mmap.PAGESIZE)
+        self.__lock = Lock()
+        self.__published_settings = None
+        file_descriptor = os.open(
+            self.shared_path, os.O_RDWR | os.O_CREAT, 0o600
+        )
+        try:
+            os.ftruncate(file_descriptor, self.capacity)
+            self.__shared_memory = mmap.mmap(file_descriptor, self.capacity)
+        finally:
+            os.close(file_descriptor)
+        self.generation = 0
+        if self.__shared_memory[:8] == SHARED_MAGIC:
+            # Carry on from the last owner, so workers that are still
+            # attached see the next publish as a change.
+            (self.generation,) = GENERATION.unpack_from(
+                self.__shared_memory, GENERATION_OFFSET
+            )
+            self.generation += self.generation & 1
+        # Odd until the first publish is complete, so readers wait for it
+        # rather than reading an empty payload.
+        SHARED_HEADER.pack_into(
+            self.__shared_memory, 0, SHARED_MAGIC, self.generation + 1, 0, 0
+        )
+        self._publish()
+        for event_action in (
+            MacSettingsEvents.settings_loaded,
+            MacSettingsEvents.settings_changed,
+        ):
+            settings_store.register_for_events(
+                event=event_action, call_back=self.publish_settings
+            )
+
+    def publish_settings(self, event: Any = None) -> None:
+        """
+        Publish the store's current settings, unless they are the ones
+        last published, e.g. when a reload posts both settings_loaded and
+        settings_changed. This is called from the store's events, after
+        the change has been made, so settings too big to publish are
+        logged rather than raised, and readers keep the settings last
+        published.
+
+        Args:
+            event (MacEvent):
+                The settings event when called by the store.
+
+        Return:
+            None
+        """
+        try:
+            self._publish()
+        except MacSharedSettingsException as err:
+            self.mac_logger.error(f"{err} They haven't been published.")
+
+    def _publish(self) -> None:
+        """
+        Publish the store's current settings if they have changed since
+        they were last published.
+
+        Args:
+            None
+
+        Return:
+            None
+        """
+        settings = self.settings_store.get_all_settings()
+        if settings is self.__published_settings:
+            return
+        try:
+            payload = marshal.dumps(settings)
+            payload_format = PAYLOAD_MARSHAL
+        except ValueError:
+            payload = yaml.dump(settings, Dumper=YamlDumper, encoding="utf8")
+            payload_format = PAYLOAD_YAML
+        with self.__lock:
+            if (
+                self.__shared_memory is None
+                or settings is self.__published_settings
+            ):
+                return
+            if PAYLOAD_OFFSET + len(payload) > self.capacity:
+                raise MacSharedSettingsException(
+                    f"The settings need {len(payload)} bytes, which won't "
+                    f"fit in the {self.capacity} byte shared settings."
+                )
+            shared_memory = self.__shared_memory
+            # An odd generation tells readers a write is in progress.
+            GENERATION.pack_into(
+                shared_memory, GENERATION_OFFSET, self.generation + 1
+            )
+            shared_memory[PAYLOAD_OFFSET:PAYLOAD_OFFSET + len(payload)] = (
+                payload
+            )
+            PAYLOAD_INFO.pack_into(
+                shared_memory,
+                PAYLOAD_INFO_OFFSET,
+                len(payload),
+                payload_format,
+            )
+            self.generation += 2
+            GENERATION.pack_into(
+                shared_memory, GENERATION_OFFSET, self.generation
+            )
+            self.__published_settings = settings
+        self.mac_logger.debug(
+            f"Published generation {self.generation} of the settings."
+        )
+
+    def close(self) -> None:
+        """
+        Stop publishing. The file is left in place, so workers keep the
+        last settings published.
+
+        Args:
+            None
+
+        Return:
+            None
+        """
+        for event_action in (
+            MacSettingsEvents.settings_loaded,
+            MacSettingsEvents.settings_changed,
+        ):
+            self.settings_store.unregister_for_events(
+                event=event_action, call_back=self.publish_settings
+            )
+        with self.__lock:
+            if self.__shared_memory is not None:
+                self.__shared_memory.close()
+            self.__shared_memory = None
+            self.__published_settings = None
+
+
+class MacSharedSettingsReader(object):
+    """
+    Read only access to settings published by a MacSharedSettingsPublisher
+    in another process. Lookups work like MacSettings, with a tuple of
+    keys or a dotted string.
+
+    Attributes:
+        shared_path (str):
+            The memory mapped file.
+        __shared_memory (mmap.mmap):
+            The read only mapping of the file.
+        __generation (int):
+            The generation of the settings held.
+        __settings (any):
+            The settings, deserialised from the generation held.
+        __lock (Lock):
+            Serialises refreshing the settings.
+    """
+
+    shared_path: str
+    __shared_memory: mmap.mmap
+    __generation: int
+    __settings: Any
+    __lock: Lock
+
+    def __init__(self, shared_path: str) -> None:
+        """
+        Attach to the shared settings. Nothing is deserialised until the
+        settings are used.
+
+        Args:
+            shared_path (str):
+                The memory mapped file the owner publishes to.
+        """
+        super(MacSharedSettingsReader, self).__init__()
+        self.shared_path = shared_path
+        try:
+            with open(file=shared_path, mode="rb") as shared_file:
+                self.__shared_memory = mmap.mmap(
+                    shared_file.fileno(), 0, access=mmap.ACCESS_READ
+                )
+        except (OSError, ValueError) as err:
+            raise MacSharedSettingsException(
+                f"Unable to attach to the shared settings {shared_path}"
+                f" {err}"
+            )
+        if self.__shared_memory[:8] != SHARED_MAGIC:
+            raise MacSharedSettingsException(
+                f"{shared_path} doesn't hold shared settings."
+            )
+        self.__generation = -1
+        self.__settings = None
+        self.__lock = Lock()
+
+    @property
+    def generation(self) -> int:
+        """
+        The generation currently published by the owner.
+
+        Return:
+            int:
+                The published generation.
+        """
+        return GENERATION.unpack_from(
+            self.__shared_memory, GENERATION_OFFSET
+        )[0]
+
+    def get_all_settings(self) -> Any:
+        """
+        Return all the settings, picking up the latest generation if the
+        owner has published a new one. The result is shared, so don't
+        change it in place.
+
+        Args:
+            None
+
+        Return:
+            any:
+                The settings.
+        """
+        if self.generation != self.__generation:
+            self._refresh()
+        return self.__settings
+
+    def _refresh(self) -> None:
+        """
+        Copy and deserialise the latest complete generation.
+
+        Args:
+            None
+
+        Return:
+            None
+        """
+        shared_memory = self.__shared_memory
+        with self.__lock:
+            deadline = time.monotonic() + 1.0
+            while True:
+                (generation,) = GENERATION.unpack_from(
+                    shared_memory, GENERATION_OFFSET
+                )
+                if generation == self.__generation:
+                    return
+                if not generation & 1:
+                    length, payload_format = PAYLOAD_INFO.unpack_from(
+                        shared_memory, PAYLOAD_INFO_OFFSET
+                    )
+                    payload = shared_memory[
+                        PAYLOAD_OFFSET:PAYLOAD_OFFSET + length
+                    ]
+                    # Only use the copy if nothing was written while it
+                    # was being taken.
+                    if (
+                        GENERATION.unpack_from(
+                            shared_memory, GENERATION_OFFSET
+                        )[0]
+                        == generation
+                    ):
+                        break
+                if time.monotonic() > deadline:
+                    raise MacSharedSettingsException(
+                        "Timed out waiting for the shared settings to be"
+                        " published."
+                    )
+                time.sleep(0)
+            if generation == 0:
+                raise MacSharedSettingsException(
+                    "No settings have been published yet."
+                )
+            if payload_format == PAYLOAD_MARSHAL:
+                self.__settings = marshal.loads(payload)
+            else:
+                self.__settings = yaml.load(payload, Loader=YamlLoader)
+            self.__generation = generation
+
+    def __getitem__(self, keys: Any) -> Any:
+        """
+        Get a setting.
+
+        Args:
+            keys (any):
+                A key, a tuple of keys, or a dotted string, e.g.
+                "level1.level2".
+
+        Return:
+            any:
+                The setting.
+        """
+        settings = self.get_all_settings()
+        if isinstance(keys, tuple):
+            key_path = keys
+        elif isinstance(settings, dict) and keys in settings:
+            return settings[keys]
+        elif isinstance(keys, str):
+            key_path = split_key_path(keys)
+        else:
+            key_path = (keys,)
+        try:
+            return reduce(operator.getitem, key_path, settings)
+        except (KeyError, IndexError, TypeError):
+            raise MacSharedSettingsException(
+                f"key {keys} is not in the dictionary."
+            )
+
+    def __setitem__(self, keys: Any, value: Any) -> None:
+        """
+        The shared settings are read only, change them in the owner.
+
+        Args:
+            keys (any):
+                The key.
+            value (any):
+                The value.
+
+        Return:
+            None
+        """
+        raise MacSharedSettingsException(
+            "The shared settings are read only, change them in the"
+            " process that owns the settings file."
+        )
+
+    def __contains__(self, keys: Any) -> bool:
+        """
+        Check whether a setting exists.
+
+        Args:
+            keys (any):
+                A key, a tuple of keys, or a dotted string.
+
+        Return:
+            bool:
+                True if the setting exists.
+        """
+        settings = self.get_all_settings()
+        if isinstance(keys, tuple):
+            key_path = keys
+        elif isinstance(settings, dict) and keys in settings:
+            return True
+        elif isinstance(keys, str):
+            key_path = split_key_path(keys)
+        else:
+            return False
+        try:
+            reduce(operator.getitem, key_path, settings)
+        except (KeyError, IndexError, TypeError):
+            return False
+        return bool(key_path)
+
+    def close(self) -> None:
+        """
+        Detach from the shared settings.
+
+        Args:
+            None
+
+        Return:
+            None
+        """
+        self.__shared_memory.close()
+
+
+if __name__ == "__main__":  # pragma: no cover
+    pass
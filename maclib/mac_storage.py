@@ -0,0 +1,828 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Name:
+        mac_storage.py
+    Description:
+        Storage backends for settings files. Each backend reads, parses
+        and writes the settings in one format:
+
+         - MacYamlStorage: YAML, using libyaml when PyYAML has it.
+         - MacJsonStorage: JSON, which is much quicker to parse and write.
+         - MacTomlStorage: TOML, read only.
+         - MacSqliteStorage: SQLite, with a row per setting, so a change
+           only writes the settings that changed rather than the whole
+           document.
+
+        A backend's read returns a document, the bytes used to tell whether
+        the settings have changed since they were last read or written,
+        which parse turns into the settings. For the file formats this is
+        the file's content. For SQLite it's a generation number that every
+        write increments, so checking for changes is cheap.
+
+        from maclib.mac_storage import get_settings_storage
+
+        storage = get_settings_storage("json")
+        document, file_stat = storage.read("settings.json")
+        settings = storage.parse(document, "settings.json")
+    Version:
+        1 - Initial release
+    Author:
+        J.MacGrillen <macgrillen@gmail.com>
+    Copyright:
+        Copyright (c) John MacGrillen. All rights reserved.
+"""
+import os
+import re
+import json
+import sqlite3
+import tomllib
+import yaml
+from abc import ABC, abstractmethod
+from threading import Lock
+from typing import Any, Iterable, Optional, Union
+from maclib.mac_exception import MacException
+
+# Use the libyaml C loader and dumper when PyYAML has been built with it,
+# they are many times faster than the pure Python ones.
+try:
+    from yaml import CSafeLoader as YamlLoader, CSafeDumper as YamlDumper
+
+    YAML_BACKEND = "libyaml"
+except ImportError:  # pragma: no cover
+    from yaml import SafeLoader as YamlLoader, SafeDumper as YamlDumper
+
+    YAML_BACKEND = "python"
+
+
+# Marks a key that isn't in the settings, as None is a valid setting value.
+_MISSING = object()
+
+# A top level YAML key that can be split out of the document to parse on
+# its own, i.e. a plain string key. Anything else is parsed straight away.
+_YAML_SECTION_KEY = re.compile(rb"([A-Za-z_][A-Za-z0-9_\-]*):(?:[ \t\r\n]|$)")
+# Plain keys that YAML reads as something other than a string.
+_YAML_KEYWORDS = frozenset(
+    [b"y", b"n", b"yes", b"no", b"on", b"off", b"true", b"false", b"null"]
+)
+# Anchors and aliases can join sections together, so they can't be split.
+_YAML_ANCHOR = re.compile(rb"(?:^|[\s\[{,])[&*][^\s]", re.MULTILINE)
+
+
+class MacStorageException(MacException):
+    """
+    Exception from the settings storage backends.
+    """
+
+    pass
+
+
+class MacSettingsStorage(ABC):
+    """
+    The interface every settings storage backend provides. The file
+    formats only need to provide parse and dump, and a backend can't be
+    created without parse.
+
+    Attributes:
+        format_name (str):
+            The name of the format, e.g. "yaml".
+        extension (str):
+            The file extension for settings files in this format.
+        read_only (bool):
+            Whether the backend can only read settings.
+        cacheable (bool):
+            Whether the parsed settings are worth keeping in the compiled
+            settings cache.
+    """
+
+    format_name: str = ""
+    extension: str = ""
+    read_only: bool = False
+    cacheable: bool = False
+
+    def read(self, file_path: str) -> tuple:
+        """
+        Read the document for a settings file.
+
+        Args:
+            file_path (str):
+                The settings file.
+
+        Return:
+            tuple:
+                The document as bytes and the file's os.stat_result.
+        """
+        try:
+            with open(file=file_path, mode="rb") as settings_file:
+                document = settings_file.read()
+                file_stat = os.fstat(settings_file.fileno())
+        except IOError as io_error:
+            raise MacStorageException(
+                f"Unable to read the settings file {file_path} {io_error}"
+            )
+        return document, file_stat
+
+    @abstractmethod
+    def parse(self, document: bytes, file_path: str) -> Any:
+        """
+        Turn a document into the settings.
+
+        Args:
+            document (bytes):
+                The document from read.
+            file_path (str):
+                The settings file the document came from.
+
+        Return:
+            any:
+                The settings.
+        """
+
+    def dump(self, settings: Any) -> bytes:
+        """
+        Turn the settings into a document to write.
+
+        Args:
+            settings (any):
+                The settings.
+
+        Return:
+            bytes:
+                The document.
+        """
+        raise MacStorageException(
+            f"{self.format_name} settings files are read only."
+        )
+
+    def write(self, file_path: str, settings: Any) -> tuple:
+        """
+        Write all the settings to a settings file.
+
+        Args:
+            file_path (str):
+                The settings file.
+            settings (any):
+                The settings.
+
+        Return:
+            tuple:
+                The document written and the file's os.stat_result.
+        """
+        document = self.dump(settings)
+        try:
+            with open(file=file_path, mode="wb") as settings_file:
+                settings_file.write(document)
+                settings_file.flush()
+                file_stat = os.fstat(settings_file.fileno())
+        except IOError as io_error:
+            raise MacStorageException(
+                f"Unable to write the settings file {file_path} {io_error}"
+            )
+        return document, file_stat
+
+    def write_changes(
+        self, file_path: str, settings: Any, key_paths: Iterable[tuple]
+    ) -> Optional[tuple]:
+        """
+        Write only the settings at the given key paths, for backends that
+        can. A key path that is no longer in the settings is removed.
+
+        Args:
+            file_path (str):
+                The settings file.
+            settings (any):
+                All the settings.
+            key_paths (Iterable):
+                The key paths that have changed since the last write.
+
+        Return:
+            tuple:
+                The document and the file's os.stat_result, or None if the
+                backend can't write part of the settings, in which case
+                use write.
+        """
+        return None
+
+    def split_sections(
+        self, document: bytes, sections: Optional[Iterable[str]] = None
+    ) -> Optional[tuple]:
+        """
+        Split the top level sections out of a document, so they can be
+        parsed when they are first used rather than up front.
+
+        Args:
+            document (bytes):
+                The document from read.
+            sections (Iterable):
+                The top level keys to split out, or None for all of them.
+
+        Return:
+            tuple:
+                The document without the split out sections, and the
+                document of each section by key. None if the backend
+                can't split the document, in which case parse all of it.
+        """
+        return None
+
+    def parse_section(
+        self, key: str, section_document: bytes, file_path: str
+    ) -> Any:
+        """
+        Parse a section split out by split_sections.
+
+        Args:
+            key (str):
+                The section's key.
+            section_document (bytes):
+                The document of the section.
+            file_path (str):
+                The settings file the section came from.
+
+        Return:
+            any:
+                The section's settings.
+        """
+        section = self.parse(section_document, file_path)
+        if not isinstance(section, dict) or list(section) != [key]:
+            raise MacStorageException(
+                f"The {key} section of {file_path} didn't parse on its own."
+            )
+        return section[key]
+
+    def close(self) -> None:
+        """
+        Release anything the backend holds open.
+
+        Args:
+            None
+
+        Return:
+            None
+        """
+        pass
+
+
+class MacYamlStorage(MacSettingsStorage):
+    """
+    YAML settings files.
+    """
+
+    format_name = "yaml"
+    extension = "yaml"
+    cacheable = True
+
+    def parse(self, document: bytes, file_path: str) -> Any:
+        """
+        Parse a YAML document.
+
+        Args:
+            document (bytes):
+                The YAML.
+            file_path (str):
+                The settings file the document came from.
+
+        Return:
+            any:
+                The settings.
+        """
+        try:
+            return yaml.load(stream=document, Loader=YamlLoader)
+        except yaml.YAMLError as yaml_error:
+            raise MacStorageException(
+                f"There was a problem parsing the file {file_path}"
+                f" {yaml_error}"
+            )
+
+    def split_sections(
+        self, document: bytes, sections: Optional[Iterable[str]] = None
+    ) -> Optional[tuple]:
+        """
+        Split the top level sections out of a YAML document. Only a
+        mapping of plain string keys can be split, in a document without
+        anchors or aliases. Splitting just scans the lines that start in
+        the first column, so it's much quicker than parsing, and gives up
+        on any of them that isn't a plain key with a value that ends on
+        its line.
+
+        Args:
+            document (bytes):
+                The YAML.
+            sections (Iterable):
+                The top level keys to split out, or None for all of them.
+
+        Return:
+            tuple:
+                The YAML without the split out sections, and the YAML of
+                each section by key, or None if it can't be split.
+        """
+        if _YAML_ANCHOR.search(document):
+            return None
+        wanted = None
+        if sections is not None:
+            wanted = {section.encode("utf8") for section in sections}
+        head: list = []
+        section_lines: dict = {}
+        current = head
+        for line in document.splitlines(keepends=True):
+            if line.startswith((b"---", b"...", b"%")):
+                if section_lines:
+                    # More than one document.
+                    return None
+                current = head
+                current.append(line)
+                continue
+            if line[:1] in (b" ", b"\t", b"\r", b"\n", b"#", b"-"):
+                # Part of the current section, including a list that
+                # isn't indented under its key.
+                current.append(line)
+                continue
+            key_match = _YAML_SECTION_KEY.match(line)
+            if key_match is None:
+                # Not a mapping, a key that can't be split out, or a flow
+                # collection carried on in the first column, which can't
+                # be told apart without parsing.
+                return None
+            value = line[key_match.end():].strip()
+            opened = value.count(b"[") + value.count(b"{")
+            closed = value.count(b"]") + value.count(b"}")
+            if value[:1] in (b"[", b"{") and opened != closed:
+                # A flow collection carried on over the next lines.
+                return None
+            if value[:1] in (b'"', b"'") and (
+                len(value) < 2 or value[-1:] != value[:1]
+            ):
+                # A quoted value, or one with a comment, which may carry
+                # on over the next lines.
+                return None
+            key = key_match.group(1)
+            if key.lower() in _YAML_KEYWORDS or (
+                wanted is not None and key not in wanted
+            ):
+                current = head
+            elif key in section_lines:
+                return None
+            else:
+                current = section_lines[key] = []
+            current.append(line)
+        return b"".join(head), {
+            key.decode("utf8"): b"".join(lines)
+            for key, lines in section_lines.items()
+        }
+
+    def dump(self, settings: Any) -> bytes:
+        """
+        Write the settings as YAML.
+
+        Args:
+            settings (any):
+                The settings.
+
+        Return:
+            bytes:
+                The YAML.
+        """
+        return yaml.dump(
+            data=settings,
+            Dumper=YamlDumper,
+            indent=4,
+            default_flow_style=False,
+            allow_unicode=True,
+            encoding="utf8",
+        )
+
+
+class MacJsonStorage(MacSettingsStorage):
+    """
+    JSON settings files.
+    """
+
+    format_name = "json"
+    extension = "json"
+
+    def parse(self, document: bytes, file_path: str) -> Any:
+        """
+        Parse a JSON document. An empty file has no settings.
+
+        Args:
+            document (bytes):
+                The JSON.
+            file_path (str):
+                The settings file the document came from.
+
+        Return:
+            any:
+                The settings.
+        """
+        if not document.strip():
+            return None
+        try:
+            return json.loads(document)
+        except ValueError as json_error:
+            raise MacStorageException(
+                f"There was a problem parsing the file {file_path}"
+                f" {json_error}"
+            )
+
+    def dump(self, settings: Any) -> bytes:
+        """
+        Write the settings as JSON.
+
+        Args:
+            settings (any):
+                The settings.
+
+        Return:
+            bytes:
+                The JSON.
+        """
+        try:
+            return json.dumps(settings, indent=4, ensure_ascii=False).encode(
+                "utf8"
+            )
+        except (TypeError, ValueError) as json_error:
+            raise MacStorageException(
+                f"The settings can't be written as JSON. {json_error}"
+            )
+
+
+class MacTomlStorage(MacSettingsStorage):
+    """
+    TOML settings files. These can only be read.
+    """
+
+    format_name = "toml"
+    extension = "toml"
+    read_only = True
+
+    def parse(self, document: bytes, file_path: str) -> Any:
+        """
+        Parse a TOML document.
+
+        Args:
+            document (bytes):
+                The TOML.
+            file_path (str):
+                The settings file the document came from.
+
+        Return:
+            any:
+                The settings.
+        """
+        try:
+            return tomllib.loads(document.decode("utf8"))
+        except (tomllib.TOMLDecodeError, UnicodeDecodeError) as toml_error:
+            raise MacStorageException(
+                f"There was a problem parsing the file {file_path}"
+                f" {toml_error}"
+            )
+
+
+class MacSqliteStorage(MacSettingsStorage):
+    """
+    SQLite settings databases. Every leaf setting is a row keyed by its
+    key path (as JSON) with its value as JSON, so a change only writes
+    the rows under the key path that changed. Mappings are descended into,
+    anything else (including lists and empty mappings) is a single row.
+
+    Attributes:
+        __connections (dict):
+            An open connection for each database, by path.
+        __lock (Lock):
+            Serialises use of the connections.
+    """
+
+    format_name = "sqlite"
+    extension = "db"
+    __connections: dict
+    __lock: Lock
+
+    def __init__(self) -> None:
+        """
+        Nothing is opened until a database is used.
+        """
+        super(MacSqliteStorage, self).__init__()
+        self.__connections = dict()
+        self.__lock = Lock()
+
+    def _connect(self, file_path: str) -> sqlite3.Connection:
+        """
+        Get the connection to a database, creating its tables if need be.
+        The caller must hold the lock.
+
+        Args:
+            file_path (str):
+                The database.
+
+        Return:
+            sqlite3.Connection:
+                The connection.
+        """
+        connection = self.__connections.get(file_path)
+        if connection is None:
+            # Autocommit, transactions are started explicitly.
+            connection = sqlite3.connect(
+                file_path, check_same_thread=False, isolation_level=None
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS settings"
+                " (key_path TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS generation"
+                " (id INTEGER PRIMARY KEY CHECK (id = 0),"
+                " generation INTEGER NOT NULL)"
+            )
+            connection.execute(
+                "INSERT OR IGNORE INTO generation VALUES (0, 0)"
+            )
+            self.__connections[file_path] = connection
+        return connection
+
+    def close(self) -> None:
+        """
+        Close every open connection.
+
+        Args:
+            None
+
+        Return:
+            None
+        """
+        with self.__lock:
+            for connection in self.__connections.values():
+                connection.close()
+            self.__connections.clear()
+
+    def read(self, file_path: str) -> tuple:
+        """
+        Read the database's generation, which changes on every write.
+
+        Args:
+            file_path (str):
+                The database.
+
+        Return:
+            tuple:
+                The generation as bytes and the file's os.stat_result.
+        """
+        try:
+            with self.__lock:
+                (generation,) = (
+                    self._connect(file_path)
+                    .execute("SELECT generation FROM generation")
+                    .fetchone()
+                )
+            file_stat = os.stat(file_path)
+        except (sqlite3.Error, OSError) as sqlite_error:
+            raise MacStorageException(
+                f"Unable to read the settings database {file_path}"
+                f" {sqlite_error}"
+            )
+        return f"generation {generation}".encode("utf8"), file_stat
+
+    def parse(self, document: bytes, file_path: str) -> Any:
+        """
+        Read all the settings from the database.
+
+        Args:
+            document (bytes):
+                The generation from read.
+            file_path (str):
+                The database.
+
+        Return:
+            any:
+                The settings.
+        """
+        settings: dict = {}
+        try:
+            with self.__lock:
+                rows = (
+                    self._connect(file_path)
+                    .execute("SELECT key_path, value FROM settings")
+                    .fetchall()
+                )
+            for key_path, value in rows:
+                node = settings
+                key_path = json.loads(key_path)
+                for key in key_path[:-1]:
+                    node = node.setdefault(key, {})
+                node[key_path[-1]] = json.loads(value)
+        except (sqlite3.Error, ValueError) as sqlite_error:
+            raise MacStorageException(
+                f"Unable to read the settings database {file_path}"
+                f" {sqlite_error}"
+            )
+        return settings
+
+    def write(self, file_path: str, settings: Any) -> tuple:
+        """
+        Replace all the settings in the database.
+
+        Args:
+            file_path (str):
+                The database.
+            settings (any):
+                The settings.
+
+        Return:
+            tuple:
+                The new generation and the file's os.stat_result.
+        """
+        if not isinstance(settings, dict):
+            settings = dict()
+        return self._write_rows(
+            file_path=file_path, settings=settings, key_paths=None
+        )
+
+    def write_changes(
+        self, file_path: str, settings: Any, key_paths: Iterable[tuple]
+    ) -> Optional[tuple]:
+        """
+        Replace only the rows under the key paths that have changed.
+
+        Args:
+            file_path (str):
+                The database.
+            settings (any):
+                All the settings.
+            key_paths (Iterable):
+                The key paths that have changed since the last write.
+
+        Return:
+            tuple:
+                The new generation and the file's os.stat_result.
+        """
+        if not isinstance(settings, dict):
+            return None
+        return self._write_rows(
+            file_path=file_path, settings=settings, key_paths=key_paths
+        )
+
+    def _write_rows(
+        self,
+        file_path: str,
+        settings: dict,
+        key_paths: Optional[Iterable[tuple]],
+    ) -> tuple:
+        """
+        Write settings rows in a single transaction and bump the
+        generation.
+
+        Args:
+            file_path (str):
+                The database.
+            settings (dict):
+                All the settings.
+            key_paths (Iterable):
+                The key paths to write, or None to replace every row.
+
+        Return:
+            tuple:
+                The new generation and the file's os.stat_result.
+        """
+        try:
+            with self.__lock:
+                connection = self._connect(file_path)
+                connection.execute("BEGIN IMMEDIATE")
+                try:
+                    if key_paths is None:
+                        connection.execute("DELETE FROM settings")
+                        key_paths = [(key,) for key in settings]
+                    for key_path in key_paths:
+                        self._write_key_path(connection, settings, key_path)
+                    connection.execute(
+                        "UPDATE generation SET generation = generation + 1"
+                    )
+                    (generation,) = connection.execute(
+                        "SELECT generation FROM generation"
+                    ).fetchone()
+                    connection.execute("COMMIT")
+                except BaseException:
+                    connection.execute("ROLLBACK")
+                    raise
+            file_stat = os.stat(file_path)
+        except (sqlite3.Error, OSError, TypeError, ValueError) as err:
+            raise MacStorageException(
+                f"Unable to write the settings database {file_path} {err}"
+            )
+        return f"generation {generation}".encode("utf8"), file_stat
+
+    def _write_key_path(
+        self, connection: sqlite3.Connection, settings: dict, key_path: tuple
+    ) -> None:
+        """
+        Replace the rows at and under a key path with its current value.
+
+        Args:
+            connection (sqlite3.Connection):
+                The connection, in a transaction.
+            settings (dict):
+                All the settings.
+            key_path (tuple):
+                The key path to write.
+
+        Return:
+            None
+        """
+        value: Any = settings
+        for depth, key in enumerate(key_path):
+            if not isinstance(value, dict):
+                # Rows only go down through mappings, so the key path ends
+                # in a value such as a list, which is written whole.
+                key_path = key_path[:depth]
+                break
+            value = value.get(key, _MISSING)
+            if value is _MISSING:
+                break
+        path_json = json.dumps(list(key_path))
+        # Every row under the key path starts with its JSON, less the
+        # closing bracket, then a comma.
+        child_prefix = f"{path_json[:-1]},"
+        connection.execute(
+            "DELETE FROM settings WHERE key_path = ?"
+            " OR substr(key_path, 1, ?) = ?",
+            (path_json, len(child_prefix), child_prefix),
+        )
+        # A parent that was a single value now has settings under it.
+        for depth in range(1, len(key_path)):
+            connection.execute(
+                "DELETE FROM settings WHERE key_path = ?",
+                (json.dumps(list(key_path[:depth])),),
+            )
+        if value is _MISSING:
+            return
+        pending = [(list(key_path), value)]
+        rows = []
+        while pending:
+            row_path, row_value = pending.pop()
+            if isinstance(row_value, dict) and row_value:
+                for key, child in row_value.items():
+                    pending.append((row_path + [key], child))
+                continue
+            rows.append((json.dumps(row_path), json.dumps(row_value)))
+        connection.executemany(
+            "INSERT INTO settings (key_path, value) VALUES (?, ?)", rows
+        )
+
+
+_STORAGE_BACKENDS = {
+    "yaml": MacYamlStorage,
+    "yml": MacYamlStorage,
+    "json": MacJsonStorage,
+    "toml": MacTomlStorage,
+    "sqlite": MacSqliteStorage,
+    "db": MacSqliteStorage,
+    "sqlite3": MacSqliteStorage,
+}
+
+
+def get_settings_storage(
+    storage: Union[str, MacSettingsStorage, None] = None,
+) -> MacSettingsStorage:
+    """
+    Get a storage backend by format name or file extension.
+
+    Args:
+        storage (str or MacSettingsStorage):
+            "yaml", "json", "toml" or "sqlite", or a backend, which is
+            returned as it is. None is YAML.
+
+    Return:
+        MacSettingsStorage:
+            The storage backend.
+    """
+    if isinstance(storage, MacSettingsStorage):
+        return storage
+    if storage is None:
+        storage = "yaml"
+    try:
+        return _STORAGE_BACKENDS[storage.lower().lstrip(".")]()
+    except KeyError:
+        raise MacStorageException(
+            f"{storage} is not a settings storage backend, use one of "
+            "yaml, json, toml or sqlite."
+        )
+
+
+def storage_for_path(file_path: str) -> MacSettingsStorage:
+    """
+    Get the storage backend for a file from its extension, defaulting to
+    YAML.
+
+    Args:
+        file_path (str):
+            The settings file.
+
+    Return:
+        MacSettingsStorage:
+            The storage backend.
+    """
+    extension = os.path.splitext(file_path)[1].lower().lstrip(".")
+    if extension not in _STORAGE_BACKENDS:
+        extension = "yaml"
+    return get_settings_storage(extension)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    pass
@@ -0,0 +1,288 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Name:
+        test_file_watch.py
+    Desscription:
+        Test the file watchers.
+    Version:
+        1 - Inital release
+    Author:
+        J.MacGrillen <macgrillen@gmail.com>
+    Copyright:
+        Copyright (c) John MacGrillen. All rights reserved.
+"""
+import os
+import sys
+import time
+import pytest
+from types import SimpleNamespace
+from watchdog.events import FileSystemEventHandler
+import maclib.mac_file_watch as mac_file_watch
+from maclib.mac_file_watch import (
+    IN_CLOSE_WRITE,
+    IN_Q_OVERFLOW,
+    MacFileWatcher,
+    MacFileWatchException,
+    MacInotifyWatcher,
+    MacPollWatcher,
+    MacWatchdogWatcher,
+    get_file_watcher,
+)
+
+
+class RecordingHandler(FileSystemEventHandler):
+    """
+    Record the type of every event dispatched to the handler.
+    """
+
+    def __init__(self) -> None:
+        self.event_types = list()
+
+    def on_any_event(self, event) -> None:
+        self.event_types.append(event.event_type)
+
+
+class FailingHandler(FileSystemEventHandler):
+    """
+    Raise an error for every event dispatched to the handler.
+    """
+
+    def on_any_event(self, event) -> None:
+        raise ValueError("Handler failed")
+
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    """
+    Wait for a condition to become true.
+
+    Args:
+        condition (callable): The condition to check.
+        timeout (float): The number of seconds to wait.
+    """
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_01_unknown_watcher():
+    """
+    Test asking for a watcher that doesn't exist.
+    """
+    with pytest.raises(MacFileWatchException):
+        get_file_watcher("carrier pigeon")
+    assert get_file_watcher("poll") is get_file_watcher("poll")
+
+
+def test_02_poll_watcher_events(tmp_path):
+    """
+    Test polling reports modified, deleted and created files.
+    """
+    watched_file = tmp_path / "watched.yaml"
+    watched_file.write_text("a: 1")
+    handler = RecordingHandler()
+    file_watcher = MacPollWatcher(interval_ms=60000)
+    file_watcher.watch(path=str(watched_file), handler=handler)
+    file_watcher.check()
+    assert handler.event_types == []
+    watched_file.write_text("a: 22")
+    file_watcher.check()
+    watched_file.unlink()
+    file_watcher.check()
+    watched_file.write_text("a: 3")
+    file_watcher.check()
+    assert handler.event_types == ["modified", "deleted", "created"]
+    file_watcher.unwatch(path=str(watched_file), handler=handler)
+    watched_file.write_text("a: 4444")
+    file_watcher.check()
+    assert len(handler.event_types) == 3
+    file_watcher.stop()
+
+
+def test_03_poll_watcher_thread(tmp_path):
+    """
+    Test the polling thread picks up changes by itself.
+    """
+    watched_file = tmp_path / "watched.yaml"
+    watched_file.write_text("a: 1")
+    handler = RecordingHandler()
+    file_watcher = MacPollWatcher(interval_ms=10)
+    file_watcher.watch(path=str(watched_file), handler=handler)
+    watched_file.write_text("a: 22")
+    assert wait_for(lambda: "modified" in handler.event_types)
+    file_watcher.stop()
+
+
+@pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="inotify is Linux only"
+)
+def test_04_inotify_watcher_rename(tmp_path):
+    """
+    Test inotify sees an atomic rename save, and ignores other files in
+    the same directory.
+    """
+    watched_file = tmp_path / "watched.yaml"
+    watched_file.write_text("a: 1")
+    other_file = tmp_path / "other.yaml"
+    handler = RecordingHandler()
+    file_watcher = MacInotifyWatcher()
+    file_watcher.watch(path=str(watched_file), handler=handler)
+    other_file.write_text("b: 1")
+    temporary_file = tmp_path / "watched.yaml.tmp"
+    temporary_file.write_text("a: 2")
+    os.replace(temporary_file, watched_file)
+    assert wait_for(lambda: "modified" in handler.event_types)
+    watched_file.unlink()
+    assert wait_for(lambda: "deleted" in handler.event_types)
+    file_watcher.unwatch(path=str(watched_file), handler=handler)
+    file_watcher.stop()
+
+
+def test_05_watchdog_watcher(tmp_path):
+    """
+    Test the watchdog watcher schedules and unschedules the file.
+    """
+    watched_file = tmp_path / "watched.yaml"
+    watched_file.write_text("a: 1")
+    handler = RecordingHandler()
+    file_watcher = MacWatchdogWatcher()
+    file_watcher.watch(path=str(watched_file), handler=handler)
+    watched_file.write_text("a: 2")
+    assert wait_for(lambda: "modified" in handler.event_types)
+    file_watcher.unwatch(path=str(watched_file), handler=handler)
+    file_watcher.unwatch(path=str(watched_file), handler=handler)
+
+
+def test_06_watcher_interface():
+    """
+    Test a watcher can't be created until it implements the interface.
+    """
+
+    class WatchOnly(MacFileWatcher):
+        def watch(self, path, handler) -> None:
+            pass
+
+    class Complete(WatchOnly):
+        def unwatch(self, path, handler) -> None:
+            pass
+
+    with pytest.raises(TypeError):
+        MacFileWatcher()
+    with pytest.raises(TypeError):
+        WatchOnly()
+    Complete().stop()
+
+
+def test_07_watchdog_already_unscheduled(monkeypatch):
+    """
+    Test unwatching a file the observer has already forgotten.
+    """
+
+    def unschedule(observed_watch) -> None:
+        raise KeyError(observed_watch)
+
+    fake_observer = SimpleNamespace(
+        schedule=lambda **schedule_args: "watch", unschedule=unschedule
+    )
+    monkeypatch.setattr(
+        mac_file_watch, "get_shared_observer", lambda: fake_observer
+    )
+    handler = RecordingHandler()
+    file_watcher = MacWatchdogWatcher()
+    file_watcher.watch(path="a.yaml", handler=handler)
+    file_watcher.unwatch(path="a.yaml", handler=handler)
+
+
+def test_08_poll_watcher_errors(tmp_path, caplog):
+    """
+    Test a failing handler is logged, and a file unwatched while the
+    others are being checked isn't reported.
+    """
+    first_file = tmp_path / "first.yaml"
+    second_file = tmp_path / "second.yaml"
+    file_watcher = MacPollWatcher(interval_ms=60000)
+    second_handler = RecordingHandler()
+
+    class UnwatchingHandler(FileSystemEventHandler):
+        def on_any_event(self, event) -> None:
+            file_watcher.unwatch(path=str(second_file), handler=second_handler)
+            raise ValueError("Handler failed")
+
+    file_watcher.watch(path=str(first_file), handler=UnwatchingHandler())
+    file_watcher.watch(path=str(second_file), handler=second_handler)
+    first_file.write_text("a: 1")
+    second_file.write_text("a: 1")
+    file_watcher.check()
+    assert second_handler.event_types == []
+    assert "Handler failed" in caplog.text
+    file_watcher.stop()
+
+
+@pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="inotify is Linux only"
+)
+def test_09_inotify_watcher_errors(tmp_path, monkeypatch, caplog):
+    """
+    Test inotify failures are raised, and failing handlers, lost events
+    and events for directories no longer watched are handled.
+    """
+    file_watcher = MacInotifyWatcher()
+    with pytest.raises(MacFileWatchException, match="Unable to watch"):
+        file_watcher.watch(
+            path=str(tmp_path / "missing" / "a.yaml"),
+            handler=RecordingHandler(),
+        )
+    file_watcher.unwatch(path=str(tmp_path / "a.yaml"), handler=None)
+    watched_file = str(tmp_path / "watched.yaml")
+    handler = RecordingHandler()
+    file_watcher.watch(path=watched_file, handler=handler)
+    file_watcher.watch(path=watched_file, handler=FailingHandler())
+    file_watcher._dispatch_buffer(
+        mac_file_watch._INOTIFY_EVENT.pack(-1, IN_Q_OVERFLOW, 0, 0)
+    )
+    assert handler.event_types == ["modified"]
+    assert "Handler failed" in caplog.text
+    file_name = b"watched.yaml".ljust(16, b"\0")
+    file_watcher._dispatch_buffer(
+        mac_file_watch._INOTIFY_EVENT.pack(
+            9999, IN_CLOSE_WRITE, 0, len(file_name)
+        )
+        + file_name
+    )
+    assert handler.event_types == ["modified"]
+    (tmp_path / "watched.yaml").write_text("a: 1")
+    assert wait_for(lambda: "created" in handler.event_types)
+    file_watcher.stop()
+    failing_libc = SimpleNamespace(inotify_init1=lambda flags: -1)
+    monkeypatch.setattr(
+        file_watcher, "_MacInotifyWatcher__libc", failing_libc
+    )
+    with pytest.raises(MacFileWatchException, match="Unable to start"):
+        file_watcher.watch(path=watched_file, handler=handler)
+
+
+@pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="inotify is Linux only"
+)
+def test_10_inotify_nothing_to_read(monkeypatch):
+    """
+    Test the reader thread waits again when there's nothing to read.
+    """
+    inotify_fd, write_fd = os.pipe()
+    os.set_blocking(inotify_fd, False)
+    ready = [[inotify_fd], [-1]]
+    monkeypatch.setattr(
+        mac_file_watch,
+        "select",
+        SimpleNamespace(select=lambda *fds: (ready.pop(0), [], [])),
+    )
+    file_watcher = MacInotifyWatcher()
+    file_watcher._read_loop(inotify_fd, -1)
+    assert ready == []
+    os.close(inotify_fd)
+    os.close(write_fd)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    pass
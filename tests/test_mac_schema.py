@@ -0,0 +1,230 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Name:
+        test_mac_schema.py
+    Desscription:
+        Test compiling settings schemas into typed settings.
+    Version:
+        1 - Inital release
+    Author:
+        J.MacGrillen <macgrillen@gmail.com>
+    Copyright:
+        Copyright (c) John MacGrillen. All rights reserved.
+"""
+import dataclasses
+import pathlib
+import pytest
+from enum import Enum
+from typing import Any, Callable, Optional, Union
+from maclib.mac_schema import (
+    MacSchema,
+    MacSchemaException,
+    compile_schema,
+)
+
+
+class Colour(Enum):
+    red = "red"
+    blue = "blue"
+
+
+@dataclasses.dataclass(frozen=True)
+class Pool:
+    size: int
+    timeout: float = 2.5
+
+
+@dataclasses.dataclass(frozen=True)
+class AppSettings:
+    pool: Pool
+    debug: bool = False
+    name: Optional[str] = None
+    hosts: list[str] = dataclasses.field(default_factory=list)
+    colour: Colour = Colour.red
+    home: pathlib.Path = pathlib.Path("/")
+
+
+def test_01_dataclass_schema():
+    """
+    Test a dataclass schema coerces and validates the settings.
+    """
+    schema = compile_schema(AppSettings)
+    typed_settings = schema.build(
+        {
+            "pool": {"size": "8"},
+            "debug": "yes",
+            "hosts": ["alpha", 2],
+            "colour": "blue",
+            "home": "/tmp",
+            "unused": 1,
+        }
+    )
+    assert typed_settings.pool == Pool(size=8, timeout=2.5)
+    assert typed_settings.debug is True
+    assert typed_settings.name is None
+    assert typed_settings.hosts == ["alpha", "2"]
+    assert typed_settings.colour is Colour.blue
+    assert typed_settings.home == pathlib.Path("/tmp")
+
+
+def test_02_invalid_settings():
+    """
+    Test invalid settings are reported with their key path.
+    """
+    schema = compile_schema(AppSettings)
+    with pytest.raises(MacSchemaException, match="pool.size"):
+        schema.build({"pool": {"size": "lots"}})
+    with pytest.raises(MacSchemaException, match="pool is missing"):
+        schema.build({})
+    with pytest.raises(MacSchemaException, match="hosts"):
+        schema.build({"pool": {"size": 1}, "hosts": "alpha"})
+    with pytest.raises(MacSchemaException):
+        compile_schema(int)
+
+
+def test_03_dict_spec():
+    """
+    Test a dict spec is compiled into frozen dataclasses.
+    """
+    schema = compile_schema(
+        {"pool": {"size": int, "timeout": (float, 2.5)}, "tags": (list, [])}
+    )
+    typed_settings = schema.build({"pool": {"size": 4}})
+    assert typed_settings.pool.size == 4
+    assert typed_settings.pool.timeout == 2.5
+    assert typed_settings.tags == []
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        typed_settings.pool.size = 5
+
+
+def test_04_sections_reused():
+    """
+    Test sections built from the same mapping as last time are reused.
+    """
+    schema = compile_schema(AppSettings)
+    pool = {"size": 1}
+    first = schema.build({"pool": pool, "debug": False})
+    second = schema.build({"pool": pool, "debug": True})
+    assert second.pool is first.pool
+    third = schema.build({"pool": {"size": 1}, "debug": True})
+    assert third.pool is not first.pool
+
+
+@dataclasses.dataclass(frozen=True)
+class Limits:
+    rate: float
+    ratio: float
+    enabled: bool
+    verbose: bool
+    label: str
+    count: int
+    extra: Any
+    ports: dict[str, int]
+    retries: tuple[int, ...] = ()
+    colour: Optional[Colour] = None
+    computed: int = dataclasses.field(default=0, init=False)
+
+
+def test_05_scalar_coercion():
+    """
+    Test floats, bools, strs and ints are coerced from other types.
+    """
+    schema = compile_schema(Limits)
+    typed_settings = schema.build(
+        {
+            "rate": 2,
+            "ratio": " 0.5 ",
+            "enabled": 1,
+            "verbose": "Off",
+            "label": 3.5,
+            "count": 4.0,
+            "extra": {"any": "thing"},
+            "ports": {"http": "80"},
+            "retries": [1, "2"],
+            "colour": "blue",
+        }
+    )
+    assert typed_settings.rate == 2.0
+    assert isinstance(typed_settings.rate, float)
+    assert typed_settings.ratio == 0.5
+    assert typed_settings.enabled is True
+    assert typed_settings.verbose is False
+    assert typed_settings.label == "3.5"
+    assert typed_settings.count == 4
+    assert typed_settings.extra == {"any": "thing"}
+    assert typed_settings.ports == {"http": 80}
+    assert typed_settings.retries == (1, 2)
+    assert typed_settings.colour is Colour.blue
+    assert typed_settings.computed == 0
+
+
+def test_06_coercion_errors():
+    """
+    Test settings that can't be coerced are reported with their key path.
+    """
+    schema = compile_schema(Limits)
+    valid = {
+        "rate": 1.0,
+        "ratio": 1.0,
+        "enabled": True,
+        "verbose": False,
+        "label": "a",
+        "count": 1,
+        "extra": None,
+        "ports": {},
+    }
+    assert schema.build(valid).colour is None
+    for key, value, message in (
+        ("rate", "fast", "rate should be a float"),
+        ("ratio", True, "ratio should be a float"),
+        ("enabled", "maybe", "enabled should be a bool"),
+        ("verbose", 2, "verbose should be a bool"),
+        ("label", ["a"], "label should be a str"),
+        ("count", 1.5, "count should be an int"),
+        ("ports", ["http"], "ports should be a mapping"),
+        ("ports", {"http": "web"}, "ports.http should be an int"),
+        ("retries", [1, "x"], "retries.1 should be an int"),
+        ("colour", "green", "colour should be one of"),
+    ):
+        with pytest.raises(MacSchemaException, match=message):
+            schema.build(dict(valid, **{key: value}))
+    with pytest.raises(MacSchemaException, match="the settings"):
+        schema.build(["not", "a", "mapping"])
+
+
+def test_07_enums_and_other_types():
+    """
+    Test enums are looked up by value or name, and other types are
+    constructed from the setting unless it already is one.
+    """
+    schema = compile_schema(AppSettings)
+    home = pathlib.Path("/home")
+    typed_settings = schema.build(
+        {"pool": {"size": 1}, "colour": "red", "home": home}
+    )
+    assert typed_settings.colour is Colour.red
+    assert typed_settings.home is home
+    typed_settings = schema.build({"pool": {"size": 1}, "colour": "blue"})
+    assert typed_settings.colour is Colour.blue
+    with pytest.raises(MacSchemaException, match="home should be a Path"):
+        schema.build({"pool": {"size": 1}, "home": 7})
+
+
+def test_08_invalid_schemas():
+    """
+    Test schemas that can't be compiled are refused.
+    """
+    with pytest.raises(MacSchemaException, match="setting name"):
+        compile_schema({"two words": int})
+    with pytest.raises(MacSchemaException, match="Optional unions"):
+        compile_schema({"value": Union[int, str]})
+    with pytest.raises(MacSchemaException, match="isn't supported"):
+        compile_schema({"value": Callable[[], int]})
+    schema = compile_schema({"value": (int, 1)})
+    assert isinstance(schema, MacSchema)
+    assert compile_schema(schema) is schema
+
+
+if __name__ == "__main__":  # pragma: no cover
+    pass
@@ -0,0 +1,1525 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Name:
+        test_mac_settings.py
+    Desscription:
+        Test the settings features using real settings files in a
+        temporary home directory.
+    Version:
+        1 - Inital release
+    Author:
+        J.MacGrillen <macgrillen@gmail.com>
+    Copyright:
+        Copyright (c) John MacGrillen. All rights reserved.
+"""
+import asyncio
+import atexit
+import collections
+import copy
+import datetime
+import os
+import pytest
+import threading
+import time
+import weakref
+import yaml
+import watchdog.observers
+import maclib.mac_file_watch as mac_file_watch
+from types import SimpleNamespace
+from maclib.mac_events import MacEvent, MacEventException
+from maclib.mac_file_watch import MacPollWatcher, get_shared_observer
+from maclib.mac_settings_stats import MacSettingsStats
+from maclib.mac_settings import (
+    MacSettings,
+    MacSettingsDispatcher,
+    MacSettingsEvents,
+    MacSettingsException,
+    MacSettingsPathRouter,
+    MacSettingsStore,
+    MacSettingsWatchdogEvents,
+    MacSettingsWatchdogHandler,
+    MacSettingsWriteLock,
+    YAML_BACKEND,
+    _close_at_exit,
+    apply_changed_paths,
+    dict_diff,
+    dict_diff_paths,
+    environment_settings,
+    flatten_settings,
+    merge_settings,
+    patch_path_index,
+)
+
+
+app_name = "test_app"
+settings_dict = {
+    "fake_load": "True Dat",
+    "something": {"else": "here", "deeper": {"level": 3}},
+    "servers": [{"host": "alpha"}, {"host": "beta"}],
+}
+
+
+def create_settings(tmp_path, monkeypatch, **settings_args) -> MacSettings:
+    """
+    Create a settings object backed by real files under a temporary
+    home directory.
+
+    Args:
+        tmp_path (pathlib.Path): The temporary directory for the test.
+        monkeypatch (_type_): _description_
+        settings_args (dict): Any extra MacSettings arguments.
+    """
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setattr(
+        watchdog.observers.Observer, "start", lambda observer: None
+    )
+    default_file = tmp_path / "defaults.yaml"
+    default_file.write_text(yaml.safe_dump(settings_dict))
+    MacSettings.clear()
+    settings = MacSettings(
+        app_name=app_name,
+        default_settings_path=str(default_file),
+        **settings_args,
+    )
+    settings.load_settings()
+    return settings
+
+
+@pytest.fixture
+def test_settings(tmp_path, monkeypatch):
+    """
+    A loaded settings object using the default arguments.
+
+    Args:
+        tmp_path (pathlib.Path): The temporary directory for the test.
+        monkeypatch (_type_): _description_
+    """
+    yield create_settings(tmp_path, monkeypatch)
+    MacSettings.clear()
+
+
+def test_01_flatten_settings():
+    """
+    Test every mapping and leaf is given a key path.
+    """
+    path_index = flatten_settings(settings_dict)
+    assert path_index[("fake_load",)] == "True Dat"
+    assert path_index[("something",)] is settings_dict["something"]
+    assert path_index[("something", "deeper", "level")] == 3
+    assert ("servers", 0) not in path_index
+    assert flatten_settings("not a dict") == {}
+
+
+def test_02_index_lookups(test_settings):
+    """
+    Test tuple, string and dotted string lookups.
+    """
+    assert test_settings["fake_load"] == "True Dat"
+    assert test_settings["something", "deeper", "level"] == 3
+    assert test_settings["something.deeper.level"] == 3
+    # List indexes fall back to walking the tree.
+    assert test_settings["servers", 1, "host"] == "beta"
+    with pytest.raises(MacSettingsException):
+        test_settings["missing.key"]
+    with pytest.raises(KeyError):
+        test_settings["something", "missing"]
+
+
+def test_03_index_contains(test_settings):
+    """
+    Test membership checks use the index and the fallback.
+    """
+    assert "fake_load" in test_settings
+    assert ("something", "deeper") in test_settings
+    assert "something.else" in test_settings
+    assert ("servers", 0, "host") in test_settings
+    assert ("something", "missing") not in test_settings
+    assert ("missing", "key") not in test_settings
+    assert () not in test_settings
+    with pytest.raises(MacSettingsException):
+        1 in test_settings
+
+
+def test_04_index_follows_set_item(test_settings):
+    """
+    Test the index is kept in step when a subtree is replaced.
+    """
+    test_settings["something"] = {"new": {"leaf": 1}}
+    assert test_settings["something", "new", "leaf"] == 1
+    assert ("something", "deeper", "level") not in test_settings
+    test_settings["something", "new", "leaf"] = 2
+    assert test_settings["something.new.leaf"] == 2
+    test_settings["servers", 0, "host"] = "gamma"
+    assert test_settings["servers", 0, "host"] == "gamma"
+    assert test_settings["servers"][0]["host"] == "gamma"
+
+
+def test_05_transaction_single_write(test_settings, monkeypatch):
+    """
+    Test a transaction writes the file and posts an event only once.
+    """
+    saves = []
+    events = []
+    save_settings = test_settings.save_settings
+    monkeypatch.setattr(
+        test_settings, "save_settings", lambda: saves.append(save_settings())
+    )
+    test_settings.register_for_events(
+        MacSettingsEvents.settings_changed, events.append
+    )
+    with test_settings.transaction():
+        test_settings["fake_load"] = "changed"
+        with test_settings.transaction():
+            test_settings["something", "else"] = "there"
+        assert len(saves) == 0
+        assert test_settings["something", "else"] == "there"
+    assert len(saves) == 1
+    assert len(events) == 1
+    assert events[0].event_info == {
+        "added": {},
+        "removed": {},
+        "changed": {
+            ("fake_load",): ("True Dat", "changed"),
+            ("something", "else"): ("here", "there"),
+        },
+        "settings_changed": {
+            ("fake_load",): "changed",
+            ("something", "else"): "there",
+        },
+    }
+    with open(test_settings.settings_file_path) as settings_file:
+        saved = yaml.safe_load(settings_file)
+    assert saved["something"]["else"] == "there"
+
+
+def test_06_transaction_rollback(test_settings):
+    """
+    Test a failed transaction undoes its changes and writes nothing.
+    """
+    with pytest.raises(ValueError):
+        with test_settings.transaction():
+            test_settings["fake_load"] = "changed"
+            test_settings["something", "added"] = {"new": 1}
+            raise ValueError("Abandon the changes")
+    assert test_settings["fake_load"] == "True Dat"
+    assert ("something", "added") not in test_settings
+    assert ("something", "added", "new") not in test_settings
+    assert test_settings.get_all_settings() == settings_dict
+
+
+def test_07_update(test_settings):
+    """
+    Test update applies all the settings.
+    """
+    test_settings.update(
+        {"fake_load": "updated", ("something", "deeper", "level"): 4}
+    )
+    assert test_settings["fake_load"] == "updated"
+    assert test_settings["something.deeper.level"] == 4
+
+
+def test_08_write_behind(tmp_path, monkeypatch):
+    """
+    Test write-behind coalesces many changes into few writes, and the
+    store is closed at exit however often its writer is started.
+    """
+    exit_handlers = []
+    monkeypatch.setattr(
+        atexit, "register", lambda *args: exit_handlers.append(args)
+    )
+    settings = create_settings(tmp_path, monkeypatch, write_behind_ms=60000)
+    saves = []
+    save_settings = settings.save_settings
+    monkeypatch.setattr(
+        settings, "save_settings", lambda: saves.append(save_settings())
+    )
+    for count in range(10):
+        settings["something", "deeper", "level"] = count
+    # The first change is written straight away, the rest wait out the
+    # write-behind interval.
+    deadline = time.monotonic() + 5
+    while not saves and time.monotonic() < deadline:
+        time.sleep(0.01)
+    settings.flush()
+    stats = settings.write_behind_stats()
+    assert stats["writes_requested"] == 10
+    assert stats["writes_flushed"] == len(saves) <= 2
+    assert stats["writes_coalesced"] >= 8
+    with open(settings.settings_file_path) as settings_file:
+        assert yaml.safe_load(settings_file)["something"]["deeper"] == {
+            "level": 9
+        }
+    settings["fake_load"] = "closing"
+    settings.close()
+    with open(settings.settings_file_path) as settings_file:
+        assert yaml.safe_load(settings_file)["fake_load"] == "closing"
+    settings["fake_load"] = "reopened"
+    settings.close()
+    assert len(exit_handlers) == 1
+    MacSettings.clear()
+
+
+def test_09_snapshots_are_not_changed(test_settings):
+    """
+    Test a change swaps in a new snapshot, sharing the untouched parts of
+    the old one.
+    """
+    before = test_settings.get_all_settings()
+    test_settings["something", "deeper", "level"] = 4
+    after = test_settings.get_all_settings()
+    assert before["something"]["deeper"]["level"] == 3
+    assert after["something"]["deeper"]["level"] == 4
+    assert after["servers"] is before["servers"]
+    assert test_settings["something"] is after["something"]
+
+
+def test_10_reload_without_deepcopy(test_settings, monkeypatch):
+    """
+    Test reloading diffs against the previous snapshot without copying it.
+    """
+    events = []
+
+    def no_deepcopy(*args, **kwargs):
+        raise AssertionError("deepcopy should not be used")
+
+    monkeypatch.setattr(copy, "deepcopy", no_deepcopy)
+    test_settings.register_for_events(
+        MacSettingsEvents.settings_changed, events.append
+    )
+    changed_dict = dict(settings_dict, fake_load="True Dat Again")
+    with open(test_settings.settings_file_path, "w") as settings_file:
+        yaml.safe_dump(changed_dict, settings_file)
+    test_settings.reload_settings_from_file()
+    assert test_settings.get_all_settings() == changed_dict
+    assert events[0].event_info["changed"] == {
+        ("fake_load",): ("True Dat", "True Dat Again")
+    }
+
+
+def test_11_dict_diff_paths():
+    """
+    Test the recursive diff reports only the leaf paths that differ.
+    """
+    dict_a = {
+        "same": {"x": 1},
+        "section": {"leaf": 1, "gone": 2, "deep": {"value": [1, 2]}},
+        "replaced": {"was": "a mapping"},
+    }
+    dict_b = {
+        "same": dict_a["same"],
+        "section": {"leaf": 1, "new": 3, "deep": {"value": [1, 3]}},
+        "replaced": "a value",
+    }
+    results = dict_diff_paths(dict_a, dict_b)
+    assert results == {
+        "added": {("section", "new"): 3},
+        "removed": {("section", "gone"): 2},
+        "changed": {
+            ("section", "deep", "value"): ([1, 2], [1, 3]),
+            ("replaced",): ({"was": "a mapping"}, "a value"),
+        },
+    }
+    assert dict_diff_paths(dict_a, dict_a) == {
+        "added": {},
+        "removed": {},
+        "changed": {},
+    }
+    assert dict_diff_paths(1, 2, prefix=("a",))["changed"] == {
+        ("a",): (1, 2)
+    }
+
+
+def test_12_set_item_event_paths(test_settings):
+    """
+    Test a single change reports the key paths under it that changed.
+    """
+    events = []
+    test_settings.register_for_events(
+        MacSettingsEvents.settings_changed, events.append
+    )
+    test_settings["something"] = {"else": "here", "deeper": {"level": 4}}
+    test_settings["brand"] = {"new": 1}
+    assert events[0].event_info["changed"] == {
+        ("something", "deeper", "level"): (3, 4)
+    }
+    assert events[0].event_info["setting_changed"] == "something"
+    assert events[1].event_info["added"] == {("brand",): {"new": 1}}
+
+
+def test_13_yaml_backend(test_settings):
+    """
+    Test the C loader is used whenever PyYAML has libyaml.
+    """
+    expected = "libyaml" if yaml.__with_libyaml__ else "python"
+    assert YAML_BACKEND == expected
+    assert test_settings.yaml_backend == expected
+    test_settings["unicode"] = "caf\u00e9"
+    test_settings.load_settings()
+    assert test_settings["unicode"] == "caf\u00e9"
+
+
+def test_14_compiled_cache(tmp_path, monkeypatch):
+    """
+    Test the compiled cache is used until the YAML changes.
+    """
+    settings = create_settings(tmp_path, monkeypatch, use_cache=True)
+    assert os.path.exists(settings.settings_cache_path)
+    MacSettings.clear()
+
+    def no_parsing(*args, **kwargs):
+        raise AssertionError("The YAML should not be parsed")
+
+    settings = create_settings(tmp_path, monkeypatch, use_cache=True)
+    monkeypatch.setattr(yaml, "load", no_parsing)
+    settings.load_settings()
+    assert settings.get_all_settings() == settings_dict
+    # Saving refreshes the cache, so it's still used afterwards.
+    settings["fake_load"] = "cached"
+    settings.load_settings()
+    assert settings["fake_load"] == "cached"
+    monkeypatch.undo()
+    changed_dict = dict(settings_dict, fake_load="edited")
+    with open(settings.settings_file_path, "w") as settings_file:
+        yaml.safe_dump(changed_dict, settings_file)
+    settings = create_settings(tmp_path, monkeypatch, use_cache=True)
+    assert settings["fake_load"] == "edited"
+    MacSettings.clear()
+
+
+def test_15_compiled_cache_unsupported(tmp_path, monkeypatch):
+    """
+    Test settings marshal can't store are loaded but not cached, and a
+    corrupt cache is ignored.
+    """
+    settings = create_settings(tmp_path, monkeypatch, use_cache=True)
+    with open(settings.settings_cache_path, "wb") as cache_file:
+        cache_file.write(b"corrupt")
+    settings.load_settings()
+    assert settings.get_all_settings() == settings_dict
+    settings["when"] = datetime.date(2020, 1, 2)
+    os.remove(settings.settings_cache_path)
+    settings.load_settings()
+    assert settings["when"] == datetime.date(2020, 1, 2)
+    assert not os.path.exists(settings.settings_cache_path)
+    MacSettings.clear()
+
+
+def test_16_watchdog_debounce():
+    """
+    Test a burst of file events posts a single reload event.
+    """
+    events = []
+    test_handler = MacSettingsWatchdogHandler(debounce_ms=50)
+    test_handler.events_publisher.register(
+        event_action=MacSettingsWatchdogEvents.reload_settings_file,
+        subscriber_callback=events.append,
+    )
+    for src_path in ("a.yaml", "a.yaml", "b.yaml"):
+        test_handler.on_modified(SimpleNamespace(src_path=src_path))
+    assert events == []
+    deadline = time.monotonic() + 5
+    while not events and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.1)
+    assert len(events) == 1
+    assert events[0].event_info == {"paths": ["a.yaml", "b.yaml"]}
+    test_handler.on_modified(SimpleNamespace(src_path="c.yaml"))
+    test_handler.cancel()
+    time.sleep(0.1)
+    assert len(events) == 1
+
+
+def test_17_reload_skipped_when_unchanged(test_settings, monkeypatch):
+    """
+    Test reloading our own save, or an untouched file, parses nothing.
+    """
+    events = []
+
+    def no_parsing(*args, **kwargs):
+        raise AssertionError("The YAML should not be parsed")
+
+    test_settings["fake_load"] = "saved"
+    test_settings.register_for_events(
+        MacSettingsEvents.settings_loaded, events.append
+    )
+    monkeypatch.setattr(yaml, "load", no_parsing)
+    test_settings.reload_settings_from_file()
+    os.utime(test_settings.settings_file_path)
+    test_settings.reload_settings_from_file()
+    assert events == []
+    assert test_settings["fake_load"] == "saved"
+
+
+def test_18_no_observer_without_watch(tmp_path, monkeypatch):
+    """
+    Test the observer isn't created when watching is turned off.
+    """
+    monkeypatch.setattr(mac_file_watch, "_shared_observer", None)
+    settings = create_settings(tmp_path, monkeypatch, watch=False)
+    assert mac_file_watch._shared_observer is None
+    settings.close()
+    MacSettings.clear()
+
+
+def test_19_shared_observer(tmp_path, monkeypatch):
+    """
+    Test every watched settings file shares the one observer, and that
+    external changes are picked up.
+    """
+    monkeypatch.setenv("HOME", str(tmp_path))
+    default_file = tmp_path / "defaults.yaml"
+    default_file.write_text(yaml.safe_dump(settings_dict))
+    all_settings = []
+    for name in ("first_app", "second_app"):
+        MacSettings.clear()
+        all_settings.append(
+            MacSettings(
+                app_name=name,
+                default_settings_path=str(default_file),
+                reload_debounce_ms=10,
+            )
+        )
+        all_settings[-1].load_settings()
+    settings_file_observer = get_shared_observer()
+    watched_paths = [
+        emitter.watch.path for emitter in settings_file_observer.emitters
+    ]
+    for settings in all_settings:
+        assert settings.settings_file_path in watched_paths
+    changed_dict = dict(settings_dict, fake_load="changed elsewhere")
+    with open(all_settings[0].settings_file_path, "w") as settings_file:
+        yaml.safe_dump(changed_dict, settings_file)
+    deadline = time.monotonic() + 5
+    while (
+        all_settings[0]["fake_load"] != "changed elsewhere"
+        and time.monotonic() < deadline
+    ):
+        time.sleep(0.01)
+    assert all_settings[0]["fake_load"] == "changed elsewhere"
+    assert all_settings[1]["fake_load"] == "True Dat"
+    for settings in all_settings:
+        settings.close()
+    watched_paths = [
+        emitter.watch.path for emitter in settings_file_observer.emitters
+    ]
+    assert all_settings[0].settings_file_path not in watched_paths
+    MacSettings.clear()
+
+
+def test_20_poll_watcher(tmp_path, monkeypatch):
+    """
+    Test the settings can be watched by a polling watcher.
+    """
+    file_watcher = MacPollWatcher(interval_ms=10)
+    settings = create_settings(
+        tmp_path, monkeypatch, watch=file_watcher, reload_debounce_ms=0
+    )
+    changed_dict = dict(settings_dict, fake_load="polled")
+    with open(settings.settings_file_path, "w") as settings_file:
+        yaml.safe_dump(changed_dict, settings_file)
+    deadline = time.monotonic() + 5
+    while settings["fake_load"] != "polled" and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert settings["fake_load"] == "polled"
+    settings.close()
+    file_watcher.stop()
+    MacSettings.clear()
+
+
+def test_21_merge_settings():
+    """
+    Test layers are deep merged, sharing whatever doesn't need merging,
+    and that a previous merge is reused for unchanged subtrees.
+    """
+    base = {"a": {"x": 1, "y": 2}, "b": [1, 2], "c": {"z": 3}}
+    overlay = {"a": {"y": 20}, "b": [3], "d": 4}
+    merged = merge_settings(base, overlay)
+    assert merged == {"a": {"x": 1, "y": 20}, "b": [3], "c": {"z": 3}, "d": 4}
+    assert merged["c"] is base["c"]
+    assert merge_settings(base, {}) is base
+    assert merge_settings({}, overlay) is overlay
+    new_overlay = dict(overlay, d=5)
+    remerged = merge_settings(base, new_overlay, (base, overlay, merged))
+    assert remerged["d"] == 5
+    assert remerged["a"] is merged["a"]
+    assert merge_settings(base, overlay, (base, overlay, merged)) is merged
+
+
+def test_22_merge_defaults(tmp_path, monkeypatch):
+    """
+    Test new default settings show through without being saved to the
+    user's file.
+    """
+    settings = create_settings(tmp_path, monkeypatch, merge_defaults=True)
+    default_file = tmp_path / "defaults.yaml"
+    default_file.write_text(
+        yaml.safe_dump(dict(settings_dict, brand_new={"default": 1}))
+    )
+    settings.load_settings()
+    assert settings["brand_new", "default"] == 1
+    assert ("brand_new", "default") in settings
+    settings["something", "deeper", "level"] = 4
+    settings["brand_new", "default"] = 2
+    assert settings["brand_new", "default"] == 2
+    assert settings.get_layer_settings("defaults")["brand_new"] == {
+        "default": 1
+    }
+    with open(settings.settings_file_path) as settings_file:
+        saved = yaml.safe_load(settings_file)
+    assert saved["something"]["deeper"]["level"] == 4
+    assert saved["brand_new"] == {"default": 2}
+    with pytest.raises(MacSettingsException):
+        settings.get_layer_settings("nonsense")
+    MacSettings.clear()
+
+
+def test_23_environment_layer(tmp_path, monkeypatch):
+    """
+    Test environment variables override the settings file.
+    """
+    monkeypatch.setenv("TEST_APP_SOMETHING__DEEPER__LEVEL", "7")
+    monkeypatch.setenv("TEST_APP_EXTRA", "[1, 2]")
+    assert environment_settings(
+        "TEST_APP_", {"TEST_APP_A__B": "x", "TEST_APP_A__B__C": "y"}
+    ) == {"a": {"b": "x"}}
+    settings = create_settings(tmp_path, monkeypatch, env_prefix="TEST_APP_")
+    assert settings["something", "deeper", "level"] == 7
+    assert settings["something", "else"] == "here"
+    assert settings["extra"] == [1, 2]
+    settings["something", "deeper", "level"] = 4
+    assert settings["something", "deeper", "level"] == 7
+    with open(settings.settings_file_path) as settings_file:
+        saved = yaml.safe_load(settings_file)
+    assert saved["something"]["deeper"]["level"] == 4
+    assert "extra" not in saved
+    MacSettings.clear()
+
+
+def test_24_runtime_overrides(test_settings):
+    """
+    Test runtime overrides take precedence, post change events, and can
+    be cleared.
+    """
+    events = []
+    test_settings.register_for_events(
+        MacSettingsEvents.settings_changed, events.append
+    )
+    test_settings.set_override(("something", "deeper", "level"), 10)
+    assert test_settings["something", "deeper", "level"] == 10
+    assert events[-1].event_info["changed"] == {
+        ("something", "deeper", "level"): (3, 10)
+    }
+    test_settings["something", "deeper", "level"] = 4
+    assert test_settings["something", "deeper", "level"] == 10
+    test_settings.clear_override(("something", "deeper", "level"))
+    assert test_settings["something", "deeper", "level"] == 4
+    test_settings.set_override("fake_load", "overridden")
+    test_settings.clear_override()
+    assert test_settings["fake_load"] == "True Dat"
+    assert test_settings.get_layer_settings("overrides") == {}
+
+
+def test_25_typed_settings(test_settings):
+    """
+    Test a registered schema builds typed settings on every change and
+    invalid settings are rejected before they are swapped in.
+    """
+    schema = {"something": {"deeper": {"level": int}}, "fake_load": str}
+    assert test_settings.typed is None
+    typed_settings = test_settings.register_schema(schema)
+    assert typed_settings.something.deeper.level == 3
+    test_settings["something", "deeper", "level"] = "4"
+    assert test_settings.typed.something.deeper.level == 4
+    assert test_settings.typed.fake_load is typed_settings.fake_load
+    with pytest.raises(MacSettingsException):
+        test_settings["something", "deeper", "level"] = "four"
+    assert test_settings["something", "deeper", "level"] == "4"
+    changed_dict = dict(settings_dict, something={"deeper": {"level": []}})
+    with open(test_settings.settings_file_path, "w") as settings_file:
+        yaml.safe_dump(changed_dict, settings_file)
+    with pytest.raises(MacSettingsException):
+        test_settings.reload_settings_from_file()
+    assert test_settings.typed.something.deeper.level == 4
+
+
+def test_26_path_subscriptions(test_settings):
+    """
+    Test callbacks subscribed to a key path only see the changes that
+    touch it, including changes above and below it.
+    """
+    events: dict = {"something": [], "level": [], "everything": []}
+    test_settings.subscribe(("something",), events["something"].append)
+    test_settings.subscribe("something.deeper.level", events["level"].append)
+    test_settings.subscribe((), events["everything"].append)
+    test_settings["fake_load"] = "Not Dat"
+    assert not events["something"] and not events["level"]
+    assert events["everything"][-1].event_info["key_path"] == ()
+    test_settings["something", "else"] = "there"
+    assert events["something"][-1].event_info["changed"] == {
+        ("something", "else"): ("here", "there")
+    }
+    assert events["something"][-1].event_info["key_path"] == ("something",)
+    assert not events["level"]
+    test_settings["something"] = {"else": "there"}
+    assert events["level"][-1].event_info["removed"] == {
+        ("something", "deeper"): {"level": 3}
+    }
+    assert len(events["something"]) == 2
+    test_settings.unsubscribe(("something",), events["something"].append)
+    test_settings["something", "else"] = "here"
+    assert len(events["something"]) == 2
+    assert len(events["everything"]) == 4
+
+
+def test_27_asyncio_api(test_settings):
+    """
+    Test the asyncio API delivers changes made on other threads onto the
+    waiting event loop.
+    """
+
+    async def use_settings():
+        await test_settings.aload()
+        waiter = asyncio.ensure_future(
+            test_settings.wait_for_change("something.else")
+        )
+        await asyncio.sleep(0)
+        await asyncio.to_thread(test_settings.__setitem__, "fake_load", "no")
+        await asyncio.to_thread(
+            test_settings.__setitem__, ("something", "else"), "there"
+        )
+        change_event = await asyncio.wait_for(waiter, timeout=5)
+        assert change_event.event_info["changed"] == {
+            ("something", "else"): ("here", "there")
+        }
+        watcher = test_settings.watch_changes(("something",))
+        next_change = asyncio.ensure_future(watcher.__anext__())
+        await asyncio.sleep(0)
+        await asyncio.to_thread(
+            test_settings.__setitem__, ("something", "deeper", "level"), 4
+        )
+        change_event = await asyncio.wait_for(next_change, timeout=5)
+        assert change_event.event_info["key_path"] == ("something",)
+        await watcher.aclose()
+        await test_settings.asave()
+
+    asyncio.run(use_settings())
+    with open(test_settings.settings_file_path) as settings_file:
+        saved_settings = yaml.safe_load(settings_file)
+    assert saved_settings["something"]["deeper"]["level"] == 4
+
+
+def test_28_lazy_load(tmp_path, monkeypatch):
+    """
+    Test lazily loaded sections are only parsed when they are first used,
+    and parsing them isn't reported as a change.
+    """
+    test_settings = create_settings(tmp_path, monkeypatch, lazy_load=True)
+    parsed = []
+    yaml_load = yaml.load
+
+    def counting_load(stream, Loader):
+        parsed.append(stream)
+        return yaml_load(stream, Loader=Loader)
+
+    monkeypatch.setattr(yaml, "load", counting_load)
+    test_settings.load_settings()
+    assert parsed == [b""]
+    assert "servers" in test_settings
+    assert test_settings["something", "deeper", "level"] == 3
+    assert test_settings["something.else"] == "here"
+    assert len(parsed) == 2
+    events = []
+    test_settings.register_for_events(
+        MacSettingsEvents.settings_changed, events.append
+    )
+    with test_settings.transaction():
+        test_settings["servers"] = []
+    assert events[-1].event_info["added"] == {}
+    assert events[-1].event_info["changed"] == {
+        ("servers",): (settings_dict["servers"], [])
+    }
+    changed_dict = dict(settings_dict, servers=[], fake_load="Changed")
+    assert test_settings.get_all_settings() == dict(
+        changed_dict, fake_load="True Dat"
+    )
+    with open(test_settings.settings_file_path, "w") as settings_file:
+        yaml.safe_dump(changed_dict, settings_file)
+    test_settings.reload_settings_from_file()
+    assert events[-1].event_info["changed"] == {
+        ("fake_load",): ("True Dat", "Changed")
+    }
+    parsed.clear()
+    test_settings.load_settings()
+    assert test_settings["fake_load"] == "Changed"
+    assert len(parsed) == 2
+
+
+def test_29_history_and_rollback(test_settings):
+    """
+    Test a bad edit picked up from the file can be rolled back, and the
+    versions kept share what didn't change.
+    """
+    first_version = test_settings.version
+    test_settings["fake_load"] = "Not Dat"
+    assert test_settings.version == first_version + 1
+    bad_dict = dict(settings_dict, something={"else": None})
+    with open(test_settings.settings_file_path, "w") as settings_file:
+        yaml.safe_dump(bad_dict, settings_file)
+    test_settings.reload_settings_from_file()
+    assert test_settings["something", "else"] is None
+    history = test_settings.history(measure_memory=True)
+    assert [version["version"] for version in history] == [
+        first_version + 1,
+        first_version,
+    ]
+    assert history[0]["settings"]["fake_load"] == "Not Dat"
+    # Only the section that changed is held by the previous version.
+    assert (
+        history[0]["settings"]["servers"]
+        is test_settings.get_all_settings()["servers"]
+    )
+    assert 0 < history[0]["retained_bytes"] < 2000
+    events = []
+    test_settings.register_for_events(
+        MacSettingsEvents.settings_changed, events.append
+    )
+    test_settings.rollback()
+    assert test_settings["something", "deeper", "level"] == 3
+    assert ("something", "deeper") in events[-1].event_info["added"]
+    with open(test_settings.settings_file_path) as settings_file:
+        assert yaml.safe_load(settings_file)["something"]["else"] == "here"
+    assert len(test_settings.history()) == 3
+    test_settings.rollback(3)
+    assert test_settings["fake_load"] == "True Dat"
+    with pytest.raises(MacSettingsException):
+        test_settings.rollback(10)
+
+
+def test_30_get_and_set_many(test_settings, monkeypatch):
+    """
+    Test get and get_many return defaults for missing settings without
+    raising, and set_many makes every change with one write and event.
+    """
+    assert test_settings.get(("something", "deeper", "level")) == 3
+    assert test_settings.get("something.else") == "here"
+    assert test_settings.get(("servers", 1, "host")) == "beta"
+    assert test_settings.get(("servers", 5, "host"), "none") == "none"
+    assert test_settings.get(("something", "missing"), 7) == 7
+    assert test_settings.get(("fake_load", "deeper")) is None
+    assert test_settings.get_many(
+        [("something", "else"), "fake_load", ("missing",)], default=0
+    ) == ["here", "True Dat", 0]
+    events = []
+    test_settings.register_for_events(
+        MacSettingsEvents.settings_changed, events.append
+    )
+    saves = []
+    save_settings = test_settings.save_settings
+    monkeypatch.setattr(
+        test_settings,
+        "save_settings",
+        lambda: saves.append(1) or save_settings(),
+    )
+    test_settings.set_many(
+        {
+            ("something", "new"): {},
+            ("something", "new", "value"): 1,
+            "fake_load": "Not Dat",
+        }
+    )
+    assert len(saves) == 1 and len(events) == 1
+    assert events[0].event_info["settings_changed"][("fake_load",)] == (
+        "Not Dat"
+    )
+    assert test_settings["something", "new", "value"] == 1
+    with pytest.raises(KeyError):
+        test_settings.set_many({"fake_load": 1, ("missing", "value"): 2})
+    assert test_settings["fake_load"] == "Not Dat"
+
+
+def test_31_stats(tmp_path, monkeypatch):
+    """
+    Test collecting stats times loading and changing the settings, can
+    post the timings as events, and is off by default.
+    """
+    settings = create_settings(tmp_path, monkeypatch, collect_stats=True)
+    settings["fake_load"] = "timed"
+    settings.reload_settings_from_file()
+    stats = settings.stats()
+    for name in ("read", "parse", "merge", "diff", "dispatch", "lock_wait"):
+        timing = stats["timings"][name]
+        assert timing["count"] >= 1
+        assert timing["max_ms"] >= timing["mean_ms"] >= 0
+        assert sum(timing["histogram_us"].values()) == timing["count"]
+    assert stats["counters"]["reloads_skipped"] == 1
+    timings = []
+    settings.register_for_events(
+        MacSettingsEvents.settings_timing, timings.append
+    )
+    settings.enable_stats(events=True)
+    settings["fake_load"] = "posted"
+    names = {event.event_info["name"] for event in timings}
+    assert {"lock_wait", "merge", "diff", "dispatch"} <= names
+    settings.disable_stats()
+    settings["fake_load"] = "untimed"
+    assert settings.stats() == {"timings": {}, "counters": {}}
+    settings.close()
+    MacSettings.clear()
+    settings_stats = MacSettingsStats()
+    settings_stats.record("read", 0.001)
+    settings_stats.count("reloads_skipped")
+    settings_stats.reset()
+    assert settings_stats.snapshot() == {"timings": {}, "counters": {}}
+
+
+def test_32_derive(test_settings):
+    """
+    Test a derived value is built once, and rebuilt only after a change
+    touches its setting.
+    """
+    builds = []
+
+    @test_settings.derive("something.deeper")
+    def level_name(deeper):
+        builds.append(deeper)
+        return f"level {deeper['level']}"
+
+    upper = test_settings.derive(("fake_load",), str.upper)
+    assert builds == []
+    assert level_name() == level_name() == "level 3"
+    assert upper() == "TRUE DAT"
+    test_settings["something", "else"] = "there"
+    test_settings["fake_load"] = "Not Dat"
+    assert level_name() == "level 3" and len(builds) == 1
+    assert upper() == "NOT DAT"
+    test_settings["something", "deeper", "level"] = 4
+    assert level_name() == level_name() == "level 4"
+    assert len(builds) == 2
+    # A full load doesn't say what changed, so the setting is compared.
+    test_settings.load_settings()
+    assert level_name() == "level 4" and len(builds) == 2
+    level_name.close()
+    test_settings["something", "deeper", "level"] = 5
+    assert level_name() == "level 5" and len(builds) == 3
+
+
+def test_33_concurrent_writes(tmp_path, monkeypatch):
+    """
+    Test two writers of the same settings file apply their changes on top
+    of each other's saves, instead of the last save winning.
+    """
+    first = create_settings(tmp_path, monkeypatch, concurrent_writes=True)
+    second = MacSettingsStore(
+        app_name=app_name,
+        default_settings_path=first.default_settings_path,
+        settings_file_path=first.settings_file_path,
+        watch=False,
+        concurrent_writes=True,
+        collect_stats=True,
+    )
+    second.load_settings()
+    events = []
+    second.register_for_events(
+        MacSettingsEvents.settings_changed, events.append
+    )
+    first["something", "else"] = "first"
+    first["something", "deeper"] = {"level": 4, "name": "first"}
+    second["fake_load"] = "second"
+    assert second["something", "deeper", "level"] == 4
+    assert second.stats()["counters"]["saves_rebased"] == 1
+    # The other process's changes are posted as they're picked up.
+    assert [event.event_info["changed"] for event in events] == [
+        {
+            ("something", "else"): ("here", "first"),
+            ("something", "deeper", "level"): (3, 4),
+        },
+        {("fake_load",): ("True Dat", "second")},
+    ]
+    first.reload_settings_from_file()
+    for settings in (first, second):
+        assert settings["fake_load"] == "second"
+        assert settings["something", "else"] == "first"
+    with open(first.settings_file_path) as settings_file:
+        saved = yaml.safe_load(settings_file)
+    assert saved["something"]["deeper"]["name"] == "first"
+    assert saved["fake_load"] == "second"
+    # Settings removed by us are removed, and settings that no longer fit
+    # replace their nearest parent that does.
+    assert apply_changed_paths(
+        {"a": 1, "b": {"c": 2}, "d": "text"},
+        {"b": {}, "d": {"e": 3}},
+        [("a",), ("b", "c"), ("d", "e"), ("f", "g")],
+    ) == {"b": {}, "d": {"e": 3}}
+    second.close()
+    first.close()
+    MacSettings.clear()
+
+
+def test_34_fragments(tmp_path, monkeypatch):
+    """
+    Test fragments are merged over the user's settings in name order,
+    and a change to one only parses that fragment again.
+    """
+    fragments_dir = tmp_path / "conf.d"
+    fragments_dir.mkdir()
+    (fragments_dir / "10-team.yaml").write_text(
+        yaml.safe_dump({"something": {"else": "team", "team": 1}})
+    )
+    (fragments_dir / "20-other.json").write_text(
+        '{"something": {"team": 2}, "other": true}'
+    )
+    (fragments_dir / "20-other.json~").write_text("not settings")
+    settings = create_settings(
+        tmp_path, monkeypatch, fragments_dir=str(fragments_dir)
+    )
+    assert settings["something", "else"] == "team"
+    assert settings["something", "team"] == 2
+    assert settings["something", "deeper", "level"] == 3
+    assert settings["other"] is True
+    events = []
+    settings.register_for_events(
+        MacSettingsEvents.settings_changed, events.append
+    )
+    settings.enable_stats()
+    team_fragment = fragments_dir / "10-team.yaml"
+    team_fragment.write_text(
+        yaml.safe_dump({"something": {"else": "changed", "team": 1}})
+    )
+    settings.reload_settings_from_file(
+        SimpleNamespace(event_info={"paths": [str(team_fragment)]})
+    )
+    assert settings["something", "else"] == "changed"
+    assert settings.stats()["timings"]["parse"]["count"] == 1
+    assert events[-1].event_info["changed"] == {
+        ("something", "else"): ("team", "changed")
+    }
+    (fragments_dir / "30-new.yaml").write_text("something: {team: 3}\n")
+    (fragments_dir / "20-other.json").unlink()
+    settings.reload_fragments()
+    assert settings["something", "team"] == 3
+    assert "other" not in settings
+    assert settings.stats()["timings"]["parse"]["count"] == 2
+    assert settings.get_layer_settings("fragments") == {
+        "something": {"else": "changed", "team": 3}
+    }
+    settings.close()
+    MacSettings.clear()
+
+
+def test_35_concurrent_writes_after_rollback(tmp_path, monkeypatch):
+    """
+    Test settings changed in a transaction that was undone aren't written
+    over another process's save.
+    """
+    first = create_settings(tmp_path, monkeypatch, concurrent_writes=True)
+    second = MacSettingsStore(
+        app_name=app_name,
+        default_settings_path=first.default_settings_path,
+        settings_file_path=first.settings_file_path,
+        watch=False,
+        concurrent_writes=True,
+    )
+    second.load_settings()
+    with pytest.raises(RuntimeError):
+        with first.transaction():
+            first["fake_load"] = "undone"
+            raise RuntimeError("undo")
+    second["fake_load"] = "second"
+    first["something", "else"] = "first"
+    assert first["fake_load"] == "second"
+    with open(first.settings_file_path) as settings_file:
+        saved = yaml.safe_load(settings_file)
+    assert saved["fake_load"] == "second"
+    assert saved["something"]["else"] == "first"
+    second.close()
+    first.close()
+    MacSettings.clear()
+
+
+def test_36_reload_keeps_write_behind_changes(tmp_path, monkeypatch):
+    """
+    Test a reload while a change waits to be written keeps the change,
+    and the change is still written.
+    """
+    settings = create_settings(tmp_path, monkeypatch, write_behind_ms=60000)
+    settings["something", "else"] = "written"
+    deadline = time.monotonic() + 5
+    while (
+        not settings.write_behind_stats()["writes_flushed"]
+        and time.monotonic() < deadline
+    ):
+        time.sleep(0.01)
+    settings["fake_load"] = "pending"
+    with open(settings.settings_file_path) as settings_file:
+        saved = yaml.safe_load(settings_file)
+    saved["something"]["deeper"]["level"] = 4
+    with open(settings.settings_file_path, "w") as settings_file:
+        yaml.safe_dump(saved, settings_file)
+    settings.reload_settings_from_file()
+    assert settings["fake_load"] == "pending"
+    assert settings["something", "deeper", "level"] == 4
+    settings.close()
+    with open(settings.settings_file_path) as settings_file:
+        saved = yaml.safe_load(settings_file)
+    assert saved["fake_load"] == "pending"
+    assert saved["something"]["deeper"]["level"] == 4
+    MacSettings.clear()
+
+
+def test_37_timing_events_from_subscribers(tmp_path, monkeypatch):
+    """
+    Test timing events are only posted once the settings have finished
+    posting events, so subscribers can use the settings.
+    """
+    settings = create_settings(tmp_path, monkeypatch, lazy_load=True)
+    settings.enable_stats(events=True)
+    timings = []
+    settings.register_for_events(
+        MacSettingsEvents.settings_timing, timings.append
+    )
+    settings.register_for_events(
+        MacSettingsEvents.settings_loaded,
+        lambda event: settings.get_all_settings(),
+    )
+    loader = threading.Thread(target=settings.load_settings, daemon=True)
+    loader.start()
+    loader.join(timeout=10)
+    assert not loader.is_alive()
+    names = {event.event_info["name"] for event in timings}
+    assert {"read", "merge", "dispatch", "lock_wait"} <= names
+    settings.close()
+    MacSettings.clear()
+
+
+def test_38_derive_all_settings(test_settings):
+    """
+    Test a value derived from all the settings, and a caller waiting for
+    the value while another caller builds it.
+    """
+    builds = []
+
+    def count_keys(settings):
+        builds.append(settings)
+        return len(settings)
+
+    key_count = test_settings.derive((), count_keys)
+    derived_lock = key_count._MacSettingsDerived__lock
+    with derived_lock:
+        waiting = threading.Thread(target=key_count, daemon=True)
+        waiting.start()
+        # Give the thread time to find no value and wait for the lock,
+        # then build the value as another caller would.
+        time.sleep(0.1)
+        key_count._MacSettingsDerived__cached = (
+            test_settings.version,
+            test_settings.get_all_settings(),
+            "built",
+        )
+    waiting.join(timeout=10)
+    assert not waiting.is_alive()
+    assert builds == []
+    key_count.invalidate()
+    assert key_count() == len(test_settings.get_all_settings())
+    assert len(builds) == 1
+    key_count.close()
+
+
+def test_39_derive_in_transactions(test_settings):
+    """
+    Test a derived value follows the changes made in a transaction, and
+    goes back to the old value when the transaction is undone.
+    """
+    squared = test_settings.derive(
+        ("something", "deeper", "level"), lambda level: level * level
+    )
+    assert squared() == 9
+    with test_settings.transaction():
+        test_settings["something", "deeper", "level"] = 7
+        assert squared() == 49
+    assert squared() == 49
+    with pytest.raises(ValueError):
+        with test_settings.transaction():
+            test_settings["something", "deeper", "level"] = 5
+            assert squared() == 25
+            raise ValueError("Undo the transaction")
+    assert test_settings["something", "deeper", "level"] == 7
+    assert squared() == 49
+    # The version isn't reused after the undo.
+    test_settings["something", "deeper", "level"] = 5
+    assert squared() == 25
+    squared.close()
+
+
+def test_40_dotted_writes(test_settings):
+    """
+    Test a dotted string finds the same setting when it's written as when
+    it's read.
+    """
+    assert test_settings["something.deeper.level"] == 3
+    test_settings["something.deeper.level"] = 99
+    assert test_settings["something", "deeper", "level"] == 99
+    assert test_settings["something.deeper.level"] == 99
+    assert "something.deeper.level" not in test_settings.get_all_settings()
+    test_settings.set_many({"something.else": "there"})
+    assert test_settings["something", "else"] == "there"
+    test_settings.set_override("something.deeper.level", 5)
+    assert test_settings["something.deeper.level"] == 5
+    test_settings.clear_override("something.deeper.level")
+    assert test_settings["something", "deeper", "level"] == 99
+
+
+def test_41_timing_events_wait_for_the_write_lock(tmp_path, monkeypatch):
+    """
+    Test timing events aren't posted while the write lock is held, and
+    the write lock knows which thread holds it.
+    """
+    settings = create_settings(tmp_path, monkeypatch, collect_stats=True)
+    settings.enable_stats(events=True)
+    timings = []
+    settings.register_for_events(
+        MacSettingsEvents.settings_timing, timings.append
+    )
+    with settings.transaction():
+        settings["fake_load"] = "in a transaction"
+        settings._publish_timings()
+        assert timings == []
+    assert timings
+    settings.close()
+    MacSettings.clear()
+    write_lock = MacSettingsWriteLock()
+    held_elsewhere = []
+    with write_lock:
+        with write_lock:
+            assert write_lock.held()
+        assert write_lock.held()
+        other_thread = threading.Thread(
+            target=lambda: held_elsewhere.append(write_lock.held())
+        )
+        other_thread.start()
+        other_thread.join()
+    assert held_elsewhere == [False]
+    assert not write_lock.held()
+
+
+def test_42_rollback_fragments(tmp_path, monkeypatch):
+    """
+    Test rolling back a fragment change isn't undone by reloading the
+    other fragments, and a later change to the fragment is picked up.
+    """
+    fragments_dir = tmp_path / "conf.d"
+    fragments_dir.mkdir()
+    team_fragment = fragments_dir / "10-team.yaml"
+    team_fragment.write_text(yaml.safe_dump({"something": {"else": "team"}}))
+    other_fragment = fragments_dir / "20-other.yaml"
+    other_fragment.write_text(yaml.safe_dump({"other": True}))
+    settings = create_settings(
+        tmp_path, monkeypatch, fragments_dir=str(fragments_dir)
+    )
+    team_fragment.write_text(yaml.safe_dump({"something": {"else": "bad"}}))
+    settings.reload_fragments([str(team_fragment)])
+    assert settings["something", "else"] == "bad"
+    settings.rollback()
+    assert settings["something", "else"] == "team"
+    settings.reload_fragments([str(other_fragment)])
+    assert settings["something", "else"] == "team"
+    with pytest.raises(MacSettingsException):
+        with settings.transaction():
+            team_fragment.write_text(
+                yaml.safe_dump({"something": {"else": "undone"}})
+            )
+            settings.reload_fragments([str(team_fragment)])
+            assert settings["something", "else"] == "undone"
+            raise MacSettingsException("Undo the fragment.")
+    assert settings["something", "else"] == "team"
+    team_fragment.write_text(
+        yaml.safe_dump({"something": {"else": "fixed"}})
+    )
+    settings.reload_fragments()
+    assert settings["something", "else"] == "fixed"
+    settings.close()
+    MacSettings.clear()
+
+
+def test_43_settings_helpers(test_settings):
+    """
+    Test the helpers for diffing, patching and building settings trees
+    with values that aren't settings trees.
+    """
+    assert dict_diff({"a": 1, "b": 2}, {"b": 3, "c": 4}) == {
+        "added": {"c": 4},
+        "removed": {"a": 1},
+        "changed": {"b": (2, 3)},
+    }
+    assert dict_diff_paths(1, 2, ("a",))["changed"] == {("a",): (1, 2)}
+    assert not any(dict_diff_paths([1], [1]).values())
+    assert apply_changed_paths(None, {"a": 1}, [("a",)]) == {"a": 1}
+    assert apply_changed_paths({"a": 1}, {"b": 2}, [()]) == {"b": 2}
+    changes = dict_diff_paths({"a": 1}, [1])
+    assert patch_path_index({("a",): 1}, [1], changes) == {}
+    assert environment_settings(
+        "TEST_APP_", {"TEST_APP_A____B": "x", "TEST_APP_C": "[not yaml"}
+    ) == {"c": "[not yaml"}
+    # Nothing to close once the settings have been garbage collected.
+    _close_at_exit(weakref.ref(MacSettingsWriteLock()))
+    _close_at_exit(weakref.ref(test_settings))
+
+
+def test_44_file_events_and_dispatch(caplog):
+    """
+    Test file created and deleted events are posted unless paused, a
+    failing callback doesn't stop the dispatcher, and unsubscribing
+    something that isn't subscribed does nothing.
+    """
+    events = []
+    test_handler = MacSettingsWatchdogHandler()
+    for event_action in (
+        MacSettingsWatchdogEvents.settings_file_created,
+        MacSettingsWatchdogEvents.settings_file_deleted,
+    ):
+        test_handler.events_publisher.register(
+            event_action=event_action, subscriber_callback=events.append
+        )
+    test_handler.on_created(SimpleNamespace(src_path="a.yaml"))
+    test_handler.on_delete(SimpleNamespace(src_path="a.yaml"))
+    test_handler._pause_observer = True
+    test_handler.on_created(SimpleNamespace(src_path="a.yaml"))
+    test_handler.on_delete(SimpleNamespace(src_path="a.yaml"))
+    assert [event.event_action for event in events] == [
+        MacSettingsWatchdogEvents.settings_file_created,
+        MacSettingsWatchdogEvents.settings_file_deleted,
+    ]
+    dispatcher = MacSettingsDispatcher(debounce_ms=1)
+    dispatched = threading.Event()
+
+    def fail() -> None:
+        raise ValueError("Broken callback")
+
+    dispatcher.schedule(fail)
+    dispatcher.schedule(dispatched.set)
+    assert dispatched.wait(timeout=5)
+    dispatcher.stop()
+    assert "Broken callback" in caplog.text
+    path_router = MacSettingsPathRouter()
+    path_router.unsubscribe(("a",), events.append)
+    path_router.subscribe(("a",), events.append)
+    path_router.unsubscribe(("a",), dispatched.set)
+    assert path_router.route([("a",)]) == {
+        (("a",), events.append): [("a",)]
+    }
+
+
+def test_45_settings_options_and_errors(tmp_path, monkeypatch):
+    """
+    Test the settings options not covered elsewhere, and the errors for
+    missing and broken settings files.
+    """
+    fragments_dir = tmp_path / "conf.d"
+    fragments_dir.mkdir()
+    (fragments_dir / "10-team.yaml").write_text("team: 1\n")
+    settings = create_settings(
+        tmp_path,
+        monkeypatch,
+        lazy_load=["servers"],
+        schema={"fake_load": str},
+        use_cache=True,
+        merge_defaults=True,
+        fragments_dir=str(fragments_dir),
+    )
+    assert settings.lazy_load == frozenset(["servers"])
+    assert settings.typed.fake_load == "True Dat"
+    assert os.path.exists(f"{settings.settings_file_path}.defaults.cache")
+    assert os.path.exists(f"{settings.settings_file_path}.10-team.yaml.cache")
+    assert settings.get_layer_settings("user")["servers"][1]["host"] == "beta"
+    with pytest.raises(MacSettingsException):
+        settings.register_schema({"fake_load": int})
+    settings["fake_load"] = "Still a string"
+    assert settings.typed.fake_load == "Still a string"
+    # An empty defaults file is an empty layer.
+    (tmp_path / "defaults.yaml").write_text("")
+    settings.load_settings()
+    assert settings.get_layer_settings("defaults") == {}
+    assert settings["team"] == 1
+    settings.close()
+    MacSettings.clear()
+    with pytest.raises(MacSettingsException, match="does not exist"):
+        MacSettings(
+            app_name=app_name,
+            default_settings_path=str(tmp_path / "missing.yaml"),
+        )
+    MacSettings.clear()
+    settings = create_settings(tmp_path, monkeypatch, lazy_load=True)
+    with open(settings.settings_file_path, "w") as settings_file:
+        settings_file.write("first: 1\nsecond: a: b\n")
+    settings.load_settings()
+    assert settings["first"] == 1
+    with pytest.raises(MacSettingsException, match="problem parsing"):
+        settings["second"]
+    os.remove(settings.settings_file_path)
+    with pytest.raises(MacSettingsException, match="Unable to read"):
+        settings.load_settings()
+    settings.close()
+    MacSettings.clear()
+
+
+def test_46_fragment_edge_cases(tmp_path, monkeypatch):
+    """
+    Test fragments that vanish, are only touched or aren't watched, and
+    a fragments directory that's empty or missing.
+    """
+    fragments_dir = tmp_path / "conf.d"
+    settings = create_settings(
+        tmp_path, monkeypatch, watch=False, fragments_dir=str(fragments_dir)
+    )
+    assert settings.get_layer_settings("fragments") == {}
+    fragments_dir.mkdir()
+    settings.reload_fragments([str(fragments_dir)])
+    assert settings.get_layer_settings("fragments") == {}
+    team_fragment = fragments_dir / "10-team.yaml"
+    team_fragment.write_text("team: 1\n")
+    settings.reload_fragments()
+    assert settings["team"] == 1
+    version = settings.version
+    settings.reload_fragments()
+    assert settings.version == version
+    # Only touched, so the fragment isn't parsed again.
+    file_stat = os.stat(team_fragment)
+    os.utime(team_fragment, ns=(file_stat.st_atime_ns, 1))
+    settings.enable_stats()
+    settings.reload_fragments([str(team_fragment)])
+    assert "parse" not in settings.stats()["timings"]
+    assert settings.version == version
+    team_fragment.unlink()
+    settings.reload_fragments([str(team_fragment)])
+    assert "team" not in settings
+    settings.close()
+    MacSettings.clear()
+    settings = create_settings(tmp_path, monkeypatch)
+    settings.reload_fragments()
+    assert settings.get_layer_settings("fragments") == {}
+    settings.close()
+    MacSettings.clear()
+
+
+def test_47_lookups_and_errors(tmp_path, monkeypatch):
+    """
+    Test looking up keys that can't be in the settings, lookups and
+    writes that parse lazy sections, and the errors for misusing the
+    settings API.
+    """
+    settings = create_settings(tmp_path, monkeypatch, lazy_load=True)
+    assert settings.get(("servers", 1, "host")) == "beta"
+    assert settings.get_many([("missing",), "missing.key"], "none") == [
+        "none",
+        "none",
+    ]
+    settings.set_many({"something.else": "there"})
+    assert settings.get_layer_settings("user")["something"]["else"] == (
+        "there"
+    )
+    unhashable = ("something", ["else"])
+    assert settings.get(unhashable) is None
+    assert settings.get_many([unhashable]) == [None]
+    assert unhashable not in settings
+    assert settings[1.5] is None
+    settings[1] = "one"
+    assert settings.get(1) == "one"
+    settings.clear_override(("missing", "key"))
+    with settings.transaction():
+        settings.set_many({"fake_load": "in a transaction"})
+        assert settings["fake_load"] == "in a transaction"
+        with pytest.raises(MacSettingsException):
+            settings.rollback()
+
+    def fail(change_event: MacEvent) -> None:
+        raise ValueError("Broken subscriber")
+
+    settings.subscribe("fake_load", fail)
+    with pytest.raises(MacEventException, match="Broken subscriber"):
+        settings["fake_load"] = "Changed"
+    settings.close()
+    # A settings file that can still be split into sections.
+    fresh_path = tmp_path / "fresh"
+    fresh_path.mkdir()
+    settings = create_settings(fresh_path, monkeypatch, lazy_load=True)
+    assert settings.get_layer_settings("user")["servers"][0] == {
+        "host": "alpha"
+    }
+    settings.close()
+    MacSettings.clear()
+
+
+def test_48_asyncio_loop_closed(test_settings):
+    """
+    Test a change is dropped rather than raising when the event loop
+    waiting for it has closed.
+    """
+    event_loop = asyncio.new_event_loop()
+    watcher = test_settings.watch_changes()
+
+    async def start_waiting():
+        asyncio.ensure_future(test_settings.wait_for_change())
+        asyncio.ensure_future(watcher.__anext__())
+        await asyncio.sleep(0)
+
+    event_loop.run_until_complete(start_waiting())
+    event_loop.close()
+    test_settings["fake_load"] = "Nobody waiting"
+    assert test_settings["fake_load"] == "Nobody waiting"
+
+
+def test_49_write_behind_failures(tmp_path, monkeypatch):
+    """
+    Test a failed background write is kept to be written by the next
+    flush, and timings waiting to be posted are posted by a flush.
+    """
+    settings = create_settings(tmp_path, monkeypatch, write_behind_ms=60000)
+    saves = []
+
+    def fail_to_save() -> None:
+        saves.append(settings["fake_load"])
+        raise MacSettingsException("The disk is full.")
+
+    monkeypatch.setattr(settings, "save_settings", fail_to_save)
+    settings["fake_load"] = "unsaved"
+    deadline = time.monotonic() + 5
+    while not saves and time.monotonic() < deadline:
+        time.sleep(0.01)
+    with pytest.raises(MacSettingsException, match="disk is full"):
+        settings.flush()
+    assert saves == ["unsaved", "unsaved"]
+    monkeypatch.undo()
+    settings.enable_stats(events=True)
+    timings = []
+    settings.register_for_events(
+        MacSettingsEvents.settings_timing, timings.append
+    )
+    settings.flush()
+    assert "save" in {event.event_info["name"] for event in timings}
+    with open(settings.settings_file_path) as settings_file:
+        assert yaml.safe_load(settings_file)["fake_load"] == "unsaved"
+    settings.close()
+    MacSettings.clear()
+
+
+def test_50_timings_posted_elsewhere(test_settings):
+    """
+    Test posting timings stops when another thread has already posted
+    the ones that were waiting.
+    """
+
+    class DrainedTimings(collections.deque):
+        def __len__(self) -> int:
+            return 1
+
+    timings = []
+    test_settings.register_for_events(
+        MacSettingsEvents.settings_timing, timings.append
+    )
+    test_settings._MacSettingsStore__pending_timings = DrainedTimings()
+    test_settings._publish_timings()
+    assert timings == []
+
+
+if __name__ == "__main__":  # pragma: no cover
+    pass
@@ -0,0 +1,60 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Name:
+        test_mac_settings_lock.py
+    Desscription:
+        Test the lock file shared by processes writing a settings file.
+    Version:
+        1 - Inital release
+    Author:
+        J.MacGrillen <macgrillen@gmail.com>
+    Copyright:
+        Copyright (c) John MacGrillen. All rights reserved.
+"""
+import pytest
+from maclib.mac_settings_lock import (
+    MacSettingsFileLock,
+    MacSettingsLockException,
+)
+
+
+def test_01_bump_generation(tmp_path):
+    """
+    Test each bump is read back by the next holder of the lock.
+    """
+    lock_path = str(tmp_path / "test_app.yaml.lock")
+    settings_lock = MacSettingsFileLock(lock_path)
+    with settings_lock.locked(exclusive=True):
+        assert settings_lock.generation == 0
+        assert settings_lock.bump() == 1
+    other_lock = MacSettingsFileLock(lock_path)
+    with other_lock.locked():
+        assert other_lock.generation == 1
+
+
+def test_02_lock_errors(tmp_path):
+    """
+    Test a lock file that can't be opened or doesn't hold a generation,
+    and bumping without holding the lock.
+    """
+    settings_lock = MacSettingsFileLock(str(tmp_path / "missing" / "lock"))
+    with pytest.raises(MacSettingsLockException, match="Unable to open"):
+        with settings_lock.locked():
+            pass
+    lock_file = tmp_path / "test_app.yaml.lock"
+    settings_lock = MacSettingsFileLock(str(lock_file))
+    with pytest.raises(MacSettingsLockException, match="must be held"):
+        settings_lock.bump()
+    lock_file.write_text("not a generation\n")
+    with pytest.raises(MacSettingsLockException, match="generation"):
+        with settings_lock.locked():
+            pass
+    # The lock is released, so it can be taken again.
+    lock_file.write_text("7\n")
+    with settings_lock.locked(exclusive=True):
+        assert settings_lock.generation == 7
+
+
+if __name__ == "__main__":  # pragma: no cover
+    pass
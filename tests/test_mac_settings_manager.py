@@ -0,0 +1,192 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Name:
+        test_mac_settings_manager.py
+    Desscription:
+        Test holding many settings stores in one process.
+    Version:
+        1 - Inital release
+    Author:
+        J.MacGrillen <macgrillen@gmail.com>
+    Copyright:
+        Copyright (c) John MacGrillen. All rights reserved.
+"""
+import sys
+import threading
+import time
+import pytest
+import yaml
+from maclib.mac_file_watch import (
+    MacInotifyWatcher,
+    MacPollWatcher,
+    get_file_watcher,
+)
+from maclib.mac_settings import (
+    MacSettings,
+    MacSettingsDispatcher,
+    MacSettingsException,
+)
+from maclib.mac_settings_manager import (
+    MacSettingsManager,
+    MacSettingsManagerException,
+)
+
+
+@pytest.fixture
+def settings_manager(tmp_path):
+    """
+    A manager for settings files in a temporary directory, polled for
+    changes.
+
+    Args:
+        tmp_path (pathlib.Path): The temporary directory for the test.
+    """
+    default_file = tmp_path / "defaults.yaml"
+    default_file.write_text(yaml.safe_dump({"pool": {"size": 1}}))
+    file_watcher = MacPollWatcher(interval_ms=10)
+    settings_manager = MacSettingsManager(
+        settings_directory=str(tmp_path / "tenants"),
+        default_settings_path=str(default_file),
+        watch=file_watcher,
+        reload_debounce_ms=10,
+    )
+    yield settings_manager
+    settings_manager.close_all()
+    file_watcher.stop()
+
+
+def test_01_independent_stores(settings_manager):
+    """
+    Test each name gets its own settings file and store.
+    """
+    tenant_a = settings_manager.open("tenant_a")
+    tenant_b = settings_manager.open("tenant_b")
+    assert tenant_a is not tenant_b
+    assert settings_manager.open("tenant_a") is tenant_a
+    assert settings_manager["tenant_b"] is tenant_b
+    tenant_a["pool", "size"] = 5
+    assert tenant_b["pool", "size"] == 1
+    assert tenant_a.settings_file_path.endswith("tenants/tenant_a.yaml")
+    assert not isinstance(tenant_a, MacSettings)
+    assert sorted(settings_manager) == ["tenant_a", "tenant_b"]
+    assert len(settings_manager) == 2
+    settings_manager.close("tenant_a")
+    assert "tenant_a" not in settings_manager
+    with pytest.raises(MacSettingsManagerException):
+        settings_manager["tenant_a"]
+
+
+def test_02_shared_reload_thread(settings_manager):
+    """
+    Test file changes for many stores are reloaded from one thread.
+    """
+    settings_stores = [
+        settings_manager.open(f"tenant_{number}") for number in range(20)
+    ]
+    for number, settings_store in enumerate(settings_stores[:3]):
+        with open(settings_store.settings_file_path, "w") as settings_file:
+            yaml.safe_dump({"pool": {"size": 10 + number}}, settings_file)
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        if [store["pool", "size"] for store in settings_stores[:3]] == [
+            10,
+            11,
+            12,
+        ]:
+            break
+        time.sleep(0.01)
+    assert [store["pool", "size"] for store in settings_stores[:3]] == [
+        10,
+        11,
+        12,
+    ]
+    dispatch_threads = [
+        thread
+        for thread in threading.enumerate()
+        if thread.name == "MacSettingsDispatcher"
+    ]
+    assert len(dispatch_threads) == 1
+
+
+def test_03_dispatcher_coalesces():
+    """
+    Test a callback scheduled many times runs once the burst is over, and
+    a cancelled callback doesn't run.
+    """
+    calls = []
+
+    def coalesced():
+        calls.append("coalesced")
+
+    def cancelled():
+        calls.append("cancelled")
+
+    dispatcher = MacSettingsDispatcher(debounce_ms=20)
+    for _ in range(5):
+        dispatcher.schedule(coalesced)
+        dispatcher.schedule(cancelled)
+    dispatcher.cancel(cancelled)
+    deadline = time.monotonic() + 5
+    while not calls and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    assert calls == ["coalesced"]
+    dispatcher.stop()
+
+
+def test_04_storage_extension(settings_manager):
+    """
+    Test the settings file takes the extension of the store's storage
+    backend.
+    """
+    json_tenant = settings_manager.open("json_tenant", storage="json")
+    assert json_tenant.settings_file_path.endswith("json_tenant.json")
+    json_tenant["pool", "size"] = 2
+    sqlite_tenant = settings_manager.open("sqlite_tenant", storage="sqlite")
+    assert sqlite_tenant.settings_file_path.endswith("sqlite_tenant.db")
+    assert sqlite_tenant["pool", "size"] == 1
+
+
+def test_05_open_errors(tmp_path):
+    """
+    Test opening a store without default settings, or with a settings
+    file that can't be loaded, fails without leaving the store open.
+    """
+    settings_manager = MacSettingsManager(
+        settings_directory=str(tmp_path), watch=False
+    )
+    with pytest.raises(MacSettingsManagerException):
+        settings_manager.open("tenant_a")
+    (tmp_path / "tenant_a.yaml").write_text("pool: [1,\n")
+    with pytest.raises(MacSettingsException):
+        settings_manager.open(
+            "tenant_a", default_settings_path=str(tmp_path / "tenant_a.yaml")
+        )
+    assert "tenant_a" not in settings_manager
+    settings_manager.close("tenant_a")
+    settings_manager.close_all()
+
+
+def test_06_shared_watcher(tmp_path):
+    """
+    Test the file watcher is picked for the platform, or by name.
+    """
+    settings_manager = MacSettingsManager(settings_directory=str(tmp_path))
+    if sys.platform.startswith("linux"):
+        expected = MacInotifyWatcher
+    else:  # pragma: no cover
+        expected = MacPollWatcher
+    assert isinstance(
+        settings_manager._MacSettingsManager__file_watcher, expected
+    )
+    settings_manager.close_all()
+    settings_manager = MacSettingsManager(watch="poll")
+    assert settings_manager._MacSettingsManager__file_watcher is (
+        get_file_watcher("poll")
+    )
+    settings_manager.close_all()
+
+
+if __name__ == "__main__":  # pragma: no cover
+    pass
@@ -0,0 +1,222 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Name:
+        test_mac_shared_settings.py
+    Desscription:
+        Test sharing settings between processes through shared memory.
+    Version:
+        1 - Inital release
+    Author:
+        J.MacGrillen <macgrillen@gmail.com>
+    Copyright:
+        Copyright (c) John MacGrillen. All rights reserved.
+"""
+import datetime
+import mmap
+import multiprocessing
+import threading
+import pytest
+import yaml
+from maclib.mac_settings import MacSettingsStore
+from maclib.mac_shared_settings import (
+    SHARED_HEADER,
+    SHARED_MAGIC,
+    MacSharedSettingsException,
+    MacSharedSettingsPublisher,
+    MacSharedSettingsReader,
+)
+
+
+DEFAULT_PAGE = mmap.PAGESIZE
+
+settings_dict = {
+    "fake_load": "True Dat",
+    "something": {"else": "here", "deeper": {"level": 3}},
+}
+
+
+@pytest.fixture
+def settings_store(tmp_path):
+    """
+    A loaded settings store that isn't watched.
+    """
+    default_file = tmp_path / "defaults.yaml"
+    default_file.write_text(yaml.safe_dump(settings_dict))
+    settings_store = MacSettingsStore(
+        app_name="test_app",
+        default_settings_path=str(default_file),
+        settings_file_path=str(tmp_path / "test_app.yaml"),
+        watch=False,
+    )
+    settings_store.load_settings()
+    yield settings_store
+    settings_store.close()
+
+
+def read_in_worker(shared_path: str, key_path: tuple, results) -> None:
+    """
+    Read a shared setting from another process.
+    """
+    results.put(MacSharedSettingsReader(shared_path)[key_path])
+
+
+def test_01_publish_and_read(settings_store):
+    """
+    A reader sees the settings published, and each change as a new
+    generation.
+    """
+    publisher = MacSharedSettingsPublisher(settings_store)
+    reader = MacSharedSettingsReader(publisher.shared_path)
+    assert reader.generation == publisher.generation == 2
+    assert reader["something", "deeper", "level"] == 3
+    assert reader["something.else"] == "here"
+    assert ("something", "missing") not in reader
+    assert "fake_load" in reader
+    first_settings = reader.get_all_settings()
+    # Nothing is deserialised again until there's a new generation.
+    assert reader.get_all_settings() is first_settings
+    settings_store["something", "else"] = "there"
+    assert reader.generation == 4
+    assert reader["something", "else"] == "there"
+    with pytest.raises(MacSharedSettingsException):
+        reader["something", "missing"]
+    with pytest.raises(MacSharedSettingsException):
+        reader["fake_load"] = "Not Dat"
+    publisher.close()
+    settings_store["something", "else"] = "elsewhere"
+    assert reader["something", "else"] == "there"
+    reader.close()
+
+
+def test_02_read_from_another_process(settings_store):
+    """
+    A worker process reads the owner's settings without loading the file.
+    """
+    publisher = MacSharedSettingsPublisher(settings_store)
+    settings_store["something", "deeper", "level"] = 4
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    key_path = ("something", "deeper", "level")
+    worker = context.Process(
+        target=read_in_worker,
+        args=(publisher.shared_path, key_path, results),
+    )
+    worker.start()
+    assert results.get(timeout=30) == 4
+    worker.join(timeout=30)
+    publisher.close()
+
+
+def test_03_values_marshal_cannot_store(settings_store, tmp_path):
+    """
+    Settings marshal can't store are shared as YAML, and a new owner
+    carries on the generations.
+    """
+    settings_store["something", "when"] = datetime.date(2024, 1, 2)
+    shared_path = str(tmp_path / "settings.shm")
+    publisher = MacSharedSettingsPublisher(settings_store, shared_path)
+    reader = MacSharedSettingsReader(shared_path)
+    assert reader["something", "when"] == datetime.date(2024, 1, 2)
+    publisher.close()
+    publisher = MacSharedSettingsPublisher(settings_store, shared_path)
+    assert publisher.generation == 4
+    publisher.close()
+    with pytest.raises(MacSharedSettingsException):
+        MacSharedSettingsReader(str(tmp_path / "missing.shm"))
+    with pytest.raises(MacSharedSettingsException):
+        MacSharedSettingsReader(settings_store.settings_file_path)
+
+
+def test_04_wait_for_first_publish(settings_store, tmp_path, monkeypatch):
+    """
+    Test a reader waits for the first publish to complete, and gives up
+    if it never does.
+    """
+    shared_path = str(tmp_path / "settings.shm")
+    monkeypatch.setattr(
+        MacSharedSettingsPublisher, "_publish", lambda *args: None
+    )
+    publisher = MacSharedSettingsPublisher(settings_store, shared_path)
+    monkeypatch.undo()
+    reader = MacSharedSettingsReader(shared_path)
+    assert reader.generation == 1
+    with pytest.raises(MacSharedSettingsException, match="Timed out"):
+        reader.get_all_settings()
+    publish_later = threading.Timer(
+        0.05, publisher.publish_settings
+    )
+    publish_later.start()
+    assert reader["fake_load"] == "True Dat"
+    publish_later.join()
+    # Another thread has already picked up the generation.
+    reader._refresh()
+    assert reader.generation == 2
+    reader.close()
+    publisher.close()
+    publisher.publish_settings()
+
+
+def test_05_reader_lookups_and_errors(settings_store, tmp_path):
+    """
+    Test looking settings up by each kind of key, and the errors for
+    settings that are too big or were never published.
+    """
+    publisher = MacSharedSettingsPublisher(settings_store)
+    reader = MacSharedSettingsReader(publisher.shared_path)
+    assert ("something", "else") in reader
+    assert "something.deeper.level" in reader
+    assert 1 not in reader
+    assert () not in reader
+    with pytest.raises(MacSharedSettingsException):
+        reader[1]
+    reader.close()
+    publisher.close()
+    settings_store["big"] = "x" * 2 * DEFAULT_PAGE
+    with pytest.raises(MacSharedSettingsException, match="won't fit"):
+        MacSharedSettingsPublisher(
+            settings_store, str(tmp_path / "big.shm"), capacity=1
+        )
+    # A header written before the first publish was made odd.
+    empty_path = tmp_path / "empty.shm"
+    empty_path.write_bytes(
+        SHARED_HEADER.pack(SHARED_MAGIC, 0, 0, 0).ljust(DEFAULT_PAGE, b"\0")
+    )
+    reader = MacSharedSettingsReader(str(empty_path))
+    with pytest.raises(MacSharedSettingsException, match="No settings"):
+        reader.get_all_settings()
+    reader.close()
+
+
+def test_06_publish_once_per_change(settings_store, tmp_path, caplog):
+    """
+    Test settings are published once for each change, and settings too
+    big to publish are logged without failing the write.
+    """
+    publisher = MacSharedSettingsPublisher(
+        settings_store, str(tmp_path / "settings.shm"), capacity=DEFAULT_PAGE
+    )
+    reader = MacSharedSettingsReader(publisher.shared_path)
+    assert publisher.generation == 2
+    publisher.publish_settings()
+    assert publisher.generation == 2
+    # A reload posts settings_loaded and settings_changed.
+    with open(settings_store.settings_file_path, "w") as settings_file:
+        yaml.safe_dump({"fake_load": "Reloaded"}, settings_file)
+    settings_store.reload_settings_from_file()
+    assert publisher.generation == 4
+    assert reader["fake_load"] == "Reloaded"
+    settings_store["fake_load"] = "Changed"
+    assert publisher.generation == 6
+    settings_store["big"] = "x" * 2 * DEFAULT_PAGE
+    assert settings_store["big"] == "x" * 2 * DEFAULT_PAGE
+    assert publisher.generation == 6
+    assert "won't fit" in caplog.text
+    assert reader["fake_load"] == "Changed"
+    assert "big" not in reader
+    reader.close()
+    publisher.close()
+
+
+if __name__ == "__main__":  # pragma: no cover
+    pass
@@ -0,0 +1,286 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    Name:
+        test_mac_storage.py
+    Desscription:
+        Test the settings storage backends.
+    Version:
+        1 - Inital release
+    Author:
+        J.MacGrillen <macgrillen@gmail.com>
+    Copyright:
+        Copyright (c) John MacGrillen. All rights reserved.
+"""
+import json
+import sqlite3
+import pytest
+import yaml
+from maclib.mac_settings import MacSettingsException, MacSettingsStore
+from maclib.mac_storage import (
+    MacJsonStorage,
+    MacSettingsStorage,
+    MacSqliteStorage,
+    MacStorageException,
+    MacTomlStorage,
+    MacYamlStorage,
+    get_settings_storage,
+    storage_for_path,
+)
+
+
+settings_dict = {
+    "fake_load": "True Dat",
+    "something": {"else": "here", "deeper": {"level": 3}},
+    "servers": [{"host": "alpha"}, {"host": "beta"}],
+}
+
+
+def create_store(tmp_path, extension: str, **store_args) -> MacSettingsStore:
+    """
+    Create a loaded settings store with YAML defaults and a settings file
+    with the given extension.
+
+    Args:
+        tmp_path (pathlib.Path): The temporary directory for the test.
+        extension (str): The extension of the settings file.
+        store_args (dict): Any extra MacSettingsStore arguments.
+    """
+    default_file = tmp_path / "defaults.yaml"
+    default_file.write_text(yaml.safe_dump(settings_dict))
+    settings_store = MacSettingsStore(
+        app_name="test_app",
+        default_settings_path=str(default_file),
+        settings_file_path=str(tmp_path / f"test_app.{extension}"),
+        watch=False,
+        **store_args,
+    )
+    settings_store.load_settings()
+    return settings_store
+
+
+def test_01_backend_lookup():
+    """
+    Test backends are found by name and by file extension.
+    """
+    assert isinstance(get_settings_storage(), MacYamlStorage)
+    assert isinstance(get_settings_storage("JSON"), MacJsonStorage)
+    assert isinstance(storage_for_path("a/b.sqlite3"), MacSqliteStorage)
+    assert isinstance(storage_for_path("a/b.conf"), MacYamlStorage)
+    with pytest.raises(MacStorageException):
+        get_settings_storage("xml")
+
+
+def test_02_json_storage(tmp_path):
+    """
+    Test the YAML defaults are converted to JSON and changes saved as JSON.
+    """
+    settings_store = create_store(tmp_path, "json", storage="json")
+    assert settings_store.get_all_settings() == settings_dict
+    settings_store["something", "deeper", "level"] = 4
+    with open(settings_store.settings_file_path) as settings_file:
+        saved = json.load(settings_file)
+    assert saved["something"]["deeper"]["level"] == 4
+    assert saved["servers"] == settings_dict["servers"]
+
+
+def test_03_toml_is_read_only(tmp_path):
+    """
+    Test TOML settings can be read but not saved.
+    """
+    (tmp_path / "test_app.toml").write_text(
+        'fake_load = "toml"\n[something.deeper]\nlevel = 5\n'
+    )
+    settings_store = create_store(tmp_path, "toml", storage="toml")
+    assert settings_store["something", "deeper", "level"] == 5
+    with pytest.raises(MacSettingsException):
+        settings_store["fake_load"] = "changed"
+
+
+def test_04_sqlite_saves_changed_keys(tmp_path):
+    """
+    Test the SQLite backend only writes the settings that changed.
+    """
+    settings_store = create_store(tmp_path, "db", storage="sqlite")
+    assert settings_store.get_all_settings() == settings_dict
+    connection = sqlite3.connect(settings_store.settings_file_path)
+    # Change a setting behind the store's back. As the store only writes
+    # what it changes, this survives the store's next save.
+    with connection:
+        connection.execute(
+            "UPDATE settings SET value = ? WHERE key_path = ?",
+            ('"outside"', '["fake_load"]'),
+        )
+    settings_store["something", "deeper"] = {"level": 4, "new": [1]}
+    rows = dict(
+        connection.execute("SELECT key_path, value FROM settings").fetchall()
+    )
+    assert rows['["fake_load"]'] == '"outside"'
+    assert rows['["something", "deeper", "level"]'] == "4"
+    assert rows['["something", "deeper", "new"]'] == "[1]"
+    settings_store["something", "deeper"] = 1
+    assert settings_store.storage.parse(
+        b"", settings_store.settings_file_path
+    )["something"] == {"else": "here", "deeper": 1}
+    connection.close()
+
+
+def test_05_sqlite_reload(tmp_path):
+    """
+    Test a reload is skipped for our own writes and picks up others.
+    """
+    settings_store = create_store(tmp_path, "db", storage="sqlite")
+    settings_store["fake_load"] = "ours"
+    settings_store.reload_settings_from_file()
+    assert settings_store["fake_load"] == "ours"
+    other_storage = MacSqliteStorage()
+    other_storage.write_changes(
+        settings_store.settings_file_path,
+        {"fake_load": "theirs"},
+        [("fake_load",)],
+    )
+    other_storage.close()
+    settings_store.reload_settings_from_file()
+    assert settings_store["fake_load"] == "theirs"
+    assert settings_store["something", "else"] == "here"
+    settings_store.close()
+
+
+def test_06_split_yaml_sections():
+    """
+    Test YAML is split into sections that parse on their own, and isn't
+    split when the sections could depend on each other.
+    """
+    yaml_storage = MacYamlStorage()
+    document = yaml.safe_dump({**settings_dict, True: 1}).encode("utf8")
+    head, sections = yaml_storage.split_sections(document)
+    assert sorted(sections) == ["fake_load", "servers", "something"]
+    assert yaml.safe_load(head) == {True: 1}
+    for key, section_document in sections.items():
+        assert yaml_storage.parse_section(
+            key, section_document, "test.yaml"
+        ) == settings_dict[key]
+    head, sections = yaml_storage.split_sections(document, ["servers"])
+    assert list(sections) == ["servers"]
+    assert yaml_storage.split_sections(b"a: &x 1\nb: *x\n") is None
+    assert yaml_storage.split_sections(b"{a: 1}\n") is None
+    assert yaml_storage.split_sections(b"two words: 1\nb: 2\n") is None
+    # A flow mapping carried on in the first column is parsed whole.
+    assert yaml_storage.split_sections(b"a: {x: 1,\ny: 2}\nb: 3\n") is None
+    assert yaml_storage.split_sections(b"a: [1,\n2]\nb: 3\n") is None
+    assert yaml_storage.split_sections(b"a: 'x\ny: 2'\nb: 3\n") is None
+    with pytest.raises(MacStorageException):
+        yaml_storage.parse_section("a", b"b: 1\n", "test.yaml")
+
+
+def test_07_sqlite_setting_in_list(tmp_path):
+    """
+    Test changing a setting inside a list rewrites the list's row rather
+    than dropping it.
+    """
+    settings_store = create_store(tmp_path, "db", storage="sqlite")
+    settings_store["servers", 0, "host"] = "gamma"
+    saved = settings_store.storage.parse(
+        b"", settings_store.settings_file_path
+    )
+    assert saved["servers"] == [{"host": "gamma"}, {"host": "beta"}]
+    assert saved["something"] == settings_dict["something"]
+    settings_store.close()
+
+
+def test_08_file_errors(tmp_path):
+    """
+    Test files that can't be read or written are reported, and a backend
+    can't be created without parse.
+    """
+    yaml_storage = MacYamlStorage()
+    with pytest.raises(MacStorageException, match="Unable to read"):
+        yaml_storage.read(str(tmp_path / "missing.yaml"))
+    with pytest.raises(MacStorageException, match="Unable to write"):
+        yaml_storage.write(str(tmp_path), settings_dict)
+    with pytest.raises(TypeError):
+        MacSettingsStorage()
+
+    class TextStorage(MacSettingsStorage):
+        def parse(self, document: bytes, file_path: str):
+            return document.decode("utf8")
+
+    text_storage = TextStorage()
+    assert text_storage.parse(b"a: 1\n", "test") == "a: 1\n"
+    assert text_storage.split_sections(b"a: 1\n") is None
+    assert get_settings_storage(yaml_storage) is yaml_storage
+
+
+def test_09_parse_errors():
+    """
+    Test documents that can't be parsed or settings that can't be
+    written are reported.
+    """
+    with pytest.raises(MacStorageException, match="test.yaml"):
+        MacYamlStorage().parse(b"a: [1,\n", "test.yaml")
+    json_storage = MacJsonStorage()
+    assert json_storage.parse(b" \n", "test.json") is None
+    with pytest.raises(MacStorageException, match="test.json"):
+        json_storage.parse(b"{", "test.json")
+    with pytest.raises(MacStorageException, match="as JSON"):
+        json_storage.dump({"a": object()})
+    toml_storage = MacTomlStorage()
+    with pytest.raises(MacStorageException, match="test.toml"):
+        toml_storage.parse(b"= 1", "test.toml")
+    with pytest.raises(MacStorageException, match="test.toml"):
+        toml_storage.parse(b"a = '\xff'", "test.toml")
+    with pytest.raises(MacStorageException, match="read only"):
+        toml_storage.dump(settings_dict)
+
+
+def test_10_split_yaml_documents():
+    """
+    Test YAML with a document marker is split, but not YAML with more
+    than one document or a repeated key.
+    """
+    yaml_storage = MacYamlStorage()
+    head, sections = yaml_storage.split_sections(b"---\na: 1\n")
+    assert head == b"---\n"
+    assert sections == {"a": b"a: 1\n"}
+    assert yaml_storage.split_sections(b"a: 1\n---\nb: 2\n") is None
+    assert yaml_storage.split_sections(b"a: 1\na: 2\n") is None
+
+
+def test_11_sqlite_errors(tmp_path):
+    """
+    Test SQLite databases that can't be used are reported, and a failed
+    write leaves the database as it was.
+    """
+    sqlite_storage = MacSqliteStorage()
+    with pytest.raises(MacStorageException, match="Unable to read"):
+        sqlite_storage.read(str(tmp_path / "missing" / "test.db"))
+    database = str(tmp_path / "test.db")
+    sqlite_storage.write(database, None)
+    assert sqlite_storage.parse(b"", database) == {}
+    assert sqlite_storage.write_changes(database, None, [("a",)]) is None
+    sqlite_storage.write(database, settings_dict)
+    generation, _ = sqlite_storage.read(database)
+    with pytest.raises(MacStorageException, match="Unable to write"):
+        sqlite_storage.write(database, {"a": object()})
+    assert sqlite_storage.read(database)[0] == generation
+    assert sqlite_storage.parse(generation, database) == settings_dict
+    # A key path that has gone is deleted along with everything under it.
+    sqlite_storage.write_changes(
+        database,
+        {"something": {}},
+        [("something", "deeper", "level")],
+    )
+    assert "deeper" not in sqlite_storage.parse(b"", database)["something"]
+    sqlite_storage.close()
+    with sqlite3.connect(database) as connection:
+        connection.execute(
+            "INSERT INTO settings VALUES (?, ?)", ('["broken"]', "{")
+        )
+    connection.close()
+    with pytest.raises(MacStorageException, match="Unable to read"):
+        sqlite_storage.parse(b"", database)
+    sqlite_storage.close()
+
+
+if __name__ == "__main__":  # pragma: no cover
+    pass